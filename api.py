@@ -1,19 +1,93 @@
+import asyncio
+import json
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Optional
+
 import uvicorn
-from clickclickclick.config import get_config
-from clickclickclick.executor.android import AndroidExecutor
-from clickclickclick.finder.gemini import GeminiFinder
-from clickclickclick.finder.local_ollama import OllamaFinder
-from clickclickclick.finder.openai import OpenAIFinder
-from clickclickclick.planner.gemini import GeminiPlanner
-from clickclickclick.planner.local_ollama import OllamaPlanner
-from clickclickclick.planner.openai import ChatGPTPlanner
+from clickclickclick.cancel import CancellationToken
+from clickclickclick.clients import close_http_clients
+from clickclickclick.config import BaseConfig, get_config
+from clickclickclick.executor.pool import DevicePool
+from clickclickclick.factory import get_executor, get_finder, get_planner
+from clickclickclick.jobs import FAILED, SUCCEEDED, Job, JobQueue, QueueFull
+from clickclickclick.planner.scheduler import TaskScheduler
 from clickclickclick.planner.task import execute_task, execute_with_timeout
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
-from github.clickclickclick.clickclickclick.executor.wind import WindowsExecutor
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    close_http_clients()
+
+
+app = FastAPI(lifespan=lifespan)
+
+PLATFORMS = {"android", "win"}
+PLANNER_MODELS = {"openai", "gemini", "ollama"}
+FINDER_MODELS = {"openai", "gemini", "ollama"}
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> TaskScheduler:
+    """Shared scheduler over all attached android devices, created on first use."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = TaskScheduler(DevicePool())
+        return _scheduler
+
+
+_jobs = None
+_jobs_lock = threading.Lock()
+
+# Windows tasks drive the one desktop, so they run one at a time like a single device
+_windows_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="windows-task")
+_windows_executor = None
+
+# Built once per model combination instead of on every request. Finders are kept per executor,
+# which is safe because a device only ever runs one task at a time.
+_configs = {}
+_finders = weakref.WeakKeyDictionary()
+_cache_lock = threading.Lock()
+
+EVENT_POLL_INTERVAL_IN_SECONDS = 0.5
+# how often submissions look for newly attached devices
+DEVICE_REFRESH_INTERVAL_IN_SECONDS = 5
+
+
+def get_jobs() -> JobQueue:
+    """Registry of the tasks submitted through POST /tasks, created on first use."""
+    global _jobs
+    with _jobs_lock:
+        if _jobs is None:
+            _jobs = JobQueue(
+                BaseConfig.API_MAX_PENDING_TASKS, BaseConfig.API_JOB_RETENTION_IN_SECONDS
+            )
+        return _jobs
+
+
+def get_windows_executor():
+    global _windows_executor
+    with _cache_lock:
+        if _windows_executor is None:
+            _windows_executor = get_executor("win")
+        return _windows_executor
+
+
+def get_cached_config(platform, planner_model, finder_model) -> BaseConfig:
+    key = (platform, planner_model, finder_model)
+    with _cache_lock:
+        if key not in _configs:
+            _configs[key] = get_config(platform, planner_model, finder_model)
+        return _configs[key]
 
 
 class TaskRequest(BaseModel):
@@ -23,49 +97,168 @@ class TaskRequest(BaseModel):
     finder_model: str = "gemini"
 
 
-@app.post("/execute")
-def execute_task_api(request: TaskRequest):
-    task_prompt = request.task_prompt
+def get_cached_finder(request: TaskRequest, c, executor):
+    key = (request.planner_model, request.finder_model)
+    with _cache_lock:
+        finders = _finders.setdefault(executor, {})
+        if key not in finders:
+            finders[key] = get_finder(request.finder_model, c, executor)
+        return finders[key]
+
+
+def finder_summaries(executor) -> dict:
+    """Lookup statistics of the finders kept for an executor, by planner/finder model."""
+    with _cache_lock:
+        finders = dict(_finders.get(executor, {}))
+    return {"/".join(key): finder.summary() for key, finder in finders.items()}
+
+
+def run_task(
+    request: TaskRequest,
+    c,
+    executor,
+    cancel_token: Optional[CancellationToken] = None,
+    on_action=None,
+):
+    # the planner keeps the task's conversation, so every task gets a new one
+    planner = get_planner(request.planner_model, c, executor)
+    finder = get_cached_finder(request, c, executor)
+
+    return execute_with_timeout(
+        execute_task,
+        c.TASK_TIMEOUT_IN_SECONDS,
+        request.task_prompt,
+        executor,
+        planner,
+        finder,
+        c,
+        cancel_token=cancel_token,
+        on_action=on_action,
+    )
+
+
+def validate_request(request: TaskRequest):
     platform = request.platform
     planner_model = request.planner_model
     finder_model = request.finder_model
 
-    c = get_config(platform, planner_model, finder_model)
-
-    if platform == "win":
-        executor = WindowsExecutor()
-    elif platform == "android":
-        executor = AndroidExecutor()
-    else:
+    if platform not in PLATFORMS:
         raise HTTPException(status_code=400, detail=f"Unsupported platform: {platform}")
-
-    if planner_model == "openai":
-        executor.screenshot_as_base64 = True
-        planner = ChatGPTPlanner(c)
-    elif planner_model == "gemini":
-        executor.screenshot_as_tempfile = True
-        planner = GeminiPlanner(c)
-    elif planner_model == "ollama":
-        executor.screenshot_as_tempfile = True
-        planner = OllamaPlanner(c, executor)
-    else:
+    if planner_model not in PLANNER_MODELS:
         raise HTTPException(status_code=400, detail=f"Unsupported planner model: {planner_model}")
+    if not set(finder_model.split(",")) <= FINDER_MODELS:
+        raise HTTPException(status_code=400, detail=f"Unsupported finder model: {finder_model}")
+
+
+def submit_job(request: TaskRequest) -> Job:
+    """
+    Queues a task and returns its job at once. Android tasks run on the next free device,
+    windows tasks one after another. Raises 429 once too many tasks are pending.
+    """
+    validate_request(request)
+    c = get_cached_config(request.platform, request.planner_model, request.finder_model)
+    if request.platform == "android":
+        scheduler = get_scheduler()
+        scheduler.start_workers(max_age=DEVICE_REFRESH_INTERVAL_IN_SECONDS)
+        if not scheduler.pool.serials:
+            raise HTTPException(status_code=503, detail="No android devices available")
+
+    jobs = get_jobs()
+    try:
+        # the time budget starts with the submission, time spent queued counts too
+        job = jobs.create(request.task_prompt, c.TASK_TIMEOUT_IN_SECONDS)
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "10"})
 
-    if finder_model == "openai":
-        finder = OpenAIFinder(c, executor)
-    elif finder_model == "gemini":
-        finder = GeminiFinder(c, executor)
-    elif finder_model == "ollama":
-        finder = OllamaFinder("llama3.2-vision", executor)
+    def task(executor):
+        return jobs.run(job, lambda: run_task(request, c, executor, job.token, job.on_action))
+
+    if request.platform == "win":
+        jobs.attach(job, _windows_worker.submit(task, get_windows_executor()))
     else:
-        raise HTTPException(status_code=400, detail=f"Unsupported finder model: {finder_model}")
+        jobs.attach(job, scheduler.submit(task))
+    return job
+
+
+def find_job(job_id: str) -> Job:
+    job = get_jobs().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No such task: {job_id}")
+    return job
 
-    result = execute_with_timeout(execute_task, c.TASK_TIMEOUT_IN_SECONDS, task_prompt, executor, planner, finder, c)
 
-    if result is not None:
-        return {"result": result}
+@app.post("/execute")
+async def execute_task_api(request: TaskRequest):
+    """Runs a task and answers with its result, waiting without holding a server thread."""
+    job = await asyncio.to_thread(submit_job, request)
+    done, _ = await asyncio.wait([asyncio.wrap_future(job.future)], timeout=job.token.remaining())
+    if not done:
+        # still queued, or a task stuck past its deadline: neither holds the request longer
+        get_jobs().cancel(job.id, timed_out=True)
+
+    # a task that ran and failed has a result, one that raised or never ran has an error
+    if job.status == SUCCEEDED or (job.status == FAILED and job.error is None):
+        return {"result": job.result}
     else:
-        raise HTTPException(status_code=500, detail="Task execution failed")
+        raise HTTPException(status_code=500, detail=job.error or "Task execution failed")
+
+
+@app.post("/tasks", status_code=202)
+def submit_task_api(request: TaskRequest):
+    """Queues a task and returns its id right away, poll GET /tasks/{id} for the result."""
+    return submit_job(request).as_dict()
+
+
+@app.get("/tasks")
+async def tasks_api():
+    """The number of tasks per status, and how many may be pending at once."""
+    return get_jobs().stats()
+
+
+@app.get("/tasks/{job_id}")
+async def task_status_api(job_id: str):
+    return find_job(job_id).as_dict()
+
+
+@app.delete("/tasks/{job_id}")
+def cancel_task_api(job_id: str):
+    """Cancels a queued or running task. Finished tasks are returned unchanged."""
+    find_job(job_id)
+    return get_jobs().cancel(job_id).as_dict()
+
+
+@app.get("/tasks/{job_id}/events")
+async def task_events_api(job_id: str, since: int = 0):
+    """
+    Server-sent events for a task: its status changes and every action it runs, starting at
+    event number `since`. The stream ends once the task has finished.
+    """
+    job = find_job(job_id)
+
+    async def stream():
+        seq = since
+        while True:
+            finished = job.finished
+            events = job.events[seq:]
+            for event in events:
+                data = json.dumps(event, default=str)
+                yield f"id: {event['seq']}\nevent: {event['event']}\ndata: {data}\n\n"
+            seq += len(events)
+            if finished and seq >= len(job.events):
+                return
+            await asyncio.sleep(EVENT_POLL_INTERVAL_IN_SECONDS)
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+@app.get("/devices")
+def devices_api():
+    """Per-device throughput and finder hit rates, and the number of queued tasks."""
+    scheduler = get_scheduler()
+    stats = scheduler.stats()
+    for device in stats["devices"]:
+        device["finders"] = finder_summaries(scheduler.pool.executor(device["serial"]))
+    return stats
 
 
 if __name__ == "__main__":
@@ -0,0 +1,177 @@
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import Executor as PoolExecutor, Future
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class TaskCancelled(Exception):
+    """Raised at the next cancellation point of a task that was cancelled or ran out of time."""
+
+
+class CancellationToken:
+    """
+    Cooperative cancellation of one task.
+
+    The task calls `check` between its stages and bounds blocking calls by what is left of the
+    deadline. Cancelling also runs the registered callbacks, which abort work that cannot poll
+    the token itself, such as a streaming HTTP response.
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.deadline: Optional[float] = None
+        self.reason: Optional[str] = None
+        self.event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._release = lambda: None
+        self.limit(timeout)
+
+    def child(self) -> "CancellationToken":
+        """
+        A token with the same deadline that is cancelled along with this one, and can also be
+        cancelled on its own, e.g. for one of several requests racing each other. `release`
+        it once its work is done.
+        """
+        child = CancellationToken()
+        child.deadline = self.deadline
+        child._release = self.on_cancel(lambda: child.cancel(self.reason or "cancelled"))
+        return child
+
+    def release(self):
+        """Stops following the parent's cancellation, see `child`."""
+        self._release()
+
+    def limit(self, timeout: Optional[float]):
+        """Brings the deadline forward to `timeout` seconds from now, if that is sooner."""
+        if timeout is None:
+            return
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            if self.deadline is None or deadline < self.deadline:
+                self.deadline = deadline
+
+    def cancel(self, reason: str = "cancelled"):
+        with self._lock:
+            if self.event.is_set():
+                return
+            self.reason = reason
+            self.event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        logger.info(f"Cancelling task: {reason}")
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                logger.exception("Error while aborting work of a cancelled task")
+
+    @property
+    def cancelled(self) -> bool:
+        if not self.event.is_set() and self.remaining() == 0:
+            self.cancel("deadline exceeded")
+        return self.event.is_set()
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left until the deadline, None without one."""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0.0)
+
+    def check(self):
+        if self.cancelled:
+            raise TaskCancelled(self.reason)
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Runs `callback` when the token is cancelled, returns a function unregistering it."""
+        with self._lock:
+            if not self.event.is_set():
+                self._callbacks.append(callback)
+
+                def unregister():
+                    with self._lock:
+                        if callback in self._callbacks:
+                            self._callbacks.remove(callback)
+
+                return unregister
+        callback()
+        return lambda: None
+
+
+# The token of the task running in this context, set by `execute_with_timeout`
+_current: contextvars.ContextVar = contextvars.ContextVar("cancellation_token", default=None)
+
+
+def current_token() -> Optional[CancellationToken]:
+    return _current.get()
+
+
+@contextmanager
+def use_token(token: Optional[CancellationToken]):
+    reset = _current.set(token)
+    try:
+        yield token
+    finally:
+        _current.reset(reset)
+
+
+def check_cancelled():
+    """Raises TaskCancelled if the current task was cancelled, a no-op outside of tasks."""
+    token = _current.get()
+    if token is not None:
+        token.check()
+
+
+def request_timeout(default=None):
+    """
+    Timeout for a blocking call of the current task: `default` (seconds or an httpx.Timeout),
+    shortened to the time left before the task's deadline.
+
+    Non-streaming requests cannot be aborted once sent, on cancellation they run until this
+    timeout while the task itself has already stopped waiting for them.
+    """
+    token = _current.get()
+    remaining = token.remaining() if token is not None else None
+    if remaining is None:
+        return default
+    if isinstance(default, httpx.Timeout):
+        cap = lambda value: remaining if value is None else min(value, remaining)
+        return httpx.Timeout(
+            connect=cap(default.connect),
+            read=cap(default.read),
+            write=cap(default.write),
+            pool=cap(default.pool),
+        )
+    if isinstance(default, (int, float)):
+        return min(default, remaining)
+    return remaining
+
+
+@contextmanager
+def abort_on_cancel(close: Callable[[], None]):
+    """
+    Calls `close` (on a stream or socket) when the current task is cancelled, so a read
+    blocked on it returns at once. The resulting error surfaces as TaskCancelled.
+    """
+    token = _current.get()
+    if token is None:
+        yield
+        return
+    unregister = token.on_cancel(close)
+    try:
+        yield
+    except Exception:
+        token.check()
+        raise
+    finally:
+        unregister()
+
+
+def submit(pool: PoolExecutor, fn: Callable, *args, **kwargs) -> Future:
+    """`pool.submit` carrying over the caller's context, so the task's token follows its work."""
+    return pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
@@ -0,0 +1,118 @@
+import asyncio
+import threading
+from typing import Dict, Tuple
+
+import httpx
+import openai
+
+# One keep-alive connection pool per endpoint, shared by every planner and finder using it
+_http_clients: Dict[Tuple, httpx.Client] = {}
+_http_clients_lock = threading.Lock()
+
+
+def get_http_client(
+    endpoint: str, pool_size: int = 20, timeout: float = 60, connect_timeout: float = 5
+) -> httpx.Client:
+    key = (endpoint, pool_size, timeout, connect_timeout)
+    with _http_clients_lock:
+        client = _http_clients.get(key)
+        if client is None:
+            client = _http_clients[key] = openai.DefaultHttpxClient(
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+                timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            )
+        return client
+
+
+def _http_client_key(model_config: dict) -> Tuple:
+    api_type = model_config.get("api_type") or "openai"
+    return (
+        (
+            model_config.get("azure_endpoint")
+            if api_type == "azure"
+            else (model_config.get("base_url") or "openai")
+        ),
+        model_config.get("http_pool_size", 20),
+        model_config.get("request_timeout", 60),
+        model_config.get("connect_timeout", 5),
+    )
+
+
+def get_openai_client(model_config: dict) -> openai.OpenAI:
+    """
+    An OpenAI or AzureOpenAI client for a planner or finder model config, so models with
+    different endpoints or keys do not overwrite each other's settings.
+    """
+    api_type = model_config.get("api_type") or "openai"
+    base_url = model_config.get("base_url")
+    azure_endpoint = model_config.get("azure_endpoint")
+    http_client = get_http_client(*_http_client_key(model_config))
+    if api_type == "azure":
+        return openai.AzureOpenAI(
+            api_key=model_config.get("api_key"),
+            azure_endpoint=azure_endpoint,
+            api_version=model_config.get("api_version"),
+            http_client=http_client,
+        )
+    return openai.OpenAI(
+        api_key=model_config.get("api_key"), base_url=base_url or None, http_client=http_client
+    )
+
+
+# Async clients are bound to the event loop they were created on, so they are kept per loop
+_async_clients: Dict[Tuple, openai.AsyncOpenAI] = {}
+_async_http_clients: Dict[Tuple, httpx.AsyncClient] = {}
+
+
+def get_async_openai_client(model_config: dict) -> openai.AsyncOpenAI:
+    """
+    `get_openai_client` for the async engine, must be called on the running event loop. All
+    clients of an endpoint share one async connection pool.
+    """
+    loop = asyncio.get_running_loop()
+    api_type = model_config.get("api_type") or "openai"
+    key = (loop, api_type, model_config.get("api_key"), model_config.get("api_version"))
+    key += _http_client_key(model_config)
+    client = _async_clients.get(key)
+    if client is not None:
+        return client
+
+    endpoint, pool_size, timeout, connect_timeout = _http_client_key(model_config)
+    http_key = (loop, endpoint, pool_size, timeout, connect_timeout)
+    http_client = _async_http_clients.get(http_key)
+    if http_client is None:
+        http_client = _async_http_clients[http_key] = openai.DefaultAsyncHttpxClient(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+        )
+    if api_type == "azure":
+        client = openai.AsyncAzureOpenAI(
+            api_key=model_config.get("api_key"),
+            azure_endpoint=model_config.get("azure_endpoint"),
+            api_version=model_config.get("api_version"),
+            http_client=http_client,
+        )
+    else:
+        client = openai.AsyncOpenAI(
+            api_key=model_config.get("api_key"),
+            base_url=model_config.get("base_url") or None,
+            http_client=http_client,
+        )
+    _async_clients[key] = client
+    return client
+
+
+def close_http_clients():
+    with _http_clients_lock:
+        for client in _http_clients.values():
+            client.close()
+        _http_clients.clear()
+
+
+async def aclose_http_clients():
+    """Closes the async connection pools of the running event loop."""
+    loop = asyncio.get_running_loop()
+    for key in [key for key in _async_clients if key[0] is loop]:
+        del _async_clients[key]
+    for key in [key for key in _async_http_clients if key[0] is loop]:
+        await _async_http_clients.pop(key).aclose()
@@ -49,6 +49,11 @@ logging.config.dictConfig(logging_config)
 
 def get_config(platform, planner_model, finder_model):
     c = BaseConfig()
+    c.platform = platform
+    c.planner_model = planner_model
+    c.finder_model = finder_model
+    # several comma separated finders run as an ensemble, the first one is the default
+    finder_model = finder_model.split(",")[0]
     prompts_config = c.get_prompts(platform, planner_model, finder_model)
     planner_model_config = c.get_config_for_platform(planner_model, "planner", platform)
     finder_model_config = c.get_config_for_platform(finder_model, "finder", platform)
@@ -1,3 +1,4 @@
+import copy
 import os
 from dataclasses import dataclass
 from google.ai.generativelanguage_v1beta.types import content
@@ -17,7 +18,50 @@ class BaseConfig:
     GEMINI_API_KEY = models_config["gemini"].get("api_key")
     SAMPLE_TASK_PROMPT = "open google.com in safari and search for sharukh khan and click the first link in the result. Take a screenshot and save the screenshot."
     TASK_TIMEOUT_IN_SECONDS = 330
-    TASK_DELAY = 1
+    # Wait for the screen to stop changing before each planner step
+    SETTLE_STABLE_MS = 300  # how long the screen has to stay unchanged
+    SETTLE_TIMEOUT_IN_SECONDS = 3  # ceiling for slow transitions
+    SETTLE_INTERVAL_IN_SECONDS = 0.1
+    SETTLE_THRESHOLD = 0.01  # mean thumbnail difference (0-1) still considered unchanged
+    # On android, look elements up in the accessibility tree before asking the vision finder.
+    # Each lookup dumps the tree with uiautomator, which takes 1-3s, so it only pays off for
+    # apps with well labelled elements
+    ACCESSIBILITY_FINDER = False
+    # "single" sends one downscaled screenshot to the finder, "tiled" sends overlapping
+    # native resolution tiles concurrently, which finds small controls more reliably, and
+    # "two_pass" locates the element on a small thumbnail then refines it on a crop
+    FINDER_SEARCH_MODE = "single"
+    FINDER_TILE_OVERLAP = 0.2  # fraction of a tile shared with its neighbour
+    FINDER_MAX_TILES = 8
+    FINDER_COARSE_SIZE = 256  # thumbnail size for the first pass
+    FINDER_REFINE_SIZE = 384  # crop size for the second pass
+    # With several finder models, "race" uses the first box returned and "consensus" the box
+    # most of them agree on
+    FINDER_ENSEMBLE_MODE = "race"
+    FINDER_ENSEMBLE_TIMEOUT_IN_SECONDS = 30
+    # Dispatch each planner function call as soon as it has streamed in
+    PLANNER_STREAMING = True
+    # Settle and encode the next screenshot, and look up elements, while the planner streams
+    PIPELINE_PREFETCH = True
+    # Planner history older than this many (estimated) tokens is collapsed into a summary
+    HISTORY_TOKEN_BUDGET = 4000
+    HISTORY_SUMMARY_TOKENS = 1000
+    # Send a duplicate of a finder request that is slower than most recent ones. Planner
+    # completions are costly, they are only hedged when a secondary model is set as well. A
+    # streamed completion is hedged until its first chunk arrives
+    HEDGE_REQUESTS = False
+    HEDGE_PLANNER_SECONDARY_MODEL = None  # e.g. a faster model or a second deployment
+    HEDGE_PERCENTILE = 0.9  # of recent latencies, after which the duplicate is sent
+    HEDGE_BUDGET = 0.1  # fraction of requests allowed to be duplicated
+    HEDGE_MIN_SAMPLES = 10  # latencies needed before hedging starts
+    # Reuse element bounds found earlier on a visually identical screen
+    ELEMENT_CACHE = True
+    ELEMENT_CACHE_SIZE = 1024
+    ELEMENT_CACHE_TTL_IN_SECONDS = 24 * 3600
+    ELEMENT_CACHE_PATH = os.getenv("CLICK3_ELEMENT_CACHE")  # JSON file persisting across runs
+    # POST /tasks answers 429 once this many tasks are queued or running
+    API_MAX_PENDING_TASKS = 64
+    API_JOB_RETENTION_IN_SECONDS = 3600  # how long finished tasks can still be polled
     DEBUG = True
 
     def get_config_for_platform(self, model_name, section, platform=""):
@@ -53,6 +97,16 @@ class BaseConfig:
         combined_config = {**base_config, **section_config, **platform_config}
         return combined_config
 
+    def with_finder(self, finder_model):
+        """A copy of this config with the prompts and finder settings of another finder model."""
+        c = copy.copy(self)
+        c.prompts = self.get_prompts(self.platform, self.planner_model, finder_model)
+        c.models = {
+            **self.models,
+            "finder_config": self.get_config_for_platform(finder_model, "finder", self.platform),
+        }
+        return c
+
     def get_function_declarations(self, platform: str) -> list:
         common_yaml_path = os.path.join(base_dir, "function_declarations", "common.yaml")
         common_declarations = load_yaml(common_yaml_path).get("function_declarations", [])
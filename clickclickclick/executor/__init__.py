@@ -1,10 +1,21 @@
 from abc import ABC, abstractmethod
-from typing import List
+from dataclasses import dataclass
+from typing import List, Optional
 import logging
 
+from .frame import Frame
+
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class ScreenGeometry:
+    width: int  # in the current orientation
+    height: int
+    density: Optional[int] = None
+    orientation: int = 0  # number of quarter turns from the natural orientation
+
+
 class Executor(ABC):
 
     @abstractmethod
@@ -64,9 +75,140 @@ class Executor(ABC):
         pass
 
     @abstractmethod
-    def screenshot(self, observation: str) -> str:
+    def screenshot(self, observation: str) -> Frame:
         pass
 
     @abstractmethod
     def click_at_a_point(self, x: int, y: int, observation: str) -> bool:
         pass
+
+    @abstractmethod
+    def screen_geometry(self) -> ScreenGeometry:
+        """Size, density and orientation of the screen, cached until the display changes."""
+        pass
+
+    # False when `probe_screen` returns something cheaper than a screenshot
+    probe_is_screenshot = True
+
+    def probe_screen(self) -> Optional[Frame]:
+        """
+        Capture used only to tell whether the screen is still changing. Executors with a
+        cheaper path than `screenshot` (no encoding, lower resolution) override it and set
+        `probe_is_screenshot` to False, so a screenshot is taken once the screen has settled.
+        """
+        return self.screenshot("Waiting for the screen to settle")
+
+    def scale_coordinates(
+        self, coordinates: List[int], image_width: int, image_height: int
+    ) -> List[int]:
+        """Scales ymin,xmin,ymax,xmax bounds found on an image_width x image_height image to the screen."""
+        return scale_to_screen(coordinates, self.screen_geometry(), image_width, image_height)
+
+
+def scale_to_screen(
+    coordinates: List[int], geometry: ScreenGeometry, image_width: int, image_height: int
+) -> List[int]:
+    screen_x, screen_y = geometry.width, geometry.height
+    logger.debug(f"Screen size: x y {screen_x} {screen_y}")
+    scaling_x = screen_x / image_width
+    scaling_y = screen_y / image_height
+    coordinates[0] = int(coordinates[0] * scaling_y)
+    coordinates[2] = int(coordinates[2] * scaling_y)
+    coordinates[1] = int(coordinates[1] * scaling_x)
+    coordinates[3] = int(coordinates[3] * scaling_x)
+
+    if scaling_x < scaling_y:
+        # For mobile: swap coordinates[0] with coordinates[1] and coordinates[2] with coordinates[3]
+        coordinates[0], coordinates[1] = coordinates[1], coordinates[0]
+        coordinates[2], coordinates[3] = coordinates[3], coordinates[2]
+
+    return coordinates
+
+
+class AsyncExecutor(ABC):
+    """
+    Asyncio counterpart of `Executor`, so many tasks can share one event loop instead of
+    needing a thread each. `ThreadedExecutor` adapts any blocking executor.
+    """
+
+    @abstractmethod
+    async def move_mouse(self, x: int, y: int, observation: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def press_key(self, key: List[str], observation: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def type_text(self, text: str, observation: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def click_mouse(self, observation: str, button: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def double_click_mouse(self, button: str, observation: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def scroll(self, clicks: int, observation: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def swipe_right(self, observation: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def swipe_left(self, observation: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def swipe_up(self, observation: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def swipe_down(self, observation: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def volume_up(self, observation: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def volume_down(self, observation: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def navigate_back(self, observation: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def minimize_app(self, observation: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def screenshot(self, observation: str) -> Frame:
+        pass
+
+    @abstractmethod
+    async def click_at_a_point(self, x: int, y: int, observation: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def screen_geometry(self) -> ScreenGeometry:
+        pass
+
+    probe_is_screenshot = True
+
+    async def probe_screen(self) -> Optional[Frame]:
+        """See `Executor.probe_screen`."""
+        return await self.screenshot("Waiting for the screen to settle")
+
+    async def scale_coordinates(
+        self, coordinates: List[int], image_width: int, image_height: int
+    ) -> List[int]:
+        return scale_to_screen(coordinates, await self.screen_geometry(), image_width, image_height)
+
+    async def close(self):
+        pass
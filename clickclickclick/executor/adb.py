@@ -0,0 +1,439 @@
+import asyncio
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+from subprocess import CompletedProcess
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from . import logger
+
+ADB_SERVER_HOST = os.getenv("ADB_SERVER_HOST", "127.0.0.1")
+ADB_SERVER_PORT = int(os.getenv("ADB_SERVER_PORT", "5037"))
+
+# shell protocol v2 packet ids
+SHELL_STDIN = 0
+SHELL_STDOUT = 1
+SHELL_STDERR = 2
+SHELL_EXIT = 3
+SHELL_CLOSE_STDIN = 4
+
+SYNC_DATA_MAX = 64 * 1024
+
+
+class AdbError(Exception):
+    """Raised when the adb server answers FAIL or the connection breaks."""
+
+
+class AdbFailure(AdbError):
+    """Raised when the adb server or the device refuses a request with FAIL."""
+
+
+def host_command(serial: Optional[str], command: str) -> str:
+    """A `host:` request about one device, or about any device without a serial."""
+    return f"host-serial:{serial}:{command}" if serial else f"host:{command}"
+
+
+class AdbConnection:
+    """One TCP connection to the adb server, speaking the host <-> server wire protocol."""
+
+    def __init__(self, host: str, port: int, timeout: Optional[float]):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def send_request(self, request: str):
+        """Sends a length-prefixed request and waits for OKAY."""
+        payload = request.encode("utf-8")
+        self.sock.sendall(b"%04x" % len(payload) + payload)
+        self.read_status()
+
+    def read_status(self):
+        status = self.read_exact(4)
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            raise AdbFailure(self.read_string())
+        raise AdbError(f"Unexpected adb server status {status!r}")
+
+    def read_string(self) -> str:
+        length = int(self.read_exact(4), 16)
+        return self.read_exact(length).decode("utf-8", "replace")
+
+    def read_exact(self, size: int) -> bytes:
+        buf = bytearray()
+        while len(buf) < size:
+            chunk = self.sock.recv(size - len(buf))
+            if not chunk:
+                raise AdbError("Connection closed by adb server")
+            buf += chunk
+        return bytes(buf)
+
+    def read_all(self) -> bytes:
+        chunks = []
+        while True:
+            chunk = self.sock.recv(256 * 1024)
+            if not chunk:
+                return b"".join(chunks)
+            chunks.append(chunk)
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class AdbClient:
+    """
+    Talks to the adb server on TCP 5037 directly instead of running the `adb` binary.
+
+    A transport connection can only carry a single service, so the pool keeps up to
+    `pool_size` connections per device that already completed `host:transport` and are
+    ready for the next `shell:`, `exec:` or `sync:` request.
+    """
+
+    def __init__(
+        self,
+        serial: Optional[str] = None,
+        host: str = ADB_SERVER_HOST,
+        port: int = ADB_SERVER_PORT,
+        pool_size: int = 4,
+        timeout: Optional[float] = 10,
+    ):
+        self.serial = serial
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=pool_size)
+        self._refilling = threading.Lock()
+        self._features: Optional[FrozenSet[str]] = None
+
+    def _connect(self) -> AdbConnection:
+        return AdbConnection(self.host, self.port, self.timeout)
+
+    def _transport(self) -> AdbConnection:
+        conn = self._connect()
+        try:
+            if self.serial:
+                conn.send_request(f"host:transport:{self.serial}")
+            else:
+                conn.send_request("host:transport-any")
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def _refill(self):
+        # Prepare a transport in the background so the next command skips the handshake
+        if not self._refilling.acquire(blocking=False):
+            return
+
+        def fill():
+            try:
+                while not self._idle.full():
+                    self._idle.put_nowait(self._transport())
+            except (OSError, AdbError, queue.Full):
+                pass
+            finally:
+                self._refilling.release()
+
+        threading.Thread(target=fill, daemon=True).start()
+
+    def open_service(self, service: str) -> AdbConnection:
+        """Opens `service` on the device and returns the connection carrying its stream."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.send_request(service)
+                self._refill()
+                return conn
+            except AdbFailure:
+                conn.close()  # the device refused the service itself, another transport won't help
+                raise
+            except (OSError, AdbError):
+                # stale transport, e.g. the device was reconnected since it was pooled
+                conn.close()
+        conn = self._transport()
+        try:
+            conn.send_request(service)
+        except Exception:
+            conn.close()
+            raise
+        self._refill()
+        return conn
+
+    def host_request(self, request: str) -> str:
+        """Runs a `host:` request that is answered by the server itself."""
+        conn = self._connect()
+        try:
+            conn.send_request(request)
+            return conn.read_string()
+        finally:
+            conn.close()
+
+    def devices(self) -> List[Tuple[str, str]]:
+        """Returns (serial, state) pairs, like `adb devices`."""
+        output = self.host_request("host:devices")
+        return [tuple(line.split("\t", 1)) for line in output.splitlines() if "\t" in line]
+
+    def features(self) -> FrozenSet[str]:
+        """Features of the device, like `adb features`."""
+        if self._features is None:
+            output = self.host_request(host_command(self.serial, "features"))
+            self._features = frozenset(output.strip().split(","))
+        return self._features
+
+    def shell(self, command: str, text_mode: bool = True) -> CompletedProcess:
+        """
+        Runs `command` with the v2 shell protocol, which separates stderr and the exit code.
+        Devices without shell_v2 only know the legacy protocol, where stderr is mixed into
+        stdout and the exit code is always reported as 0.
+        """
+        if "shell_v2" not in self.features():
+            conn = self.open_service(f"shell:{command}")
+            try:
+                stdout = conn.read_all()
+            finally:
+                conn.close()
+            return self._completed(command, 0, stdout, b"", text_mode)
+
+        conn = self.open_service(f"shell,v2,raw:{command}")
+        stdout, stderr, returncode = bytearray(), bytearray(), 1
+        try:
+            while True:
+                try:
+                    header = conn.read_exact(5)
+                except AdbError:
+                    break
+                packet_id, length = struct.unpack("<BI", header)
+                data = conn.read_exact(length)
+                if packet_id == SHELL_STDOUT:
+                    stdout += data
+                elif packet_id == SHELL_STDERR:
+                    stderr += data
+                elif packet_id == SHELL_EXIT:
+                    returncode = data[0]
+                    break
+        finally:
+            conn.close()
+        if returncode != 0:
+            logger.error(f"adb shell {command} failed: {bytes(stderr).decode('utf-8', 'replace')}")
+        return self._completed(command, returncode, bytes(stdout), bytes(stderr), text_mode)
+
+    def exec_out(self, command: str) -> bytes:
+        """Runs `command` through `exec:`, returning its raw (binary safe) stdout."""
+        conn = self.open_service(f"exec:{command}")
+        try:
+            return conn.read_all()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _completed(command, returncode, stdout, stderr, text_mode) -> CompletedProcess:
+        if text_mode:
+            stdout = stdout.decode("utf-8", "replace")
+            stderr = stderr.decode("utf-8", "replace")
+        return CompletedProcess(["shell", command], returncode, stdout, stderr)
+
+    # sync: service, used for file transfer
+
+    def _sync(self) -> AdbConnection:
+        return self.open_service("sync:")
+
+    @staticmethod
+    def _sync_send(conn: AdbConnection, command: bytes, data: bytes):
+        conn.sock.sendall(command + struct.pack("<I", len(data)) + data)
+
+    @staticmethod
+    def _sync_read_header(conn: AdbConnection) -> Tuple[bytes, int]:
+        command, length = struct.unpack("<4sI", conn.read_exact(8))
+        if command == b"FAIL":
+            raise AdbFailure(conn.read_exact(length).decode("utf-8", "replace"))
+        return command, length
+
+    def stat(self, remote_path: str) -> Tuple[int, int, int]:
+        """Returns (mode, size, mtime) of a file on the device."""
+        conn = self._sync()
+        try:
+            self._sync_send(conn, b"STAT", remote_path.encode("utf-8"))
+            command, mode, size, mtime = struct.unpack("<4sIII", conn.read_exact(16))
+            if command != b"STAT":
+                raise AdbError(f"Unexpected sync response {command!r}")
+            return mode, size, mtime
+        finally:
+            conn.close()
+
+    def pull(self, remote_path: str) -> bytes:
+        conn = self._sync()
+        try:
+            self._sync_send(conn, b"RECV", remote_path.encode("utf-8"))
+            chunks = []
+            while True:
+                command, length = self._sync_read_header(conn)
+                if command == b"DONE":
+                    break
+                if command != b"DATA":
+                    raise AdbError(f"Unexpected sync response {command!r}")
+                chunks.append(conn.read_exact(length))
+            self._sync_send(conn, b"QUIT", b"")
+            return b"".join(chunks)
+        finally:
+            conn.close()
+
+    def push(self, data: bytes, remote_path: str, mode: int = 0o644):
+        conn = self._sync()
+        try:
+            self._sync_send(conn, b"SEND", f"{remote_path},{mode}".encode("utf-8"))
+            view = memoryview(data)
+            for offset in range(0, len(data), SYNC_DATA_MAX):
+                self._sync_send(conn, b"DATA", view[offset : offset + SYNC_DATA_MAX])
+            conn.sock.sendall(b"DONE" + struct.pack("<I", int(time.time())))
+            command, _ = self._sync_read_header(conn)
+            if command != b"OKAY":
+                raise AdbError(f"Unexpected sync response {command!r}")
+            self._sync_send(conn, b"QUIT", b"")
+        finally:
+            conn.close()
+
+
+class AsyncAdbClient:
+    """
+    Asyncio counterpart of `AdbClient` for `shell` and `exec-out`, so a single event loop can
+    drive many devices without a thread blocked on each socket. Like the socket timeout of
+    `AdbClient`, `timeout` applies to connecting and to each read.
+    """
+
+    def __init__(
+        self,
+        serial: Optional[str] = None,
+        host: str = ADB_SERVER_HOST,
+        port: int = ADB_SERVER_PORT,
+        timeout: Optional[float] = 10,
+    ):
+        self.serial = serial
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._features: Optional[FrozenSet[str]] = None
+
+    async def _read(self, reading):
+        return await asyncio.wait_for(reading, self.timeout)
+
+    async def _read_string(self, reader: asyncio.StreamReader) -> str:
+        length = int(await self._read(reader.readexactly(4)), 16)
+        return (await self._read(reader.readexactly(length))).decode("utf-8", "replace")
+
+    async def _read_all(self, reader: asyncio.StreamReader) -> bytes:
+        chunks = []
+        while True:
+            chunk = await self._read(reader.read(256 * 1024))
+            if not chunk:
+                return b"".join(chunks)
+            chunks.append(chunk)
+
+    async def _send_request(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, request
+    ):
+        payload = request.encode("utf-8")
+        writer.write(b"%04x" % len(payload) + payload)
+        await writer.drain()
+        status = await self._read(reader.readexactly(4))
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            raise AdbFailure(await self._read_string(reader))
+        raise AdbError(f"Unexpected adb server status {status!r}")
+
+    async def _connect(self):
+        return await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+
+    async def open_service(self, service: str):
+        """Opens `service` on the device, returns the (reader, writer) pair carrying it."""
+        reader, writer = await self._connect()
+        try:
+            transport = f"host:transport:{self.serial}" if self.serial else "host:transport-any"
+            await self._send_request(reader, writer, transport)
+            await self._send_request(reader, writer, service)
+        except BaseException:
+            writer.close()
+            raise
+        return reader, writer
+
+    async def features(self) -> FrozenSet[str]:
+        """Features of the device, like `adb features`."""
+        if self._features is None:
+            reader, writer = await self._connect()
+            try:
+                await self._send_request(reader, writer, host_command(self.serial, "features"))
+                output = await self._read_string(reader)
+            finally:
+                writer.close()
+            self._features = frozenset(output.strip().split(","))
+        return self._features
+
+    async def shell(self, command: str, text_mode: bool = True) -> CompletedProcess:
+        """`AdbClient.shell` for the event loop."""
+        if "shell_v2" not in await self.features():
+            reader, writer = await self.open_service(f"shell:{command}")
+            try:
+                stdout = await self._read_all(reader)
+            finally:
+                writer.close()
+            return AdbClient._completed(command, 0, stdout, b"", text_mode)
+
+        reader, writer = await self.open_service(f"shell,v2,raw:{command}")
+        stdout, stderr, returncode = bytearray(), bytearray(), 1
+        try:
+            while True:
+                try:
+                    header = await self._read(reader.readexactly(5))
+                except asyncio.IncompleteReadError:
+                    break
+                packet_id, length = struct.unpack("<BI", header)
+                data = await self._read(reader.readexactly(length))
+                if packet_id == SHELL_STDOUT:
+                    stdout += data
+                elif packet_id == SHELL_STDERR:
+                    stderr += data
+                elif packet_id == SHELL_EXIT:
+                    returncode = data[0]
+                    break
+        finally:
+            writer.close()
+        if returncode != 0:
+            logger.error(f"adb shell {command} failed: {bytes(stderr).decode('utf-8', 'replace')}")
+        return AdbClient._completed(command, returncode, bytes(stdout), bytes(stderr), text_mode)
+
+    async def exec_out(self, command: str) -> bytes:
+        """Runs `command` through `exec:`, returning its raw (binary safe) stdout."""
+        reader, writer = await self.open_service(f"exec:{command}")
+        try:
+            return await self._read_all(reader)
+        finally:
+            writer.close()
+
+
+_clients: Dict[Optional[str], AdbClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_adb_client(serial: Optional[str] = None) -> AdbClient:
+    """Returns the shared client (and so the shared connection pool) for a device serial."""
+    with _clients_lock:
+        client = _clients.get(serial)
+        if client is None:
+            client = _clients[serial] = AdbClient(serial)
+        return client
+
+
+def adb_server_available(host: str = ADB_SERVER_HOST, port: int = ADB_SERVER_PORT) -> bool:
+    try:
+        socket.create_connection((host, port), timeout=0.5).close()
+        return True
+    except OSError:
+        return False
@@ -1,30 +1,293 @@
-from . import Executor
+import asyncio
+from . import AsyncExecutor, Executor
 from subprocess import CompletedProcess, run
 import subprocess
-from typing import List, Union
-import io
-import base64
+from typing import List, Optional, Union
+import queue
+import re
+import struct
+import threading
+import time
+import uuid
 from PIL import Image
-from tempfile import NamedTemporaryFile
 import shlex
-from . import logger
+from . import Frame, ScreenGeometry, logger
+from .adb import (
+    SHELL_EXIT,
+    SHELL_STDERR,
+    SHELL_STDIN,
+    SHELL_STDOUT,
+    AdbClient,
+    AdbError,
+    AsyncAdbClient,
+    adb_server_available,
+    get_adb_client,
+)
+from .stream import ScreenStream
+from clickclickclick.cancel import check_cancelled, request_timeout
 
 
-def run_adb_command(command: List[str], text_mode: bool = True) -> CompletedProcess:
-    """Runs adb command and returns the completed process."""
+def adb_serial_args(serial: Optional[str]) -> List[str]:
+    return ["-s", serial] if serial else []
+
+
+def run_adb_command(
+    command: List[str], text_mode: bool = True, serial: Optional[str] = None
+) -> CompletedProcess:
+    """Runs adb command (against `serial` if given) and returns the completed process."""
     result = run(
-        ["adb"] + command,
+        ["adb"] + adb_serial_args(serial) + command,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
         text=text_mode,
     )
     if result.returncode != 0:
-        logger.error(
-            f"adb command {' '.join(command)} failed: {result.stderr.decode('utf-8').strip()}"
-        )
+        stderr = result.stderr if text_mode else result.stderr.decode("utf-8")
+        logger.error(f"adb command {' '.join(command)} failed: {stderr.strip()}")
     return result
 
 
+async def run_adb_command_async(
+    command: List[str], text_mode: bool = True, serial: Optional[str] = None
+) -> CompletedProcess:
+    """Asyncio variant of `run_adb_command`, the adb process is awaited instead of waited on."""
+    args = ["adb"] + adb_serial_args(serial) + command
+    process = await asyncio.create_subprocess_exec(
+        *args, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate()
+    if text_mode:
+        stdout = stdout.decode("utf-8", "replace")
+        stderr = stderr.decode("utf-8", "replace")
+    if process.returncode != 0:
+        error = stderr if text_mode else stderr.decode("utf-8", "replace")
+        logger.error(f"adb command {' '.join(command)} failed: {error.strip()}")
+    return CompletedProcess(args, process.returncode, stdout, stderr)
+
+
+class AdbShellSession:
+    """
+    A long-lived `adb shell` that commands are written into.
+
+    Every command is followed by a unique marker carrying its exit code, so results can be
+    read back from the same shell instead of spawning a new `adb` per action. If the
+    shell cannot be reached the command is sent to a new one. If it is lost after a command
+    was sent, that command fails (exit code 255) rather than being repeated, and the next
+    command starts a new shell.
+
+    With an `AdbClient` the shell is opened straight on the adb server socket, otherwise an
+    `adb shell` process is used. Devices without shell protocol v2 mix stderr into stdout.
+    """
+
+    def __init__(
+        self,
+        adb_args: Optional[List[str]] = None,
+        timeout: float = 30,
+        client: Optional[AdbClient] = None,
+    ):
+        self.adb_args = adb_args or []
+        self.timeout = timeout
+        self.client = client
+        self._process = None
+        self._connection = None
+        self._write = None
+        self._lines = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        # (stream, line) pairs, a reader thread keeps this portable (select() does not work on
+        # pipes on Windows)
+        self._lines = queue.Queue()
+        if self.client is not None:
+            # A non-empty command makes adbd run the shell without a pty, so nothing is echoed
+            v2 = "shell_v2" in self.client.features()
+            service = "shell,v2,raw:sh" if v2 else "shell:sh"
+            conn = self._connection = self.client.open_service(service)
+            conn.sock.settimeout(None)
+            if v2:
+                self._write = lambda text: self._send_packet(conn, text)
+                threading.Thread(
+                    target=self._pump_packets, args=(conn, self._lines), daemon=True
+                ).start()
+                return
+            stdin = conn.sock.makefile("w", encoding="utf-8", newline="\n")
+            streams = [(SHELL_STDOUT, conn.sock.makefile("r", encoding="utf-8", errors="replace"))]
+        else:
+            self._process = subprocess.Popen(
+                ["adb"] + self.adb_args + ["shell"],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                bufsize=1,
+            )
+            stdin = self._process.stdin
+            streams = [(SHELL_STDOUT, self._process.stdout), (SHELL_STDERR, self._process.stderr)]
+            logger.debug(f"Started adb shell session pid={self._process.pid}")
+
+        def write(text):
+            stdin.write(text)
+            stdin.flush()
+
+        self._write = write
+        for stream_id, stream in streams:
+            threading.Thread(
+                target=self._pump, args=(stream, stream_id, self._lines), daemon=True
+            ).start()
+
+    @staticmethod
+    def _pump(stream, stream_id, lines):
+        try:
+            for line in iter(stream.readline, ""):
+                lines.put((stream_id, line))
+        except (OSError, ValueError):
+            pass
+        lines.put(None)  # EOF, the shell went away
+
+    @staticmethod
+    def _send_packet(conn, text: str):
+        data = text.encode("utf-8")
+        conn.sock.sendall(struct.pack("<BI", SHELL_STDIN, len(data)) + data)
+
+    @staticmethod
+    def _pump_packets(conn, lines):
+        pending = {SHELL_STDOUT: b"", SHELL_STDERR: b""}
+        try:
+            while True:
+                packet_id, length = struct.unpack("<BI", conn.read_exact(5))
+                data = conn.read_exact(length)
+                if packet_id == SHELL_EXIT:
+                    break
+                if packet_id in pending:
+                    *complete, pending[packet_id] = (pending[packet_id] + data).split(b"\n")
+                    for line in complete:
+                        lines.put((packet_id, line.decode("utf-8", "replace") + "\n"))
+        except (OSError, AdbError):
+            pass
+        lines.put(None)
+
+    def close(self):
+        with self._lock:
+            self._stop()
+
+    def _stop(self):
+        try:
+            if self._process is not None:
+                self._process.kill()
+                self._process.wait(timeout=5)
+            if self._connection is not None:
+                self._connection.close()
+        except Exception:
+            logger.exception("Error while stopping adb shell session")
+        self._process = None
+        self._connection = None
+        self._write = None
+        self._lines = None
+
+    def _alive(self) -> bool:
+        if self._connection is not None:
+            return True  # a dropped socket surfaces as EOF or a write error
+        return self._process is not None and self._process.poll() is None
+
+    def run(self, commands: Union[str, List[str]]) -> CompletedProcess:
+        """
+        Runs one or more shell commands in a single round trip.
+
+        Multiple commands are joined with `;`, so the returned exit code is the one of the last
+        command, matching how the individual `adb shell` calls behaved before.
+        """
+        if isinstance(commands, str):
+            commands = [commands]
+        command = "; ".join(commands)
+        check_cancelled()
+        marker = f"__ccc_{uuid.uuid4().hex}__"
+        with self._lock:
+            try:
+                self._send(command, marker)
+            except (OSError, AdbError) as e:
+                # the command never reached the device, so it is safe to send it to a new shell
+                self._stop()
+                check_cancelled()
+                logger.warning(f"adb shell session lost ({e!r}), reconnecting")
+                self._send(command, marker)
+            try:
+                return self._read(command, marker)
+            except (OSError, EOFError, AdbError) as e:
+                # the command may have run, or still run, so it is not repeated: a tap or
+                # `am start` must not happen twice. The next command gets a clean shell.
+                self._stop()
+                check_cancelled()
+                logger.error(f"adb shell session lost while running {command} ({e!r})")
+                return CompletedProcess(["shell", command], 255, "", str(e))
+
+    def _send(self, command: str, marker: str):
+        if not self._alive():
+            self._start()
+        # stderr gets a marker of its own, so its output is not left over for the next command
+        self._write(
+            f"{{ {command}; }}; __ccc_status=$?; printf '\\n%s\\n' {marker}e >&2; "
+            f"printf '\\n%s%s\\n' {marker} \"$__ccc_status\"\n"
+        )
+
+    def _read(self, command: str, marker: str) -> CompletedProcess:
+        output = {SHELL_STDOUT: [], SHELL_STDERR: []}
+        returncode = None
+        stderr_done = False
+        while returncode is None or not stderr_done:
+            timeout = request_timeout(self.timeout)
+            try:
+                item = self._lines.get(timeout=timeout)
+            except queue.Empty:
+                raise TimeoutError(f"adb shell did not answer within {timeout:.2f}s")
+            if item is None:
+                raise EOFError("adb shell session closed")
+            stream_id, line = item
+            lines = output[stream_id]
+            # without shell protocol v2 the stderr marker arrives on stdout
+            if line.rstrip("\n") == f"{marker}e":
+                stderr_done = True
+            elif line.startswith(marker):
+                returncode = int(line[len(marker) :].strip() or 1)
+            else:
+                lines.append(line)
+                continue
+            # Drop the newline printed in front of the marker
+            if lines and lines[-1].endswith("\n"):
+                lines[-1] = lines[-1][:-1]
+        stdout, stderr = "".join(output[SHELL_STDOUT]), "".join(output[SHELL_STDERR])
+        if returncode != 0:
+            logger.error(f"adb shell command {command} failed: {(stderr or stdout).strip()}")
+        return CompletedProcess(["shell", command], returncode, stdout, stderr)
+
+
+# screencap pixel formats (android.graphics.PixelFormat) -> PIL (mode, raw mode)
+SCREENCAP_RAW_MODES = {
+    1: ("RGBA", "RGBA"),  # RGBA_8888
+    2: ("RGB", "RGBX"),  # RGBX_8888
+    5: ("RGBA", "BGRA"),  # BGRA_8888
+}
+
+
+def decode_raw_screencap(data: bytes) -> Image.Image:
+    """
+    Wraps raw `screencap` output (header + pixels) as an image without copying the pixels.
+
+    The header is width, height and pixel format as little endian u32, followed by a
+    dataspace u32 on newer Android versions, so its size is derived from the payload length.
+    """
+    width, height, pixel_format = struct.unpack_from("<III", data)
+    modes = SCREENCAP_RAW_MODES.get(pixel_format)
+    if modes is None:
+        raise ValueError(f"Unsupported screencap pixel format {pixel_format}")
+    header_size = len(data) - width * height * 4
+    if header_size not in (12, 16):
+        raise ValueError(f"Unexpected screencap size {len(data)} for {width}x{height}")
+    pixels = memoryview(data)[header_size:]
+    # For RGBA_8888 the layout matches PIL's RGBA mode, so frombuffer shares the buffer
+    mode, raw_mode = modes
+    return Image.frombuffer(mode, (width, height), pixels, "raw", raw_mode, 0, 1)
+
+
 def sanitize_for_adb(text: str) -> str:
     # Replace spaces with %s
     text = text.replace(" ", "%s")
@@ -32,11 +295,130 @@ def sanitize_for_adb(text: str) -> str:
     return shlex.quote(text)
 
 
+def type_text_commands(text: str) -> List[str]:
+    commands = []
+    multiline_texts = text.split("\n")
+    for text in multiline_texts:
+        if text == "":  # due to newline
+            commands.append("input keyevent 66")
+        else:
+            sanitized_text = sanitize_for_adb(text)
+            commands.append(f"input text {sanitized_text}")
+    # todo confirm if needed
+    commands.append("input keyevent 66")
+    return commands
+
+
+# Queried together in one shell round trip
+GEOMETRY_COMMANDS = ["wm size", "wm density", "dumpsys input | grep -m 1 SurfaceOrientation"]
+
+
+def parse_geometry(output: str) -> ScreenGeometry:
+    # e.g. 'Physical size: 1080x2400' plus 'Override size: ...' when changed by the user
+    size = re.search(r"Override size: (\d+)x(\d+)", output) or re.search(
+        r"Physical size: (\d+)x(\d+)", output
+    )
+    if size is None:
+        raise Exception("Failed to parse screen size from adb output.")
+    width, height = map(int, size.groups())
+    density = re.search(r"Override density: (\d+)", output) or re.search(
+        r"Physical density: (\d+)", output
+    )
+    orientation = re.search(r"SurfaceOrientation: (\d)", output)
+    orientation = int(orientation.group(1)) if orientation else 0
+    if orientation % 2 == 1:
+        # wm size reports the natural orientation
+        width, height = height, width
+    density = int(density.group(1)) if density else None
+    return ScreenGeometry(width, height, density, orientation)
+
+
+def geometry_matches(geometry: Optional[ScreenGeometry], frame: Frame) -> bool:
+    # screencap follows the display, so a differently shaped frame means a rotation or
+    # display change and the cached geometry is refreshed on next use
+    if geometry is not None and frame.size != (geometry.width, geometry.height):
+        logger.info(f"Display changed to {frame.size}, refreshing device geometry")
+        return False
+    return True
+
+
 class AndroidExecutor(Executor):
-    def __init__(self):
+    def __init__(
+        self,
+        serial: Optional[str] = None,
+        persistent_shell: bool = True,
+        use_adb_server: bool = True,
+        capture_mode: str = "raw",
+    ):
         super().__init__()
-        self.screenshot_as_base64 = False
-        self.screenshot_as_tempfile = False
+        # None targets the default device, like plain `adb`
+        self.serial = serial
+        # "raw" pulls the framebuffer as-is, "png" lets the device compress every frame
+        self.capture_mode = capture_mode
+        # Talk to the adb server directly when it is running, else shell out to the binary
+        self.adb = get_adb_client(serial) if use_adb_server and adb_server_available() else None
+        self.shell = (
+            AdbShellSession(adb_serial_args(serial), client=self.adb) if persistent_shell else None
+        )
+        self.stream = None
+        self.last_action_time = 0.0
+        self._geometry = None
+
+    def run_shell(self, commands: Union[str, List[str]]) -> CompletedProcess:
+        """Runs shell command(s) on the device, in one round trip when a session is open."""
+        try:
+            if self.shell is not None:
+                return self.shell.run(commands)
+            if isinstance(commands, str):
+                commands = [commands]
+            if self.adb is not None:
+                return self.adb.shell("; ".join(commands))
+            return run_adb_command(["shell", "; ".join(commands)], serial=self.serial)
+        finally:
+            # streamed frames captured before this point may not show the command's effect
+            self.last_action_time = time.time()
+
+    def exec_out(self, command: str) -> CompletedProcess:
+        """Runs a command whose binary stdout is needed as-is, e.g. screencap."""
+        check_cancelled()
+        if self.adb is not None:
+            try:
+                return CompletedProcess(["exec-out", command], 0, self.adb.exec_out(command), b"")
+            except (OSError, AdbError) as e:
+                logger.error(f"adb exec-out {command} failed: {e}")
+                return CompletedProcess(["exec-out", command], 1, b"", str(e).encode())
+        return run_adb_command(["exec-out"] + command.split(), text_mode=False, serial=self.serial)
+
+    def close(self):
+        self.stop_stream()
+        if self.shell is not None:
+            self.shell.close()
+
+    def start_stream(self, size: int = 8, interval: float = 0.0):
+        """
+        Streams raw captures continuously on a background thread, so `screenshot` can return
+        the newest frame straight from the ring buffer.
+        """
+        if self.stream is None:
+            self.stream = ScreenStream(self._capture, size=size, interval=interval)
+        self.stream.start()
+
+    def stop_stream(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream = None
+
+    def screen_geometry(self) -> ScreenGeometry:
+        if self._geometry is None:
+            self._geometry = self._query_geometry()
+            logger.debug(f"Device geometry {self._geometry}")
+        return self._geometry
+
+    def invalidate_geometry(self):
+        self._geometry = None
+
+    def _query_geometry(self) -> ScreenGeometry:
+        return parse_geometry(self.run_shell(GEOMETRY_COMMANDS).stdout)
 
     def click_mouse(observation: str):
         raise NotImplementedError("click mouse is not available in android")
@@ -47,7 +429,7 @@ class AndroidExecutor(Executor):
     def move_mouse(self, x: int, y: int, observation: str) -> bool:
         try:
             logger.debug(f"move mouse x y {x} {y}")
-            run_adb_command(["shell", "input", "tap", str(x), str(y)])
+            self.run_shell(f"input tap {x} {y}")
             return True
         except Exception as e:
             logger.exception("Error in move_mouse")
@@ -56,8 +438,7 @@ class AndroidExecutor(Executor):
     def press_key(self, keys: List[str], observation: str) -> bool:
         try:
             logger.debug(f"press keys {keys}")
-            for key in keys:
-                run_adb_command(["shell", "input", "keyevent", key.upper()])
+            self.run_shell([f"input keyevent {shlex.quote(key.upper())}" for key in keys])
             return True
         except Exception as e:
             logger.exception("Error in press_key")
@@ -66,15 +447,7 @@ class AndroidExecutor(Executor):
     def type_text(self, text: str, observation: str) -> bool:
         try:
             logger.debug(f"type text {text}")
-            multiline_texts = text.split("\n")
-            for text in multiline_texts:
-                if text == "":  # due to newline
-                    run_adb_command(["shell", "input", "keyevent", "66"])
-                else:
-                    sanitized_text = sanitize_for_adb(text)
-                    run_adb_command(["shell", "input", "text", sanitized_text])
-            # todo confirm if needed
-            run_adb_command(["shell", "input", "keyevent", "66"])
+            self.run_shell(type_text_commands(text))
             return True
         except Exception as e:
             logger.exception("Error in type_text")
@@ -86,10 +459,10 @@ class AndroidExecutor(Executor):
             # Perform swipe to simulate scroll
             if clicks > 0:
                 # Scroll up
-                run_adb_command(["shell", "input", "swipe", "500", "1500", "500", "500"])
+                self.run_shell("input swipe 500 1500 500 500")
             else:
                 # Scroll down
-                run_adb_command(["shell", "input", "swipe", "500", "500", "500", "1500"])
+                self.run_shell("input swipe 500 500 500 1500")
             return True
         except Exception as e:
             logger.exception("Error in scroll")
@@ -98,7 +471,7 @@ class AndroidExecutor(Executor):
     def swipe_left(self, observation: str) -> bool:
         try:
             logger.debug("swipe left")
-            run_adb_command(["shell", "input", "swipe", "700", "1000", "100", "1000"])
+            self.run_shell("input swipe 700 1000 100 1000")
             return True
         except Exception as e:
             logger.exception("Error in swipe_left")
@@ -107,7 +480,7 @@ class AndroidExecutor(Executor):
     def swipe_right(self, observation: str) -> bool:
         try:
             logger.debug("swipe right")
-            run_adb_command(["shell", "input", "swipe", "100", "1000", "700", "1000"])
+            self.run_shell("input swipe 100 1000 700 1000")
             return True
         except Exception as e:
             logger.exception("Error in swipe_right")
@@ -116,7 +489,7 @@ class AndroidExecutor(Executor):
     def volume_up(self, observation: str) -> bool:
         try:
             logger.debug("volume up")
-            run_adb_command(["shell", "input", "keyevent", "KEYCODE_VOLUME_UP"])
+            self.run_shell("input keyevent KEYCODE_VOLUME_UP")
             return True
         except Exception as e:
             logger.exception("Error in volume_up")
@@ -125,7 +498,7 @@ class AndroidExecutor(Executor):
     def volume_down(self, observation: str) -> bool:
         try:
             logger.debug("volume down")
-            run_adb_command(["shell", "input", "keyevent", "KEYCODE_VOLUME_DOWN"])
+            self.run_shell("input keyevent KEYCODE_VOLUME_DOWN")
             return True
         except Exception as e:
             logger.exception("Error in volume_down")
@@ -134,7 +507,7 @@ class AndroidExecutor(Executor):
     def swipe_up(self, observation: str) -> bool:
         try:
             logger.debug("swipe up")
-            run_adb_command(["shell", "input", "swipe", "500", "1500", "500", "500"])
+            self.run_shell("input swipe 500 1500 500 500")
             return True
         except Exception as e:
             logger.exception("Error in swipe_up")
@@ -143,7 +516,7 @@ class AndroidExecutor(Executor):
     def swipe_down(self, observation: str) -> bool:
         try:
             logger.debug("swipe down")
-            run_adb_command(["shell", "input", "swipe", "500", "500", "500", "1500"])
+            self.run_shell("input swipe 500 500 500 1500")
             return True
         except Exception as e:
             logger.exception("Error in swipe_down")
@@ -152,7 +525,7 @@ class AndroidExecutor(Executor):
     def navigate_back(self, observation: str) -> bool:
         try:
             logger.debug("navigate back")
-            run_adb_command(["shell", "input", "keyevent", "KEYCODE_BACK"])
+            self.run_shell("input keyevent KEYCODE_BACK")
             return True
         except Exception as e:
             logger.exception("Error in navigate_back")
@@ -161,7 +534,7 @@ class AndroidExecutor(Executor):
     def minimize_app(self, observation: str) -> bool:
         try:
             logger.debug("minimize app")
-            run_adb_command(["shell", "input", "keyevent", "KEYCODE_HOME"])
+            self.run_shell("input keyevent KEYCODE_HOME")
             return True
         except Exception as e:
             logger.exception("Error in minimize_app")
@@ -170,46 +543,211 @@ class AndroidExecutor(Executor):
     def click_at_a_point(self, x: int, y: int, observation: str) -> bool:
         try:
             logger.debug(f"click at a point x y {x} {y}")
-            run_adb_command(["shell", "input", "tap", str(x), str(y)])
+            self.run_shell(f"input tap {x} {y}")
             return True
         except Exception as e:
             logger.exception("Error in click_at_a_point")
             return False
 
-    def screenshot(
-        self, observation: str, as_base64: bool = False, use_tempfile: bool = False
-    ) -> Union[Image.Image, str, tuple]:
+    def screenshot(self, observation: str) -> Optional[Frame]:
         try:
-            logger.debug(f"Take a screenshot use_tempfile={use_tempfile}")
-            result = run_adb_command(["exec-out", "screencap", "-p"], text_mode=False)
-            if result.returncode != 0:
-                return "" if as_base64 or use_tempfile else None
+            logger.debug("Take a screenshot")
+            if self.stream is not None and self.stream.running:
+                # newest streamed frame that was captured after the last action
+                frame = self.stream.wait_for_frame(after=self.last_action_time)
+                if frame is not None:
+                    return frame
+            return self._capture()
+        except Exception as e:
+            logger.exception("Error in screenshot")
+            return None
 
-            screenshot = Image.open(io.BytesIO(result.stdout))
+    @property
+    def probe_is_screenshot(self) -> bool:
+        return self.capture_mode == "raw"
 
-            if use_tempfile or self.screenshot_as_tempfile:
-                with NamedTemporaryFile(delete=False, suffix=".png") as temp_file:
-                    screenshot.save(temp_file, format="PNG")
-                    temp_file_path = temp_file.name
-                return temp_file_path
+    def probe_screen(self) -> Optional[Frame]:
+        """
+        Raw captures are the cheap path, in png mode probes are raw as well so the device only
+        compresses the settled frame.
+        """
+        if self.capture_mode == "raw":
+            return self.screenshot("Waiting for the screen to settle")
+        try:
+            result = self.exec_out("screencap")
+            if result.returncode != 0:
+                return None
+            return Frame(decode_raw_screencap(result.stdout))
+        except Exception:
+            logger.exception("Error in probe_screen")
+            return None
 
-            if as_base64 or self.screenshot_as_base64:
-                buffered = io.BytesIO()
-                screenshot.save(buffered, format="PNG")
-                base64_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
-                return base64_str
+    def _capture(self) -> Optional[Frame]:
+        started = time.time()
+        if self.capture_mode == "png":
+            result = self.exec_out("screencap -p")
+        else:
+            result = self.exec_out("screencap")
+        if result.returncode != 0:
+            return None
 
-            return screenshot
-        except Exception as e:
-            logger.exception("Error in screenshot")
-            return "" if as_base64 or use_tempfile else None
+        # Encodings are produced lazily by the frame, only when a backend asks for them
+        if self.capture_mode == "png":
+            frame = Frame(png_bytes=result.stdout, timestamp=started)
+        else:
+            frame = Frame(decode_raw_screencap(result.stdout), timestamp=started)
+        if not geometry_matches(self._geometry, frame):
+            self.invalidate_geometry()
+        return frame
 
     def run_shell_command(self, command: str) -> bool:
         try:
             logger.debug(f"Run shell command {command}")
-            result = run_adb_command(["shell", command])
+            result = self.run_shell(command)
             logger.info(result)
             return True
         except Exception as e:
             logger.exception(f"Error in run_shell_command {e}")
             return False
+
+
+class AsyncAndroidExecutor(AsyncExecutor):
+    """
+    Asyncio android executor. Commands and captures go over asyncio sockets to the adb server,
+    or through awaited `adb` processes when no server is running, so one event loop can drive
+    many devices at once.
+    """
+
+    def __init__(
+        self, serial: Optional[str] = None, use_adb_server: bool = True, capture_mode: str = "raw"
+    ):
+        self.serial = serial
+        self.capture_mode = capture_mode
+        self.adb = AsyncAdbClient(serial) if use_adb_server and adb_server_available() else None
+        self._geometry = None
+
+    async def run_shell(self, commands: Union[str, List[str]]) -> CompletedProcess:
+        """Runs shell command(s) on the device in one round trip."""
+        if isinstance(commands, str):
+            commands = [commands]
+        if self.adb is not None:
+            return await self.adb.shell("; ".join(commands))
+        return await run_adb_command_async(["shell", "; ".join(commands)], serial=self.serial)
+
+    async def exec_out(self, command: str) -> CompletedProcess:
+        """Runs a command whose binary stdout is needed as-is, e.g. screencap."""
+        if self.adb is not None:
+            try:
+                stdout = await self.adb.exec_out(command)
+                return CompletedProcess(["exec-out", command], 0, stdout, b"")
+            except (OSError, AdbError, asyncio.IncompleteReadError) as e:
+                logger.error(f"adb exec-out {command} failed: {e}")
+                return CompletedProcess(["exec-out", command], 1, b"", str(e).encode())
+        return await run_adb_command_async(
+            ["exec-out"] + command.split(), text_mode=False, serial=self.serial
+        )
+
+    async def _act(self, name: str, commands: Union[str, List[str]]) -> bool:
+        try:
+            logger.debug(name.replace("_", " "))
+            await self.run_shell(commands)
+            return True
+        except Exception:
+            logger.exception(f"Error in {name}")
+            return False
+
+    async def screen_geometry(self) -> ScreenGeometry:
+        if self._geometry is None:
+            self._geometry = parse_geometry((await self.run_shell(GEOMETRY_COMMANDS)).stdout)
+            logger.debug(f"Device geometry {self._geometry}")
+        return self._geometry
+
+    def invalidate_geometry(self):
+        self._geometry = None
+
+    async def click_mouse(self, observation: str, button: str = "left"):
+        raise NotImplementedError("click mouse is not available in android")
+
+    async def double_click_mouse(self, button: str, observation: str):
+        raise NotImplementedError("double click mouse is not available in android")
+
+    async def move_mouse(self, x: int, y: int, observation: str) -> bool:
+        return await self._act("move_mouse", f"input tap {x} {y}")
+
+    async def press_key(self, keys: List[str], observation: str) -> bool:
+        return await self._act(
+            "press_key", [f"input keyevent {shlex.quote(key.upper())}" for key in keys]
+        )
+
+    async def type_text(self, text: str, observation: str) -> bool:
+        return await self._act("type_text", type_text_commands(text))
+
+    async def scroll(self, clicks: int, observation: str) -> bool:
+        if clicks > 0:
+            return await self._act("scroll", "input swipe 500 1500 500 500")
+        return await self._act("scroll", "input swipe 500 500 500 1500")
+
+    async def swipe_left(self, observation: str) -> bool:
+        return await self._act("swipe_left", "input swipe 700 1000 100 1000")
+
+    async def swipe_right(self, observation: str) -> bool:
+        return await self._act("swipe_right", "input swipe 100 1000 700 1000")
+
+    async def volume_up(self, observation: str) -> bool:
+        return await self._act("volume_up", "input keyevent KEYCODE_VOLUME_UP")
+
+    async def volume_down(self, observation: str) -> bool:
+        return await self._act("volume_down", "input keyevent KEYCODE_VOLUME_DOWN")
+
+    async def swipe_up(self, observation: str) -> bool:
+        return await self._act("swipe_up", "input swipe 500 1500 500 500")
+
+    async def swipe_down(self, observation: str) -> bool:
+        return await self._act("swipe_down", "input swipe 500 500 500 1500")
+
+    async def navigate_back(self, observation: str) -> bool:
+        return await self._act("navigate_back", "input keyevent KEYCODE_BACK")
+
+    async def minimize_app(self, observation: str) -> bool:
+        return await self._act("minimize_app", "input keyevent KEYCODE_HOME")
+
+    async def click_at_a_point(self, x: int, y: int, observation: str) -> bool:
+        return await self._act("click_at_a_point", f"input tap {x} {y}")
+
+    @property
+    def probe_is_screenshot(self) -> bool:
+        return self.capture_mode == "raw"
+
+    async def probe_screen(self) -> Optional[Frame]:
+        """See `AndroidExecutor.probe_screen`."""
+        if self.capture_mode == "raw":
+            return await self.screenshot("Waiting for the screen to settle")
+        try:
+            result = await self.exec_out("screencap")
+            if result.returncode != 0:
+                return None
+            return Frame(decode_raw_screencap(result.stdout))
+        except Exception:
+            logger.exception("Error in probe_screen")
+            return None
+
+    async def screenshot(self, observation: str) -> Optional[Frame]:
+        try:
+            logger.debug("Take a screenshot")
+            started = time.time()
+            if self.capture_mode == "png":
+                result = await self.exec_out("screencap -p")
+            else:
+                result = await self.exec_out("screencap")
+            if result.returncode != 0:
+                return None
+            if self.capture_mode == "png":
+                frame = Frame(png_bytes=result.stdout, timestamp=started)
+            else:
+                frame = Frame(decode_raw_screencap(result.stdout), timestamp=started)
+            if not geometry_matches(self._geometry, frame):
+                self.invalidate_geometry()
+            return frame
+        except Exception:
+            logger.exception("Error in screenshot")
+            return None
@@ -0,0 +1,143 @@
+import base64
+import io
+import threading
+import time
+from typing import Optional, Tuple
+
+from PIL import Image, ImageChops, ImageStat
+
+# Size of the grayscale thumbnail used to compare frames cheaply
+THUMBNAIL_SIZE = (64, 64)
+
+
+class Frame:
+    """
+    A single screenshot kept in memory.
+
+    Decoded pixels, resized variants and PNG/JPEG/base64 encodings are computed on first use
+    and cached, so the planner, the finder and the executor can share one capture without
+    encoding it more than once or writing it to disk.
+    """
+
+    def __init__(
+        self,
+        image: Optional[Image.Image] = None,
+        png_bytes: Optional[bytes] = None,
+        timestamp: Optional[float] = None,
+    ):
+        if image is None and png_bytes is None:
+            raise ValueError("A frame needs either an image or PNG bytes")
+        self._image = image
+        self._encoded = {}
+        if png_bytes is not None:
+            self._encoded["PNG"] = png_bytes
+        self._base64 = {}
+        self._resized = {}
+        self._lock = threading.Lock()
+        self.timestamp = timestamp if timestamp is not None else time.time()
+
+    @property
+    def image(self) -> Image.Image:
+        """Decoded pixels, decoded lazily when the frame was built from PNG bytes."""
+        if self._image is None:
+            with self._lock:
+                if self._image is None:
+                    image = Image.open(io.BytesIO(self._encoded["PNG"]))
+                    image.load()
+                    self._image = image
+        return self._image
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.image.size
+
+    @property
+    def width(self) -> int:
+        return self.size[0]
+
+    @property
+    def height(self) -> int:
+        return self.size[1]
+
+    def resized(self, width: int, height: int) -> "Frame":
+        """Returns a (cached) frame scaled to width x height."""
+        key = (width, height)
+        frame = self._resized.get(key)
+        if frame is None:
+            image = self.image.resize((width, height), Image.Resampling.LANCZOS)
+            frame = self._resized.setdefault(key, Frame(image, timestamp=self.timestamp))
+        return frame
+
+    def thumbnail(self) -> Image.Image:
+        """Small grayscale version of the frame, used for cheap comparisons."""
+        thumbnail = self._resized.get("thumbnail")
+        if thumbnail is None:
+            image = self.image.convert("L").resize(THUMBNAIL_SIZE, Image.Resampling.BOX)
+            thumbnail = self._resized.setdefault("thumbnail", image)
+        return thumbnail
+
+    def difference(self, other: "Frame") -> float:
+        """Mean absolute pixel difference between two frames' thumbnails, from 0 to 1."""
+        diff = ImageChops.difference(self.thumbnail(), other.thumbnail())
+        return ImageStat.Stat(diff).mean[0] / 255
+
+    def crop(self, box: Tuple[int, int, int, int]) -> "Frame":
+        """Returns the (left, top, right, bottom) region of the frame as a new frame."""
+        return Frame(self.image.crop(box), timestamp=self.timestamp)
+
+    def dhash(self, hash_size: int = 8) -> int:
+        """Perceptual difference hash, stable under small rendering and scaling changes."""
+        key = ("dhash", hash_size)
+        value = self._resized.get(key)
+        if value is None:
+            image = self.image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BOX)
+            pixels = list(image.getdata())
+            value = 0
+            for row in range(hash_size):
+                for col in range(hash_size):
+                    left = pixels[row * (hash_size + 1) + col]
+                    right = pixels[row * (hash_size + 1) + col + 1]
+                    value = (value << 1) | (left > right)
+            value = self._resized.setdefault(key, value)
+        return value
+
+    def encode(self, format: str = "PNG", quality: int = 85) -> bytes:
+        """Returns the frame encoded as PNG or JPEG bytes, encoding only once per format."""
+        format = format.upper()
+        data = self._encoded.get(format)
+        if data is None:
+            image = self.image
+            buffered = io.BytesIO()
+            if format == "JPEG":
+                if image.mode != "RGB":
+                    image = image.convert("RGB")
+                image.save(buffered, format="JPEG", quality=quality)
+            else:
+                image.save(buffered, format=format)
+            data = self._encoded.setdefault(format, buffered.getvalue())
+        return data
+
+    def png(self) -> bytes:
+        return self.encode("PNG")
+
+    def jpeg(self) -> bytes:
+        return self.encode("JPEG")
+
+    def base64(self, format: str = "PNG") -> str:
+        format = format.upper()
+        text = self._base64.get(format)
+        if text is None:
+            text = self._base64.setdefault(
+                format, base64.b64encode(self.encode(format)).decode("utf-8")
+            )
+        return text
+
+    def data_url(self, format: str = "PNG") -> str:
+        return f"data:{self.mime_type(format)};base64,{self.base64(format)}"
+
+    @staticmethod
+    def mime_type(format: str = "PNG") -> str:
+        return f"image/{format.lower()}"
+
+    def __repr__(self):
+        return f"Frame(size={self.size if self._image is not None else '?'}, encoded={list(self._encoded)})"
@@ -0,0 +1,76 @@
+import subprocess
+import threading
+from typing import Dict, List, Optional
+
+from . import logger
+from .adb import AdbError, adb_server_available, get_adb_client
+from .android import AndroidExecutor
+
+
+def discover_devices() -> List[str]:
+    """Serials of the attached devices that are online, like `adb devices`."""
+    if adb_server_available():
+        try:
+            return [serial for serial, state in get_adb_client().devices() if state == "device"]
+        except (OSError, AdbError):
+            logger.exception("Could not list devices through the adb server")
+    result = subprocess.run(["adb", "devices"], stdout=subprocess.PIPE, text=True)
+    serials = []
+    for line in result.stdout.splitlines()[1:]:
+        parts = line.split()
+        if len(parts) == 2 and parts[1] == "device":
+            serials.append(parts[0])
+    return serials
+
+
+class DevicePool:
+    """
+    Serial-aware Android executors for every attached device.
+
+    Executors are created once per device and reused across tasks, so their shell
+    sessions and cached geometry stay warm.
+    """
+
+    def __init__(self, serials: Optional[List[str]] = None, **executor_kwargs):
+        self.executor_kwargs = executor_kwargs
+        self._fixed_serials = serials
+        self._executors: Dict[str, AndroidExecutor] = {}
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self) -> List[str]:
+        """Picks up newly attached devices and returns the serials added."""
+        serials = self._fixed_serials if self._fixed_serials is not None else discover_devices()
+        added = []
+        with self._lock:
+            for serial in serials:
+                if serial not in self._executors:
+                    self._executors[serial] = AndroidExecutor(serial, **self.executor_kwargs)
+                    added.append(serial)
+        if added:
+            logger.info(f"Device pool added {added}")
+        return added
+
+    @property
+    def serials(self) -> List[str]:
+        with self._lock:
+            return list(self._executors)
+
+    def executor(self, serial: str) -> AndroidExecutor:
+        with self._lock:
+            return self._executors[serial]
+
+    def is_healthy(self, serial: str) -> bool:
+        """A device is usable when it answers over adb and has finished booting."""
+        try:
+            result = self.executor(serial).run_shell("getprop sys.boot_completed")
+            return result.returncode == 0 and result.stdout.strip() == "1"
+        except Exception:
+            logger.exception(f"Health check failed for {serial}")
+            return False
+
+    def close(self):
+        with self._lock:
+            for executor in self._executors.values():
+                executor.close()
+            self._executors.clear()
@@ -0,0 +1,153 @@
+import asyncio
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from . import AsyncExecutor, Executor, Frame, logger
+from clickclickclick.cancel import current_token
+
+
+@dataclass
+class SettleResult:
+    frame: Optional[Frame]  # the settled screen, usable as the step's screenshot
+    settle_time: float  # seconds until the screen was considered stable (or the ceiling)
+    stable: bool  # False when the ceiling was hit while the screen was still changing
+    captures: int  # probes and screenshots taken
+
+
+def settle_options(c) -> dict:
+    """The configured settle parameters, as keyword arguments for `wait_for_stable_screen`."""
+    return dict(
+        stable_ms=c.SETTLE_STABLE_MS,
+        timeout=c.SETTLE_TIMEOUT_IN_SECONDS,
+        interval=c.SETTLE_INTERVAL_IN_SECONDS,
+        threshold=c.SETTLE_THRESHOLD,
+    )
+
+
+def wait_for_stable_screen(
+    executor: Executor,
+    stable_ms: int = 300,
+    timeout: float = 3.0,
+    interval: float = 0.1,
+    threshold: float = 0.01,
+    cancel: Optional[threading.Event] = None,
+) -> SettleResult:
+    """
+    Probes the screen until it has not changed by more than `threshold` for `stable_ms`, or
+    for at most `timeout` seconds. Streaming executors are checked on their buffered frames.
+    """
+    token = current_token()
+
+    def stopped() -> bool:
+        return (cancel is not None and cancel.is_set()) or (token is not None and token.cancelled)
+
+    stream = getattr(executor, "stream", None)
+    if stream is not None and stream.running:
+        return _wait_on_stream(executor, stream, stable_ms, timeout, threshold, stopped)
+
+    start = time.monotonic()
+    previous = executor.probe_screen()
+    probe_time = time.monotonic() - start
+    captures = 1
+    stable_since = time.monotonic()
+    while True:
+        now = time.monotonic()
+        stable = previous is not None and (now - stable_since) * 1000 >= stable_ms
+        if stable or now - start >= timeout or stopped():
+            if not stable:
+                logger.debug(f"Screen did not settle within {now - start:.2f}s")
+            settle_time = stable_since - start if stable else now - start
+            frame = previous
+            if not executor.probe_is_screenshot:
+                frame = executor.screenshot("Screen settled")
+                captures += 1
+            return SettleResult(frame, settle_time, stable, captures)
+
+        # adb captures are full size, spacing them by their own duration keeps the link usable
+        time.sleep(max(interval, probe_time))
+        probing = time.monotonic()
+        probe = executor.probe_screen()
+        probe_time = time.monotonic() - probing
+        captures += 1
+        if probe is None or previous is None or probe.difference(previous) > threshold:
+            stable_since = time.monotonic()
+        if probe is not None:
+            previous = probe
+
+
+def _wait_on_stream(executor, stream, stable_ms, timeout, threshold, stopped) -> SettleResult:
+    start = time.monotonic()
+    since = getattr(executor, "last_action_time", 0.0)
+    newest = None
+    while True:
+        frame = stream.wait_for_frame(
+            after=newest.timestamp if newest else since,
+            timeout=max(timeout - (time.monotonic() - start), 0),
+        )
+        if frame is None:
+            return SettleResult(newest, time.monotonic() - start, False, 0)
+        newest = frame
+        # how far back the buffered frames after the action match the newest one
+        frames = stream.frames(since=since)
+        stable_since = newest.timestamp
+        for previous in reversed(frames[:-1]):
+            if previous.difference(newest) > threshold:
+                break
+            stable_since = previous.timestamp
+        if (newest.timestamp - stable_since) * 1000 >= stable_ms:
+            settle_time = max(stable_since - since, 0) if since else 0.0
+            return SettleResult(newest, settle_time, True, len(frames))
+        if time.monotonic() - start >= timeout or stopped():
+            return SettleResult(newest, time.monotonic() - start, False, len(frames))
+
+
+async def wait_for_stable_screen_async(
+    executor: AsyncExecutor,
+    stable_ms: int = 300,
+    timeout: float = 3.0,
+    interval: float = 0.1,
+    threshold: float = 0.01,
+) -> SettleResult:
+    """
+    `wait_for_stable_screen` for the async engine. A thread-backed executor settles with the
+    blocking version on a worker thread, which keeps using its screen stream if it has one.
+    """
+    inner = getattr(executor, "executor", None)
+    if isinstance(inner, Executor):
+        return await asyncio.to_thread(
+            wait_for_stable_screen, inner, stable_ms, timeout, interval, threshold
+        )
+
+    start = time.monotonic()
+    previous = await executor.probe_screen()
+    probe_time = time.monotonic() - start
+    captures = 1
+    stable_since = time.monotonic()
+    while True:
+        now = time.monotonic()
+        stable = previous is not None and (now - stable_since) * 1000 >= stable_ms
+        if stable or now - start >= timeout:
+            if not stable:
+                logger.debug(f"Screen did not settle within {now - start:.2f}s")
+            settle_time = stable_since - start if stable else now - start
+            frame = previous
+            if not executor.probe_is_screenshot:
+                frame = await executor.screenshot("Screen settled")
+                captures += 1
+            return SettleResult(frame, settle_time, stable, captures)
+
+        await asyncio.sleep(max(interval, probe_time))
+        probing = time.monotonic()
+        probe = await executor.probe_screen()
+        probe_time = time.monotonic() - probing
+        captures += 1
+        if (
+            probe is None
+            or previous is None
+            or await asyncio.to_thread(probe.difference, previous) > threshold
+        ):
+            stable_since = time.monotonic()
+        if probe is not None:
+            previous = probe
@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, List, Optional
+
+from . import Frame, logger
+
+
+class ScreenStream:
+    """
+    Captures frames continuously on a background thread into a small ring buffer.
+
+    `capture` is called back to back (optionally `interval` seconds apart) and each frame is
+    stamped with the time its capture started, so a frame newer than an action is known to
+    show the screen after that action.
+    """
+
+    def __init__(
+        self, capture: Callable[[], Optional[Frame]], size: int = 8, interval: float = 0.0
+    ):
+        self.capture = capture
+        self.interval = interval
+        self._frames = deque(maxlen=size)
+        self._new_frame = threading.Condition()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="screen-stream", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.is_set():
+            started = time.time()
+            try:
+                frame = self.capture()
+            except Exception:
+                logger.exception("Error while streaming the screen")
+                frame = None
+            if frame is not None:
+                frame.timestamp = started
+                with self._new_frame:
+                    self._frames.append(frame)
+                    self._new_frame.notify_all()
+            elif self._stopped.wait(0.5):
+                break  # back off while the device is unavailable
+            if self.interval:
+                self._stopped.wait(self.interval)
+
+    def latest(self) -> Optional[Frame]:
+        with self._new_frame:
+            return self._frames[-1] if self._frames else None
+
+    def frames(self, since: float = 0.0) -> List[Frame]:
+        """Buffered frames captured at or after `since`, oldest first."""
+        with self._new_frame:
+            return [frame for frame in self._frames if frame.timestamp >= since]
+
+    def wait_for_frame(self, after: float = 0.0, timeout: float = 5.0) -> Optional[Frame]:
+        """Returns the newest frame whose capture started after `after`, waiting if needed."""
+        deadline = time.monotonic() + timeout
+        with self._new_frame:
+            while not self._frames or self._frames[-1].timestamp <= after:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.running:
+                    return None
+                self._new_frame.wait(remaining)
+            return self._frames[-1]
@@ -0,0 +1,81 @@
+import asyncio
+from typing import List, Optional
+
+from . import AsyncExecutor, Executor, Frame, ScreenGeometry
+
+
+class ThreadedExecutor(AsyncExecutor):
+    """
+    Runs a blocking `Executor` on the default thread pool, so existing executors can be used
+    by the async task engine unchanged.
+    """
+
+    def __init__(self, executor: Executor):
+        self.executor = executor
+
+    @property
+    def stream(self):
+        return getattr(self.executor, "stream", None)
+
+    async def move_mouse(self, x: int, y: int, observation: str) -> bool:
+        return await asyncio.to_thread(self.executor.move_mouse, x, y, observation)
+
+    async def press_key(self, key: List[str], observation: str) -> bool:
+        return await asyncio.to_thread(self.executor.press_key, key, observation)
+
+    async def type_text(self, text: str, observation: str) -> bool:
+        return await asyncio.to_thread(self.executor.type_text, text, observation)
+
+    async def click_mouse(self, observation: str, button: str = "left") -> bool:
+        return await asyncio.to_thread(self.executor.click_mouse, observation, button)
+
+    async def double_click_mouse(self, button: str, observation: str) -> bool:
+        return await asyncio.to_thread(self.executor.double_click_mouse, button, observation)
+
+    async def scroll(self, clicks: int, observation: str) -> bool:
+        return await asyncio.to_thread(self.executor.scroll, clicks, observation)
+
+    async def swipe_right(self, observation: str) -> bool:
+        return await asyncio.to_thread(self.executor.swipe_right, observation)
+
+    async def swipe_left(self, observation: str) -> bool:
+        return await asyncio.to_thread(self.executor.swipe_left, observation)
+
+    async def swipe_up(self, observation: str) -> bool:
+        return await asyncio.to_thread(self.executor.swipe_up, observation)
+
+    async def swipe_down(self, observation: str) -> bool:
+        return await asyncio.to_thread(self.executor.swipe_down, observation)
+
+    async def volume_up(self, observation: str) -> bool:
+        return await asyncio.to_thread(self.executor.volume_up, observation)
+
+    async def volume_down(self, observation: str) -> bool:
+        return await asyncio.to_thread(self.executor.volume_down, observation)
+
+    async def navigate_back(self, observation: str) -> bool:
+        return await asyncio.to_thread(self.executor.navigate_back, observation)
+
+    async def minimize_app(self, observation: str) -> bool:
+        return await asyncio.to_thread(self.executor.minimize_app, observation)
+
+    @property
+    def probe_is_screenshot(self) -> bool:
+        return self.executor.probe_is_screenshot
+
+    async def probe_screen(self) -> Optional[Frame]:
+        return await asyncio.to_thread(self.executor.probe_screen)
+
+    async def screenshot(self, observation: str) -> Frame:
+        return await asyncio.to_thread(self.executor.screenshot, observation)
+
+    async def click_at_a_point(self, x: int, y: int, observation: str) -> bool:
+        return await asyncio.to_thread(self.executor.click_at_a_point, x, y, observation)
+
+    async def screen_geometry(self) -> ScreenGeometry:
+        return await asyncio.to_thread(self.executor.screen_geometry)
+
+    async def close(self):
+        close = getattr(self.executor, "close", None)
+        if close is not None:
+            await asyncio.to_thread(close)
@@ -1,20 +1,21 @@
-import base64
-import io
 import logging
-from tempfile import NamedTemporaryFile
-from typing import List, Union
+from typing import List, Optional
 
 import pyautogui
-from PIL import Image
 
-from . import Executor, logger
+from . import Executor, Frame, ScreenGeometry, logger
 
 
 class WindowsExecutor(Executor):
     def __init__(self):
         super().__init__()
-        self.screenshot_as_base64 = False
-        self.screenshot_as_tempfile = False
+        self._geometry = None
+
+    def screen_geometry(self) -> ScreenGeometry:
+        if self._geometry is None:
+            width, height = pyautogui.size()
+            self._geometry = ScreenGeometry(width, height)
+        return self._geometry
 
     def move_mouse(self, x: int, y: int, observation: str) -> bool:
         try:
@@ -112,39 +113,20 @@ class WindowsExecutor(Executor):
         # Windows-specific logic to minimize the currently active window
         raise NotImplementedError("Minimize app is not implemented on Windows")
 
-    def screenshot(
-        self, observation: str, as_base64: bool = False, use_tempfile: bool = False
-    ) -> Union[Image.Image, str, tuple]:
+    def screenshot(self, observation: str) -> Optional[Frame]:
         """
         Takes a screenshot.
 
-        Args:
-            as_base64 (bool): Whether to return the screenshot as a base64-encoded string. Defaults to False.
-            use_tempfile (bool): Whether to use a temporary file for storing the screenshot. Defaults to False.
-
         Returns:
-            Union[Image.Image, str, tuple]: The screenshot as a PIL Image object, a base64-encoded string,
-                                             or a tuple containing the PIL Image object and the file path if use_tempfile is True.
+            Optional[Frame]: The screenshot as an in-memory frame, encoded lazily on demand,
+                             or None if the capture failed.
         """
         try:
-            logger.debug(f"Take a screenshot use_tempfile={use_tempfile}")
-            screenshot = pyautogui.screenshot()
-            if use_tempfile or self.screenshot_as_tempfile:
-                with NamedTemporaryFile(delete=False, suffix=".png") as temp_file:
-                    screenshot.save(temp_file, format="PNG")
-                    temp_file_path = temp_file.name
-                return temp_file_path
-
-            if as_base64 or self.screenshot_as_base64:
-                buffered = io.BytesIO()
-                screenshot.save(buffered, format="PNG")
-                base64_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
-                return base64_str
-
-            return screenshot
+            logger.debug("Take a screenshot")
+            return Frame(pyautogui.screenshot())
         except Exception as e:
             logger.exception("Error in screenshot")
-            return "" if as_base64 or use_tempfile else None
+            return None
 
     def apple_script(self, script: str, observation: str) -> bool:
         # AppleScript is specific to macOS, so we raise an error
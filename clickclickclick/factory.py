@@ -0,0 +1,114 @@
+from clickclickclick.executor.android import AndroidExecutor, AsyncAndroidExecutor
+from clickclickclick.executor.threaded import ThreadedExecutor
+from clickclickclick.finder.accessibility import AccessibilityFinder, AsyncAccessibilityFinder
+from clickclickclick.finder.cache import AsyncCachingFinder, CachingFinder, get_element_cache
+from clickclickclick.finder.ensemble import EnsembleFinder
+from clickclickclick.finder.gemini import GeminiFinder
+from clickclickclick.finder.local_ollama import OllamaFinder
+from clickclickclick.finder.openai import AsyncOpenAIFinder, OpenAIFinder
+from clickclickclick.finder.threaded import ThreadedFinder
+from clickclickclick.planner.gemini import GeminiPlanner
+from clickclickclick.planner.local_ollama import OllamaPlanner
+from clickclickclick.planner.openai import AsyncChatGPTPlanner, ChatGPTPlanner
+from clickclickclick.planner.threaded import ThreadedPlanner
+
+
+def get_executor(platform, serial=None, stream=False):
+    if platform.lower() == "win":
+        # pyautogui needs a display, a headless server driving android devices never loads it
+        from clickclickclick.executor.wind import WindowsExecutor
+
+        return WindowsExecutor()
+    executor = AndroidExecutor(serial)
+    if stream:
+        executor.start_stream()
+    return executor
+
+
+def get_planner(planner_model, config, executor):
+    if planner_model.lower() == "openai":
+        return ChatGPTPlanner(config)
+    elif planner_model.lower() == "gemini":
+        return GeminiPlanner(config)
+    elif planner_model.lower() == "ollama":
+        return OllamaPlanner(config, executor)
+    raise ValueError(f"Unsupported planner model: {planner_model}")
+
+
+def get_finder(finder_model, config, executor):
+    finder = get_vision_finder(finder_model, config, executor)
+    if config.ACCESSIBILITY_FINDER and isinstance(executor, AndroidExecutor):
+        # resolve elements from the accessibility tree before calling the vision model
+        finder = AccessibilityFinder(finder, executor)
+    if config.ELEMENT_CACHE:
+        finder = CachingFinder(finder, executor, get_finder_cache(config))
+    return finder
+
+
+def get_vision_finder(finder_model, config, executor):
+    """The model finder, or an ensemble of several comma separated ones."""
+    finder_models = [name.strip() for name in finder_model.split(",") if name.strip()]
+    if len(finder_models) > 1:
+        finders = {
+            name: get_model_finder(name, config.with_finder(name), executor)
+            for name in finder_models
+        }
+        return EnsembleFinder(
+            finders,
+            executor,
+            config.FINDER_ENSEMBLE_MODE,
+            config.FINDER_ENSEMBLE_TIMEOUT_IN_SECONDS,
+        )
+    return get_model_finder(finder_model, config, executor)
+
+
+def get_finder_cache(config):
+    return get_element_cache(
+        config.ELEMENT_CACHE_SIZE, config.ELEMENT_CACHE_TTL_IN_SECONDS, config.ELEMENT_CACHE_PATH
+    )
+
+
+def get_model_finder(finder_model, config, executor):
+    if finder_model.lower() == "openai":
+        return OpenAIFinder(config, executor)
+    elif finder_model.lower() == "gemini":
+        return GeminiFinder(config, executor)
+    elif finder_model.lower() == "ollama":
+        return OllamaFinder(config, executor)
+    elif finder_model.lower() == "mlx":
+        # mlx only installs on Apple silicon
+        from clickclickclick.finder.mlx import MLXFinder
+
+        return MLXFinder(config, executor)
+    raise ValueError(f"Unsupported finder model: {finder_model}")
+
+
+def get_async_executor(platform, serial=None):
+    if platform.lower() == "android":
+        return AsyncAndroidExecutor(serial)
+    return ThreadedExecutor(get_executor(platform, serial))
+
+
+def get_async_planner(planner_model, config, executor):
+    if planner_model.lower() == "openai":
+        return AsyncChatGPTPlanner(config)
+    return ThreadedPlanner(get_planner(planner_model, config, executor))
+
+
+def get_async_finder(finder_model, config, executor, sync_executor=None):
+    """
+    The `get_finder` stack for the async engine. OpenAI lookups, the accessibility tree and
+    the cache are awaited natively, other models run on worker threads with `sync_executor`,
+    a blocking executor for the same device.
+    """
+    if finder_model.lower() == "openai":
+        finder = AsyncOpenAIFinder(config, executor)
+    else:
+        if sync_executor is None:
+            sync_executor = executor.executor  # a ThreadedExecutor
+        finder = ThreadedFinder(get_vision_finder(finder_model, config, sync_executor))
+    if config.ACCESSIBILITY_FINDER and isinstance(executor, AsyncAndroidExecutor):
+        finder = AsyncAccessibilityFinder(finder, executor)
+    if config.ELEMENT_CACHE:
+        finder = AsyncCachingFinder(finder, executor, get_finder_cache(config))
+    return finder
@@ -1,18 +1,44 @@
 from abc import ABC, abstractmethod
-from typing import List
-import subprocess
-import re
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
 import base64
 import json
-import pyautogui
 import logging
-from clickclickclick.executor import Executor
-from PIL import Image
+import math
+import statistics
+from clickclickclick import cancel
+from clickclickclick.executor import AsyncExecutor, Executor, Frame
+from clickclickclick.hedge import get_hedger
 from pydantic import BaseModel
 
 logger = logging.getLogger(__name__)
 
 
+def box_iou(a, b) -> float:
+    """Intersection over union of two ymin,xmin,ymax,xmax boxes."""
+    height = min(a[2], b[2]) - max(a[0], b[0])
+    width = min(a[3], b[3]) - max(a[1], b[1])
+    if height <= 0 or width <= 0:
+        return 0.0
+    intersection = height * width
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def cut_off(box, segment, width, height) -> bool:
+    """Whether a ymin,xmin,ymax,xmax box touches an edge of its segment inside the frame."""
+    ymin, xmin, ymax, xmax = box
+    left, top, right, bottom = segment
+    margin = 0.01 * max(right - left, bottom - top)
+    return (
+        (top > 0 and ymin <= top + margin)
+        or (left > 0 and xmin <= left + margin)
+        or (bottom < height and ymax >= bottom - margin)
+        or (right < width and xmax >= right - margin)
+    )
+
+
 class FinderResponseLLM(BaseModel):
     ymin: int
     ymax: int
@@ -25,6 +51,12 @@ class BaseFinder(ABC):
     IMAGE_HEIGHT = None
     OUTPUT_WIDTH = None
     OUTPUT_HEIGHT = None
+    SEARCH_MODE = "single"  # "single" scaled image, "tiled" native resolution, or "two_pass"
+    TILE_OVERLAP = 0.2
+    MAX_TILES = 8
+    COARSE_SIZE = 256
+    REFINE_SIZE = 384
+    hedger = None
 
     def __init__(self, api_key, model_name, generation_config, system_prompt, executor: Executor):
         self.model_name = model_name
@@ -37,93 +69,341 @@ class BaseFinder(ABC):
             encoded_string = base64.b64encode(image_file.read()).decode("utf-8")
         return encoded_string
 
-    def resize(self, image, new_size):
+    def apply_config(self, c):
+        """Search and hedging settings shared by all finders."""
+        self.hedger = get_hedger(f"finder:{self.model_name}", c)
+        self.SEARCH_MODE = c.FINDER_SEARCH_MODE
+        self.TILE_OVERLAP = c.FINDER_TILE_OVERLAP
+        self.MAX_TILES = c.FINDER_MAX_TILES
+        self.COARSE_SIZE = c.FINDER_COARSE_SIZE
+        self.REFINE_SIZE = c.FINDER_REFINE_SIZE
+
+    def resize(self, frame: Frame, new_size):
+        """A single segment: the whole frame scaled down to new_size x new_size."""
         if new_size:
             target_width, target_height = new_size, new_size
-            resized_image = image.resize((target_width, target_height), Image.Resampling.LANCZOS)
-            segments = [(resized_image, (0, 0, target_width, target_height))]
+            resized_frame = frame.resized(target_width, target_height)
+            segments = [(resized_frame, (0, 0, target_width, target_height))]
             total_width, total_height = target_width, target_height
         return segments, total_width, total_height
 
+    def tile(self, frame: Frame, new_size):
+        """
+        Overlapping square tiles covering the frame at native resolution.
+
+        Tiles are new_size pixels wide, grown (and scaled back down to new_size) only when
+        more than MAX_TILES would be needed. Segment coordinates are in frame pixels.
+        """
+        width, height = frame.size
+        tile_size = min(new_size, width, height)
+        while True:
+            step = max(int(tile_size * (1 - self.TILE_OVERLAP)), 1)
+            columns = max(math.ceil((width - tile_size) / step), 0) + 1
+            rows = max(math.ceil((height - tile_size) / step), 0) + 1
+            if columns * rows <= self.MAX_TILES or tile_size >= min(width, height):
+                break
+            tile_size = min(int(tile_size * 1.25) + 1, width, height)
+
+        def offsets(length, count):
+            # spread evenly so the last tile ends exactly on the frame edge
+            if count == 1:
+                return [0]
+            return [round(i * (length - tile_size) / (count - 1)) for i in range(count)]
+
+        segments = []
+        for top in offsets(height, rows):
+            for left in offsets(width, columns):
+                box = (left, top, left + tile_size, top + tile_size)
+                tile_frame = frame.crop(box)
+                if tile_size != new_size:
+                    tile_frame = tile_frame.resized(new_size, new_size)
+                segments.append((tile_frame, box))
+        return segments, width, height
+
     @abstractmethod
     def process_segment(self, segment, model, prompt):
         pass
 
-    def find_element(self, prompt, observation: str) -> str:
-        new_size = self.IMAGE_WIDTH  # assuming square image size
-        logger.info(prompt)
-        screenshot = self.executor.screenshot(observation, False, True)
-        image = Image.open(screenshot)
+    def process_segments(self, segments, prompt):
+        """Runs process_segment over all segments concurrently, in segment order."""
 
-        segments, total_width, total_height = self.resize(image, new_size=new_size)
+        def call(segment):
+            cancel.check_cancelled()
+            if self.hedger is None:
+                return self.process_segment(segment, self.model_name, prompt)
+            # a segment request has no side effects, a slow one can be sent again
+            return self.hedger.call(lambda: self.process_segment(segment, self.model_name, prompt))
 
-        results = [self.process_segment(segments[0], self.model_name, prompt)]
-        i = 0
-        ans = "0,0,0,0"
-        for response, coordinates in results:
-            i += 1
-            print(coordinates, i)
+        if len(segments) == 1:
+            return [call(segments[0])]
 
+        def process(segment):
             try:
-                response_dict = json.loads(response)
-                ymin = int(response_dict["ymin"])
-                xmin = int(response_dict["xmin"])
-                ymax = int(response_dict["ymax"])
-                xmax = int(response_dict["xmax"])
-                if ymin == 0 and xmin == 0 and xmax == 0 and ymax == 0:
-                    continue
-                orig_left, orig_top, _, _ = coordinates
-
-                y_min_percent = (orig_top + ymin) / self.OUTPUT_HEIGHT * self.IMAGE_HEIGHT
-                x_min_percent = (orig_left + xmin) / self.OUTPUT_WIDTH * self.IMAGE_WIDTH
-                y_max_percent = (orig_top + ymax) / self.OUTPUT_HEIGHT * self.IMAGE_HEIGHT
-                x_max_percent = (orig_left + xmax) / self.OUTPUT_WIDTH * self.IMAGE_WIDTH
-                ans = ",".join(
-                    map(
-                        str,
-                        map(
-                            int,
-                            [
-                                y_min_percent,
-                                x_min_percent,
-                                y_max_percent,
-                                x_max_percent,
-                            ],
-                        ),
-                    )
-                )
-                print(ans)
-            except json.JSONDecodeError:
-                print("Could not decode response")
+                return call(segment)
+            except cancel.TaskCancelled:
+                raise
+            except Exception:
+                logger.exception(f"Could not process the segment at {segment[1]}")
+                return ("", segment[1])
 
-        return ans
+        with ThreadPoolExecutor(max_workers=len(segments)) as pool:
+            futures = [cancel.submit(pool, process, segment) for segment in segments]
+            return [future.result() for future in futures]
 
-    def scale_coordinates(self, coordinates: List[int]) -> List[int]:
+    def parse_box(self, response, coordinates) -> Optional[Tuple[float, float, float, float]]:
+        """ymin,xmin,ymax,xmax of a segment response, in the segments' total space."""
         try:
-            # Execute adb shell command to get the screen size
-            result = subprocess.run(["adb", "shell", "wm", "size"], stdout=subprocess.PIPE)
-            output = result.stdout.decode()
-            # Example output format: 'Physical size: 1080x1920'
-            match = re.search(r"Physical size: (\d+)x(\d+)", output)
-            if match:
-                screen_x, screen_y = map(int, match.groups())
+            response_dict = json.loads(response)
+            ymin = int(response_dict["ymin"])
+            xmin = int(response_dict["xmin"])
+            ymax = int(response_dict["ymax"])
+            xmax = int(response_dict["xmax"])
+        except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+            logger.info(f"Could not decode response {response!r}")
+            return None
+        if ymin == 0 and xmin == 0 and xmax == 0 and ymax == 0:
+            return None
+        left, top, right, bottom = coordinates
+        scale_x = (right - left) / self.OUTPUT_WIDTH
+        scale_y = (bottom - top) / self.OUTPUT_HEIGHT
+        return (
+            top + ymin * scale_y,
+            left + xmin * scale_x,
+            top + ymax * scale_y,
+            left + xmax * scale_x,
+        )
+
+    def merge_boxes(self, boxes):
+        """
+        Groups overlapping boxes (the same element seen by neighbouring tiles) and returns the
+        median box of the largest group.
+        """
+        groups = []
+        for box in boxes:
+            for group in groups:
+                if any(box_iou(box, other) >= 0.3 for other in group):
+                    group.append(box)
+                    break
             else:
-                raise Exception("Failed to parse screen size from adb output.")
-        except Exception as e:
-            # Attempt to get screen size using pyautogui (for desktops)
-            screen_x, screen_y = pyautogui.size()
-
-        print(f"Screen size: x y {screen_x} {screen_y}")
-        scaling_x = screen_x / self.IMAGE_WIDTH
-        scaling_y = screen_y / self.IMAGE_HEIGHT
-        coordinates[0] = int(coordinates[0] * scaling_y)
-        coordinates[2] = int(coordinates[2] * scaling_y)
-        coordinates[1] = int(coordinates[1] * scaling_x)
-        coordinates[3] = int(coordinates[3] * scaling_x)
-
-        if scaling_x < scaling_y:
-            # For mobile: swap coordinates[0] with coordinates[1] and coordinates[2] with coordinates[3]
-            coordinates[0], coordinates[1] = coordinates[1], coordinates[0]
-            coordinates[2], coordinates[3] = coordinates[3], coordinates[2]
-
-        return coordinates
+                groups.append([box])
+        if len(groups) > 1:
+            logger.info(f"Finder boxes disagree across {len(groups)} regions, using the most seen")
+        best = max(groups, key=len)
+        return tuple(statistics.median(box[i] for box in best) for i in range(4))
+
+    def search(self, segments, prompt):
+        """Merged box over all segment responses in the segments' total space, or None."""
+        logger.debug(f"Finder searching {len(segments)} segment(s) for {prompt}")
+        return self.best_box(self.process_segments(segments, prompt))
+
+    def best_box(self, results):
+        """The merged box of (response, segment coordinates) pairs, or None."""
+        width = max(coordinates[2] for _, coordinates in results)
+        height = max(coordinates[3] for _, coordinates in results)
+        found = [
+            (self.parse_box(response, coordinates), coordinates)
+            for response, coordinates in results
+        ]
+        found = [(box, coordinates) for box, coordinates in found if box is not None]
+        if not found:
+            return None
+        # a tile that cuts the element off only sees part of it, prefer the complete views
+        whole = [box for box, coordinates in found if not cut_off(box, coordinates, width, height)]
+        return self.merge_boxes(whole or [box for box, _ in found])
+
+    def refine_segment(self, frame: Frame, box):
+        """A square crop around a rough frame-space box, scaled to REFINE_SIZE."""
+        width, height = frame.size
+        ymin, xmin, ymax, xmax = box
+        # a few times the box size, so an inaccurate first guess still contains the element
+        side = max(3 * (ymax - ymin), 3 * (xmax - xmin), min(width, height) / 4)
+        side = int(min(side, width, height))
+        left = int(min(max((xmin + xmax - side) / 2, 0), width - side))
+        top = int(min(max((ymin + ymax - side) / 2, 0), height - side))
+        crop_box = (left, top, left + side, top + side)
+        crop = frame.crop(crop_box).resized(self.REFINE_SIZE, self.REFINE_SIZE)
+        return (crop, crop_box)
+
+    @staticmethod
+    def to_frame_space(box, frame: Frame, total_width, total_height):
+        """A box found in a total_width x total_height space, in frame pixels."""
+        width, height = frame.size
+        return tuple(
+            value * (height / total_height if i % 2 == 0 else width / total_width)
+            for i, value in enumerate(box)
+        )
+
+    def two_pass_search(self, frame: Frame, prompt):
+        """Rough region from a small thumbnail, then the exact box from a crop of it."""
+        segments, coarse_width, coarse_height = self.resize(frame, self.COARSE_SIZE)
+        rough = self.search(segments, prompt)
+        if rough is None:
+            # small targets can disappear in the thumbnail, look at the usual image instead
+            logger.info(f"Coarse pass did not find {prompt}, searching the full screenshot")
+            segments, total_width, total_height = self.resize(frame, self.IMAGE_WIDTH)
+            box = self.search(segments, prompt)
+            if box is None:
+                return None
+            return self.to_frame_space(box, frame, total_width, total_height)
+
+        rough = self.to_frame_space(rough, frame, coarse_width, coarse_height)
+        box = self.search([self.refine_segment(frame, rough)], prompt)
+        if box is None:
+            logger.info(f"Refine pass did not find {prompt}, using the coarse box")
+            return rough
+        return box
+
+    def segments(self, frame: Frame):
+        """Segments of the "single" and "tiled" search modes, with their total size."""
+        new_size = self.IMAGE_WIDTH  # assuming square image size
+        if self.SEARCH_MODE == "tiled":
+            return self.tile(frame, new_size)
+        return self.resize(frame, new_size=new_size)
+
+    def find_element(self, prompt, observation: str, frame: Optional[Frame] = None) -> str:
+        logger.info(prompt)
+        if frame is None:
+            frame = self.executor.screenshot(observation)
+
+        if self.SEARCH_MODE == "two_pass":
+            total_width, total_height = frame.size
+            box = self.two_pass_search(frame, prompt)
+        else:
+            segments, total_width, total_height = self.segments(frame)
+            box = self.search(segments, prompt)
+        return self.answer(prompt, box, total_width, total_height)
+
+    def answer(self, prompt, box, total_width, total_height) -> str:
+        """ymin,xmin,ymax,xmax in image space of a box found in the given total space."""
+        if box is None:
+            return "0,0,0,0"
+
+        ymin, xmin, ymax, xmax = box
+        ans = ",".join(
+            str(int(value))
+            for value in (
+                ymin / total_height * self.IMAGE_HEIGHT,
+                xmin / total_width * self.IMAGE_WIDTH,
+                ymax / total_height * self.IMAGE_HEIGHT,
+                xmax / total_width * self.IMAGE_WIDTH,
+            )
+        )
+        logger.info(f"Finder output for {prompt}: {ans}")
+        return ans
+
+    def report_click(self, screen_changed: bool):
+        """Called after a click on the last found element, with whether the screen changed."""
+        pass
+
+    def summary(self) -> dict:
+        """Lookup statistics of the finder and the finders it wraps."""
+        return {}
+
+    def scale_coordinates(self, coordinates: List[int]) -> List[int]:
+        # The executor owns the screen and caches its geometry
+        return self.executor.scale_coordinates(coordinates, self.IMAGE_WIDTH, self.IMAGE_HEIGHT)
+
+
+class AsyncFinder(ABC):
+    """
+    Asyncio counterpart of `BaseFinder`. `ThreadedFinder` adapts any blocking finder,
+    including the caching, accessibility and ensemble wrappers.
+    """
+
+    IMAGE_WIDTH = None
+    IMAGE_HEIGHT = None
+
+    @abstractmethod
+    async def find_element(self, prompt, observation: str, frame: Optional[Frame] = None) -> str:
+        pass
+
+    def report_click(self, screen_changed: bool):
+        """Called after a click on the last found element, with whether the screen changed."""
+        pass
+
+    def summary(self) -> dict:
+        """Lookup statistics of the finder and the finders it wraps."""
+        return {}
+
+    @abstractmethod
+    async def scale_coordinates(self, coordinates: List[int]) -> List[int]:
+        pass
+
+
+class AsyncModelFinder(AsyncFinder):
+    """
+    Base of native async finders: the search modes of a wrapped `BaseFinder`, with the segment
+    requests awaited concurrently through `process_segment`.
+    """
+
+    def __init__(self, finder: BaseFinder, executor: AsyncExecutor):
+        self.finder = finder
+        self.executor = executor
+        self.model_name = finder.model_name
+        self.IMAGE_WIDTH = finder.IMAGE_WIDTH
+        self.IMAGE_HEIGHT = finder.IMAGE_HEIGHT
+
+    @abstractmethod
+    async def process_segment(self, segment, prompt):
+        pass
+
+    async def process_segments(self, segments, prompt):
+        if len(segments) == 1:
+            return [await self.process_segment(segments[0], prompt)]
+
+        async def process(segment):
+            try:
+                return await self.process_segment(segment, prompt)
+            except Exception:
+                logger.exception(f"Could not process the segment at {segment[1]}")
+                return ("", segment[1])
+
+        return await asyncio.gather(*(process(segment) for segment in segments))
+
+    async def search(self, segments, prompt):
+        logger.debug(f"Finder searching {len(segments)} segment(s) for {prompt}")
+        return self.finder.best_box(await self.process_segments(segments, prompt))
+
+    async def two_pass_search(self, frame: Frame, prompt):
+        finder = self.finder
+        segments, coarse_width, coarse_height = await asyncio.to_thread(
+            finder.resize, frame, finder.COARSE_SIZE
+        )
+        rough = await self.search(segments, prompt)
+        if rough is None:
+            logger.info(f"Coarse pass did not find {prompt}, searching the full screenshot")
+            segments, total_width, total_height = await asyncio.to_thread(
+                finder.resize, frame, finder.IMAGE_WIDTH
+            )
+            box = await self.search(segments, prompt)
+            if box is None:
+                return None
+            return finder.to_frame_space(box, frame, total_width, total_height)
+
+        rough = finder.to_frame_space(rough, frame, coarse_width, coarse_height)
+        segment = await asyncio.to_thread(finder.refine_segment, frame, rough)
+        box = await self.search([segment], prompt)
+        if box is None:
+            logger.info(f"Refine pass did not find {prompt}, using the coarse box")
+            return rough
+        return box
+
+    async def find_element(self, prompt, observation: str, frame: Optional[Frame] = None) -> str:
+        logger.info(prompt)
+        if frame is None:
+            frame = await self.executor.screenshot(observation)
+
+        if self.finder.SEARCH_MODE == "two_pass":
+            total_width, total_height = frame.size
+            box = await self.two_pass_search(frame, prompt)
+        else:
+            segments, total_width, total_height = await asyncio.to_thread(
+                self.finder.segments, frame
+            )
+            box = await self.search(segments, prompt)
+        return self.finder.answer(prompt, box, total_width, total_height)
+
+    async def scale_coordinates(self, coordinates: List[int]) -> List[int]:
+        return await self.executor.scale_coordinates(
+            coordinates, self.IMAGE_WIDTH, self.IMAGE_HEIGHT
+        )
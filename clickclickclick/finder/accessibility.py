@@ -0,0 +1,289 @@
+import asyncio
+import re
+import xml.etree.ElementTree as ET
+from dataclasses import asdict, dataclass
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Tuple
+
+from . import AsyncFinder, BaseFinder, logger
+from clickclickclick.executor import Frame, ScreenGeometry
+from clickclickclick.executor.android import AndroidExecutor, AsyncAndroidExecutor
+
+DUMP_PATH = "/sdcard/ccc_window_dump.xml"
+
+# Words that describe the kind of element rather than which one it is
+FILLER_WORDS = set(
+    "a an the in on at of to with for and or is that button icon app tab link field box text "
+    "option menu item label screen top bottom left right corner click tap press".split()
+)
+
+
+@dataclass
+class UINode:
+    text: str
+    content_desc: str
+    resource_id: str
+    class_name: str
+    clickable: bool
+    bounds: Tuple[int, int, int, int]  # left, top, right, bottom in screen pixels
+
+    @property
+    def labels(self) -> List[str]:
+        labels = [self.text, self.content_desc]
+        if self.resource_id:
+            # com.android.chrome:id/search_box_text -> search box text
+            labels.append(self.resource_id.split("/")[-1].replace("_", " "))
+        return [label for label in labels if label]
+
+
+def normalize(text: str) -> str:
+    return re.sub(r"[^\w\s]", " ", text.lower()).strip()
+
+
+def tokens(text: str) -> set:
+    return set(normalize(text).split()) - FILLER_WORDS
+
+
+def parse_bounds(bounds: str) -> Optional[Tuple[int, int, int, int]]:
+    # e.g. "[0,63][1080,210]"
+    numbers = list(map(int, re.findall(r"-?\d+", bounds or "")))
+    if len(numbers) != 4 or numbers[2] <= numbers[0] or numbers[3] <= numbers[1]:
+        return None
+    return tuple(numbers)
+
+
+class AccessibilityTree:
+    """The `uiautomator dump` hierarchy, indexed by normalized label."""
+
+    def __init__(self, xml: str):
+        self.nodes: List[UINode] = []
+        self.index: Dict[str, List[UINode]] = {}
+        start = xml.find("<?xml")
+        end = xml.rfind("</hierarchy>")
+        if start == -1 or end == -1:
+            raise ValueError("No window hierarchy in uiautomator output")
+        root = ET.fromstring(xml[start : end + len("</hierarchy>")])
+        for element in root.iter("node"):
+            bounds = parse_bounds(element.get("bounds"))
+            if bounds is None or element.get("visible-to-user", "true") == "false":
+                continue
+            node = UINode(
+                text=element.get("text", ""),
+                content_desc=element.get("content-desc", ""),
+                resource_id=element.get("resource-id", ""),
+                class_name=element.get("class", ""),
+                clickable=element.get("clickable") == "true",
+                bounds=bounds,
+            )
+            if not node.labels:
+                continue
+            self.nodes.append(node)
+            for label in node.labels:
+                self.index.setdefault(normalize(label), []).append(node)
+
+    def match(self, prompt: str) -> List[Tuple[float, UINode]]:
+        """Nodes scored against the element prompt, best first."""
+        prompt_norm = normalize(prompt)
+        prompt_tokens = tokens(prompt)
+        quoted = {normalize(q) for q in re.findall(r"[\"'‘“](.+?)[\"'’”]", prompt)}
+
+        exact = self.index.get(prompt_norm, [])
+        for phrase in quoted:
+            exact = exact + self.index.get(phrase, [])
+        if exact:
+            return [(1.0, node) for node in exact]
+
+        scored = []
+        for label, nodes in self.index.items():
+            label_tokens = tokens(label)
+            if label_tokens and prompt_tokens and prompt_tokens <= label_tokens:
+                # every meaningful word of the prompt is in the label, e.g. "Chrome icon" for
+                # "Chrome" or "Wi-Fi" for "Wi-Fi settings". A prompt word missing from the
+                # label ("gear" in "Settings gear icon") may describe a different element, so
+                # such prompts only get the fuzzy score below.
+                score = 0.85 + 0.15 * len(prompt_tokens) / len(label_tokens)
+            else:
+                score = SequenceMatcher(None, prompt_norm, label).ratio()
+            scored.extend((score, node) for node in nodes)
+        scored.sort(key=lambda item: (item[0], item[1].clickable), reverse=True)
+        return scored
+
+
+def confident_match(tree: AccessibilityTree, prompt, threshold) -> Optional[UINode]:
+    """The best match of the prompt, if it scores above the threshold and has no rival."""
+    matches = tree.match(prompt)
+    if not matches or matches[0][0] < threshold:
+        return None
+    best_score, best = matches[0]
+    # several different elements above the threshold is not a confident answer
+    rivals = [node for score, node in matches[1:] if score >= threshold]
+    if any(node.bounds != best.bounds for node in rivals):
+        logger.debug(f"Accessibility tree match for {prompt} is ambiguous")
+        return None
+    return best
+
+
+def node_answer(node: UINode, geometry: ScreenGeometry, image_width, image_height) -> str:
+    """The node's bounds in the same ymin,xmin,ymax,xmax layout and image space as a finder."""
+    left, top, right, bottom = node.bounds
+    scale_x = image_width / geometry.width
+    scale_y = image_height / geometry.height
+    return ",".join(
+        str(int(value))
+        for value in (top * scale_y, left * scale_x, bottom * scale_y, right * scale_x)
+    )
+
+
+@dataclass
+class TreeStats:
+    """Lookup counters, the tree is skipped for a while after `max_misses` misses in a row."""
+
+    max_misses: int = 3
+    tree_hits: int = 0
+    tree_misses: int = 0
+    tree_errors: int = 0
+    tree_skips: int = 0
+    vision_calls: int = 0
+    misses_in_a_row: int = 0
+    skips_left: int = 0
+
+    def use_tree(self) -> bool:
+        if self.skips_left > 0:
+            self.skips_left -= 1
+            self.tree_skips += 1
+            return False
+        return True
+
+    def record(self, node: Optional[UINode], error: bool = False):
+        if node is not None:
+            self.tree_hits += 1
+            self.misses_in_a_row = 0
+            return
+        self.vision_calls += 1
+        if error:
+            self.tree_errors += 1
+        self.tree_misses += 1
+        self.misses_in_a_row += 1
+        if self.misses_in_a_row >= self.max_misses:
+            self.skips_left = self.max_misses
+
+    def as_dict(self) -> dict:
+        lookups = self.tree_hits + self.vision_calls
+        stats = asdict(self)
+        del stats["max_misses"], stats["skips_left"]
+        return {**stats, "hit_rate": self.tree_hits / lookups if lookups else None}
+
+    def log(self):
+        lookups = self.tree_hits + self.vision_calls
+        logger.info(
+            f"Accessibility tree hit rate {self.tree_hits}/{lookups}, "
+            f"vision calls {self.vision_calls}/{lookups}, tree skipped {self.tree_skips}"
+        )
+
+
+class AccessibilityFinder(BaseFinder):
+    """
+    Matches the prompt against the `uiautomator` hierarchy by text, content-desc and
+    resource-id, and asks the vision finder only when there is no single confident match.
+    """
+
+    def __init__(self, vision_finder: BaseFinder, executor: AndroidExecutor, threshold=0.85):
+        self.vision_finder = vision_finder
+        self.executor = executor
+        self.threshold = threshold
+        # output coordinates use the vision finder's image space, so scaling stays the same
+        self.IMAGE_WIDTH = vision_finder.IMAGE_WIDTH
+        self.IMAGE_HEIGHT = vision_finder.IMAGE_HEIGHT
+        self.OUTPUT_WIDTH = vision_finder.OUTPUT_WIDTH
+        self.OUTPUT_HEIGHT = vision_finder.OUTPUT_HEIGHT
+        self.model_name = vision_finder.model_name
+        self.stats = TreeStats()
+
+    def process_segment(self, segment, model, prompt):
+        return self.vision_finder.process_segment(segment, model, prompt)
+
+    def report_click(self, screen_changed: bool):
+        self.vision_finder.report_click(screen_changed)
+
+    def summary(self) -> dict:
+        return {"accessibility": self.stats.as_dict(), **self.vision_finder.summary()}
+
+    def dump_tree(self) -> AccessibilityTree:
+        result = self.executor.run_shell(
+            [f"uiautomator dump {DUMP_PATH} > /dev/null", f"cat {DUMP_PATH}"]
+        )
+        return AccessibilityTree(result.stdout)
+
+    def find_in_tree(self, prompt) -> Optional[UINode]:
+        return confident_match(self.dump_tree(), prompt, self.threshold)
+
+    def find_element(self, prompt, observation: str, frame: Optional[Frame] = None) -> str:
+        node = None
+        if self.stats.use_tree():
+            try:
+                node = self.find_in_tree(prompt)
+                self.stats.record(node)
+            except Exception:
+                logger.exception("Could not read the accessibility tree")
+                self.stats.record(None, error=True)
+        else:
+            self.stats.vision_calls += 1
+
+        if node is None:
+            ans = self.vision_finder.find_element(prompt, observation, frame)
+        else:
+            geometry = self.executor.screen_geometry()
+            ans = node_answer(node, geometry, self.IMAGE_WIDTH, self.IMAGE_HEIGHT)
+            logger.info(f"Found {prompt} in the accessibility tree: {node.labels} {node.bounds}")
+        self.stats.log()
+        return ans
+
+
+class AsyncAccessibilityFinder(AsyncFinder):
+    """`AccessibilityFinder` for the async engine, wrapping a native async vision finder."""
+
+    def __init__(self, vision_finder: AsyncFinder, executor: AsyncAndroidExecutor, threshold=0.85):
+        self.vision_finder = vision_finder
+        self.executor = executor
+        self.threshold = threshold
+        self.IMAGE_WIDTH = vision_finder.IMAGE_WIDTH
+        self.IMAGE_HEIGHT = vision_finder.IMAGE_HEIGHT
+        self.stats = TreeStats()
+
+    def report_click(self, screen_changed: bool):
+        self.vision_finder.report_click(screen_changed)
+
+    def summary(self) -> dict:
+        return {"accessibility": self.stats.as_dict(), **self.vision_finder.summary()}
+
+    async def scale_coordinates(self, coordinates: List[int]) -> List[int]:
+        return await self.vision_finder.scale_coordinates(coordinates)
+
+    async def find_in_tree(self, prompt) -> Optional[UINode]:
+        result = await self.executor.run_shell(
+            [f"uiautomator dump {DUMP_PATH} > /dev/null", f"cat {DUMP_PATH}"]
+        )
+        return await asyncio.to_thread(
+            lambda: confident_match(AccessibilityTree(result.stdout), prompt, self.threshold)
+        )
+
+    async def find_element(self, prompt, observation: str, frame: Optional[Frame] = None) -> str:
+        node = None
+        if self.stats.use_tree():
+            try:
+                node = await self.find_in_tree(prompt)
+                self.stats.record(node)
+            except Exception:
+                logger.exception("Could not read the accessibility tree")
+                self.stats.record(None, error=True)
+        else:
+            self.stats.vision_calls += 1
+
+        if node is None:
+            ans = await self.vision_finder.find_element(prompt, observation, frame)
+        else:
+            geometry = await self.executor.screen_geometry()
+            ans = node_answer(node, geometry, self.IMAGE_WIDTH, self.IMAGE_HEIGHT)
+            logger.info(f"Found {prompt} in the accessibility tree: {node.labels} {node.bounds}")
+        self.stats.log()
+        return ans
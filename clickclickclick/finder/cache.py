@@ -0,0 +1,287 @@
+import asyncio
+import atexit
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from . import AsyncFinder, BaseFinder, logger
+from clickclickclick.executor import AsyncExecutor, Executor, Frame
+
+NOT_FOUND = "0,0,0,0"
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def normalize_prompt(prompt: str) -> str:
+    return " ".join(prompt.lower().split())
+
+
+def region_hash(frame: Frame, bounds: str, image_width: int, image_height: int) -> int:
+    """Hash of the frame pixels at bounds given in a finder's image space."""
+    ymin, xmin, ymax, xmax = map(int, bounds.split(","))
+    scale_x = frame.width / image_width
+    scale_y = frame.height / image_height
+    left, top = int(xmin * scale_x), int(ymin * scale_y)
+    box = (left, top, max(int(xmax * scale_x), left + 1), max(int(ymax * scale_y), top + 1))
+    return frame.crop(box).dhash()
+
+
+@dataclass
+class CacheEntry:
+    prompt: str
+    frame_hash: int  # hash of the whole screen, only used to rank candidates
+    region_hash: int  # hash of the element's own pixels, checked against the frame on lookup
+    bounds: str  # ymin,xmin,ymax,xmax in the finder's image space
+    created_at: float
+
+
+class ElementCache:
+    """
+    Bounded LRU/TTL cache of element bounds, served while the pixels at the bounds still match.
+    Optionally persisted to a JSON file, saved in the background and at exit.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl_seconds: float = 24 * 3600,
+        path: Optional[str] = None,
+        region_tolerance: int = 6,
+        save_interval: float = 5.0,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.region_tolerance = region_tolerance
+        self.save_interval = save_interval
+        self._entries: "OrderedDict[Tuple[str, str], CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # orders writes of the file, held without _lock
+        self._dirty = False
+        self._save_timer: Optional[threading.Timer] = None
+        if path:
+            if os.path.exists(path):
+                self._load()
+            atexit.register(self.flush)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                for item in json.load(f):
+                    entry = CacheEntry(**item)
+                    self._entries[(entry.prompt, entry.bounds)] = entry
+            self._expire()
+            logger.info(f"Loaded {len(self._entries)} cached element locations from {self.path}")
+        except (OSError, ValueError, TypeError):
+            logger.exception(f"Could not load the element cache from {self.path}")
+
+    def _changed(self):
+        """Marks the file tier stale and schedules a save, called with the lock held."""
+        if not self.path:
+            return
+        self._dirty = True
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(self.save_interval, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def flush(self):
+        """Writes pending changes to the file tier, off the lookup path."""
+        with self._save_lock:
+            with self._lock:
+                if self._save_timer is not None:
+                    self._save_timer.cancel()
+                    self._save_timer = None
+                if not self._dirty:
+                    return
+                self._dirty = False
+                items = [asdict(entry) for entry in self._entries.values()]
+            temp_path = f"{self.path}.tmp"
+            try:
+                with open(temp_path, "w") as f:
+                    json.dump(items, f)
+                os.replace(temp_path, self.path)
+            except OSError:
+                logger.exception(f"Could not save the element cache to {self.path}")
+
+    def _expire(self):
+        now = time.time()
+        for key in [k for k, e in self._entries.items() if now - e.created_at > self.ttl_seconds]:
+            del self._entries[key]
+
+    def get(
+        self, prompt: str, frame_hash: int, region_hash: Callable[[str], int]
+    ) -> Optional[CacheEntry]:
+        """The cached location of `prompt` whose pixels, hashed by `region_hash`, still match."""
+        prompt = normalize_prompt(prompt)
+        with self._lock:
+            self._expire()
+            candidates = [e for (p, _), e in self._entries.items() if p == prompt]
+        # locations cached on the most similar screen first
+        candidates.sort(key=lambda e: hamming(e.frame_hash, frame_hash))
+        for entry in candidates:
+            if hamming(entry.region_hash, region_hash(entry.bounds)) <= self.region_tolerance:
+                with self._lock:
+                    key = (entry.prompt, entry.bounds)
+                    if self._entries.get(key) is entry:
+                        self._entries.move_to_end(key)
+                return entry
+        return None
+
+    def put(self, prompt: str, frame_hash: int, region_hash: int, bounds: str):
+        if hamming(region_hash, 0) <= self.region_tolerance:
+            # a featureless region would match any plain area at these bounds
+            return
+        entry = CacheEntry(normalize_prompt(prompt), frame_hash, region_hash, bounds, time.time())
+        key = (entry.prompt, bounds)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._changed()
+
+    def invalidate(self, entry: CacheEntry):
+        with self._lock:
+            key = (entry.prompt, entry.bounds)
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+                self._changed()
+
+
+def cache_summary(stats: Dict[str, int], cache: ElementCache) -> dict:
+    lookups = stats["hits"] + stats["misses"]
+    hit_rate = stats["hits"] / lookups if lookups else None
+    return {**stats, "hit_rate": hit_rate, "entries": len(cache)}
+
+
+class CachingFinder(BaseFinder):
+    """
+    Serves repeated lookups of the same element on a visually identical screen from an
+    ElementCache, without calling the wrapped finder.
+    """
+
+    def __init__(self, finder: BaseFinder, executor: Executor, cache: ElementCache):
+        self.finder = finder
+        self.executor = executor
+        self.cache = cache
+        self.IMAGE_WIDTH = finder.IMAGE_WIDTH
+        self.IMAGE_HEIGHT = finder.IMAGE_HEIGHT
+        self.OUTPUT_WIDTH = finder.OUTPUT_WIDTH
+        self.OUTPUT_HEIGHT = finder.OUTPUT_HEIGHT
+        self.model_name = finder.model_name
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+        self._last_hit: Optional[CacheEntry] = None
+
+    def process_segment(self, segment, model, prompt):
+        return self.finder.process_segment(segment, model, prompt)
+
+    def region_hash(self, frame: Frame, bounds: str) -> int:
+        return region_hash(frame, bounds, self.IMAGE_WIDTH, self.IMAGE_HEIGHT)
+
+    def find_element(self, prompt, observation: str, frame: Optional[Frame] = None) -> str:
+        if frame is None:
+            frame = self.executor.screenshot(observation)
+        self._last_hit = None
+
+        entry = self.cache.get(
+            prompt, frame.dhash(), lambda bounds: self.region_hash(frame, bounds)
+        )
+        if entry is not None:
+            self.stats["hits"] += 1
+            self._last_hit = entry
+            logger.info(f"Element cache hit for {prompt}: {entry.bounds}")
+            return entry.bounds
+
+        self.stats["misses"] += 1
+        ans = self.finder.find_element(prompt, observation, frame)
+        if ans != NOT_FOUND:
+            self.cache.put(prompt, frame.dhash(), self.region_hash(frame, ans), ans)
+        return ans
+
+    def report_click(self, screen_changed: bool):
+        if self._last_hit is not None and not screen_changed:
+            # the cached bounds did not hit anything, do not serve them again
+            logger.info(f"Invalidating cached bounds for {self._last_hit.prompt}")
+            self.cache.invalidate(self._last_hit)
+            self.stats["invalidations"] += 1
+        self._last_hit = None
+        self.finder.report_click(screen_changed)
+
+    def summary(self) -> dict:
+        return {"element_cache": cache_summary(self.stats, self.cache), **self.finder.summary()}
+
+
+class AsyncCachingFinder(AsyncFinder):
+    """`CachingFinder` for the async engine, wrapping a native async finder."""
+
+    def __init__(self, finder: AsyncFinder, executor: AsyncExecutor, cache: ElementCache):
+        self.finder = finder
+        self.executor = executor
+        self.cache = cache
+        self.IMAGE_WIDTH = finder.IMAGE_WIDTH
+        self.IMAGE_HEIGHT = finder.IMAGE_HEIGHT
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+        self._last_hit: Optional[CacheEntry] = None
+
+    def region_hash(self, frame: Frame, bounds: str) -> int:
+        return region_hash(frame, bounds, self.IMAGE_WIDTH, self.IMAGE_HEIGHT)
+
+    async def find_element(self, prompt, observation: str, frame: Optional[Frame] = None) -> str:
+        if frame is None:
+            frame = await self.executor.screenshot(observation)
+        self._last_hit = None
+
+        frame_hash = await asyncio.to_thread(frame.dhash)
+        entry = await asyncio.to_thread(
+            self.cache.get, prompt, frame_hash, lambda bounds: self.region_hash(frame, bounds)
+        )
+        if entry is not None:
+            self.stats["hits"] += 1
+            self._last_hit = entry
+            logger.info(f"Element cache hit for {prompt}: {entry.bounds}")
+            return entry.bounds
+
+        self.stats["misses"] += 1
+        ans = await self.finder.find_element(prompt, observation, frame)
+        if ans != NOT_FOUND:
+            bounds_hash = await asyncio.to_thread(self.region_hash, frame, ans)
+            self.cache.put(prompt, frame_hash, bounds_hash, ans)
+        return ans
+
+    def report_click(self, screen_changed: bool):
+        if self._last_hit is not None and not screen_changed:
+            logger.info(f"Invalidating cached bounds for {self._last_hit.prompt}")
+            self.cache.invalidate(self._last_hit)
+            self.stats["invalidations"] += 1
+        self._last_hit = None
+        self.finder.report_click(screen_changed)
+
+    def summary(self) -> dict:
+        return {"element_cache": cache_summary(self.stats, self.cache), **self.finder.summary()}
+
+    async def scale_coordinates(self, coordinates: List[int]) -> List[int]:
+        return await self.finder.scale_coordinates(coordinates)
+
+
+_shared_caches = {}
+_shared_caches_lock = threading.Lock()
+
+
+def get_element_cache(max_entries: int, ttl_seconds: float, path: Optional[str]) -> ElementCache:
+    """One cache per persistence path, shared by every finder (and task) in the process."""
+    with _shared_caches_lock:
+        cache = _shared_caches.get(path)
+        if cache is None:
+            cache = _shared_caches[path] = ElementCache(max_entries, ttl_seconds, path)
+        return cache
@@ -0,0 +1,189 @@
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
+
+from . import BaseFinder, box_iou, logger
+from clickclickclick import cancel
+from clickclickclick.executor import Executor, Frame
+
+NOT_FOUND = "0,0,0,0"
+
+
+class BackendStats:
+    def __init__(self, window: int = 100):
+        self.calls = 0
+        self.valid = 0  # calls that returned a box
+        self.wins = 0  # calls whose box was used
+        self.errors = 0
+        self.latencies = deque(maxlen=window)
+
+    def as_dict(self) -> dict:
+        latencies = sorted(self.latencies)
+        return {
+            "calls": self.calls,
+            "valid": self.valid,
+            "wins": self.wins,
+            "errors": self.errors,
+            "win_rate": self.wins / self.calls if self.calls else 0.0,
+            "p50_latency": statistics.median(latencies) if latencies else None,
+            "p90_latency": latencies[int(0.9 * (len(latencies) - 1))] if latencies else None,
+        }
+
+
+class EnsembleFinder(BaseFinder):
+    """
+    Sends the same query to several finder backends concurrently.
+
+    In "race" mode the first backend returning a box wins and the others are cancelled. In
+    "consensus" mode every backend is waited for (up to `timeout`) and the median of the
+    largest group of agreeing boxes is returned.
+    """
+
+    def __init__(
+        self,
+        finders: Dict[str, BaseFinder],
+        executor: Executor,
+        mode: str = "race",
+        timeout: Optional[float] = None,
+        agreement_iou: float = 0.3,
+    ):
+        if mode not in ("race", "consensus"):
+            raise ValueError(f"Unsupported ensemble mode: {mode}")
+        self.finders = finders
+        self.executor = executor
+        self.mode = mode
+        self.timeout = timeout
+        self.agreement_iou = agreement_iou
+        # answers use the first backend's image space, so scaling stays the same
+        first = next(iter(finders.values()))
+        self.IMAGE_WIDTH = first.IMAGE_WIDTH
+        self.IMAGE_HEIGHT = first.IMAGE_HEIGHT
+        self.OUTPUT_WIDTH = first.OUTPUT_WIDTH
+        self.OUTPUT_HEIGHT = first.OUTPUT_HEIGHT
+        self.model_name = ",".join(finders)
+        self.stats = {name: BackendStats() for name in finders}
+        self._lock = threading.Lock()
+        # room for a new query per backend while cancelled ones reach their next check
+        self._pool = ThreadPoolExecutor(
+            max_workers=2 * len(finders), thread_name_prefix="finder-ensemble"
+        )
+
+    def process_segment(self, segment, model, prompt):
+        return next(iter(self.finders.values())).process_segment(segment, model, prompt)
+
+    def _query(
+        self, token: cancel.CancellationToken, name, prompt, observation, frame
+    ) -> Optional[Tuple[float, ...]]:
+        with cancel.use_token(token):
+            return self._query_backend(name, prompt, observation, frame)
+
+    def _query_backend(self, name, prompt, observation, frame) -> Optional[Tuple[float, ...]]:
+        finder = self.finders[name]
+        start = time.monotonic()
+        try:
+            ans = finder.find_element(prompt, observation, frame)
+        except cancel.TaskCancelled:
+            raise
+        except Exception:
+            logger.exception(f"Finder backend {name} failed")
+            with self._lock:
+                self.stats[name].calls += 1
+                self.stats[name].errors += 1
+            return None
+        with self._lock:
+            stats = self.stats[name]
+            stats.calls += 1
+            stats.latencies.append(time.monotonic() - start)
+            if ans != NOT_FOUND:
+                stats.valid += 1
+        if ans == NOT_FOUND:
+            return None
+        # into the ensemble's image space
+        ymin, xmin, ymax, xmax = map(int, ans.split(","))
+        scale_x = self.IMAGE_WIDTH / finder.IMAGE_WIDTH
+        scale_y = self.IMAGE_HEIGHT / finder.IMAGE_HEIGHT
+        return (ymin * scale_y, xmin * scale_x, ymax * scale_y, xmax * scale_x)
+
+    def find_element(self, prompt, observation: str, frame: Optional[Frame] = None) -> str:
+        if frame is None:
+            frame = self.executor.screenshot(observation)
+
+        # each backend runs under its own token, so the ones that lost the race stop at their
+        # next cancellation point (retries, further tiles, the refine pass) instead of
+        # spending more requests on an answer nobody waits for
+        parent = cancel.current_token()
+        tokens = {
+            name: parent.child() if parent is not None else cancel.CancellationToken()
+            for name in self.finders
+        }
+        futures = {
+            self._pool.submit(self._query, tokens[name], name, prompt, observation, frame): name
+            for name in self.finders
+        }
+        try:
+            if self.mode == "race":
+                winners, box = self._race(futures)
+            else:
+                winners, box = self._consensus(futures)
+        finally:
+            for future, name in futures.items():
+                if not future.done():
+                    future.cancel()
+                    tokens[name].cancel(f"finder backend {name} is no longer needed")
+                tokens[name].release()
+
+        with self._lock:
+            for name in winners:
+                self.stats[name].wins += 1
+        logger.info(f"Finder ensemble ({self.mode}) winners for {prompt}: {winners or 'none'}")
+        logger.debug(f"Finder ensemble stats: {self.summary()}")
+        if box is None:
+            return NOT_FOUND
+        return ",".join(str(int(value)) for value in box)
+
+    def _race(self, futures):
+        pending = set(futures)
+        deadline = time.monotonic() + self.timeout if self.timeout else None
+        while pending:
+            remaining = deadline - time.monotonic() if deadline else None
+            if remaining is not None and remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                box = future.result()
+                if box is not None:
+                    return [futures[future]], box
+        return [], None
+
+    def _consensus(self, futures):
+        done, _ = wait(futures, timeout=self.timeout)
+        boxes = [(futures[future], future.result()) for future in done]
+        boxes = [(name, box) for name, box in boxes if box is not None]
+        if not boxes:
+            return [], None
+
+        groups: List[List[Tuple[str, tuple]]] = []
+        for name, box in boxes:
+            for group in groups:
+                if any(box_iou(box, other) >= self.agreement_iou for _, other in group):
+                    group.append((name, box))
+                    break
+            else:
+                groups.append([(name, box)])
+        best = max(groups, key=len)
+        if len(groups) > 1:
+            logger.info(f"Finder backends disagree, {len(best)} of {len(boxes)} agree")
+        box = tuple(statistics.median(box[i] for _, box in best) for i in range(4))
+        return [name for name, _ in best], box
+
+    def summary(self) -> Dict[str, dict]:
+        """Per-backend calls, win rate and latency percentiles."""
+        with self._lock:
+            return {name: stats.as_dict() for name, stats in self.stats.items()}
+
+    def report_click(self, screen_changed: bool):
+        for finder in self.finders.values():
+            finder.report_click(screen_changed)
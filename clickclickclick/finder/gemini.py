@@ -1,9 +1,8 @@
 import google.generativeai as genai
 from . import BaseFinder
+from clickclickclick.cancel import check_cancelled, request_timeout
 from clickclickclick.config import BaseConfig
 from clickclickclick.executor import Executor
-from tempfile import NamedTemporaryFile
-from PIL import Image
 
 
 class GeminiFinder(BaseFinder):
@@ -21,6 +20,7 @@ class GeminiFinder(BaseFinder):
         model_name = finder_config.get("model_name")
         generation_config = finder_config.get("generation_config")
         super().__init__(api_key, model_name, generation_config, system_prompt, executor)
+        self.apply_config(c)
         genai.configure(api_key=api_key)
         self.model = genai.GenerativeModel(
             model_name=model_name,
@@ -30,20 +30,19 @@ class GeminiFinder(BaseFinder):
 
     def process_segment(self, segment, model, prompt, retries=3):
         attempt = 0
-        segment_image, coordinates = segment
+        segment_frame, coordinates = segment
+        image_part = {"mime_type": "image/png", "data": segment_frame.png()}
         while attempt < retries:
+            check_cancelled()
+            timeout = request_timeout()
             try:
-                with NamedTemporaryFile(delete=False, suffix=".png") as temp_file:
-                    segment_image.save(temp_file, format="PNG")
-                    temp_file_path = temp_file.name
-
-                with Image.open(temp_file_path) as segment_image:
-                    response = self.model.generate_content(
-                        [segment_image, self.gemini_finder_prompt(prompt)]
-                    )
-                    response_text = response.text
-                    print(response_text, " resp text")
-                    return (response_text, coordinates)
+                response = self.model.generate_content(
+                    [image_part, self.gemini_finder_prompt(prompt)],
+                    request_options={"timeout": timeout} if timeout is not None else None,
+                )
+                response_text = response.text
+                print(response_text, " resp text")
+                return (response_text, coordinates)
             except Exception as e:
                 # Log the exception or handle it as necessary
                 print(f"Attempt {attempt + 1} failed with exception: {e}")
@@ -2,7 +2,6 @@ from clickclickclick.config import BaseConfig
 from . import BaseFinder, logger
 from ollama import Client
 from clickclickclick.executor import Executor
-from tempfile import NamedTemporaryFile
 
 
 class OllamaFinder(BaseFinder):
@@ -22,13 +21,10 @@ class OllamaFinder(BaseFinder):
         self.OUTPUT_WIDTH = finder_config.get("output_width")
         self.OUTPUT_HEIGHT = finder_config.get("output_height")
         self.model_name = finder_config.get("model_name")
+        self.apply_config(c)
 
     def process_segment(self, segment, model_name, prompt):
-        segment_image, coordinates = segment
-
-        with NamedTemporaryFile(delete=False, suffix=".png") as temp_file:
-            segment_image.save(temp_file, format="PNG")
-            temp_file_path = temp_file.name
+        segment_frame, coordinates = segment
 
         response = self.client.chat(
             model=self.model_name,
@@ -40,7 +36,7 @@ class OllamaFinder(BaseFinder):
                 {
                     "role": "user",
                     "content": self.gemini_finder_prompt(prompt),
-                    "images": [temp_file_path],
+                    "images": [segment_frame.base64()],
                 },
             ],
         )
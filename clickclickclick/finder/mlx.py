@@ -3,7 +3,7 @@ from . import BaseFinder, logger
 from mlx_vlm import load, generate
 from mlx_vlm.prompt_utils import apply_chat_template
 from mlx_vlm.utils import load_config
-from tempfile import NamedTemporaryFile
+from io import BytesIO
 import re
 import json
 import os
@@ -72,12 +72,13 @@ class MLXFinder(BaseFinder):
         self.OUTPUT_WIDTH = finder_config.get("output_width")
         self.OUTPUT_HEIGHT = finder_config.get("output_height")
         self.model_name = finder_config.get("model_name")
+        self.apply_config(c)
 
-    def process_image(self, image_path, prompt):
+    def process_image(self, image, prompt):
         formatted_prompt = apply_chat_template(
             self.processor, self.config, prompt, num_images=1
         )
-        output = generate(self.model, self.processor, [image_path], formatted_prompt, verbose=False)
+        output = generate(self.model, self.processor, [image], formatted_prompt, verbose=False)
         print(output)
         try:
             logger.debug(output)
@@ -89,13 +90,10 @@ class MLXFinder(BaseFinder):
     # Example usage
     def process_segment(self, segment, model_name, prompt):
         prompt = f'UI bounds of "{prompt}" as ymin=,ymax=,xmin=,xmax= format strictly.  '
-        segment_image, coordinates = segment
-        with NamedTemporaryFile(delete=False, suffix=".png") as temp_file:
-            segment_image.save(temp_file, format="PNG")
-            temp_file_path = temp_file.name
-            response_text = self.process_image(temp_file_path, prompt)
-            response_json_str = extract_coordinates(response_text)
+        segment_frame, coordinates = segment
+        response_text = self.process_image(BytesIO(segment_frame.png()), prompt)
+        response_json_str = extract_coordinates(response_text)
 
-            return (response_json_str, coordinates)
+        return (response_json_str, coordinates)
 
 # Example instantiation and usage would resemble how you manage the base classes and client interactions.
\ No newline at end of file
@@ -1,8 +1,10 @@
-import openai
-from . import BaseFinder, FinderResponseLLM
+import asyncio
+
+from . import AsyncModelFinder, BaseFinder, FinderResponseLLM, logger
+from clickclickclick.cancel import request_timeout
+from clickclickclick.clients import get_async_openai_client, get_openai_client
 from clickclickclick.config import BaseConfig
-from clickclickclick.executor import Executor
-from tempfile import NamedTemporaryFile
+from clickclickclick.executor import AsyncExecutor, Executor
 
 
 class OpenAIFinder(BaseFinder):
@@ -20,24 +22,13 @@ class OpenAIFinder(BaseFinder):
         model_name = finder_config.get("model_name")
         generation_config = finder_config.get("generation_config")
         super().__init__(api_key, model_name, generation_config, system_prompt, executor)
-        openai.api_key = api_key
-        openai.azure_endpoint = finder_config.get("azure_endpoint")
-        openai.api_type = finder_config.get("api_type")
-        openai.api_version = finder_config.get("api_version")
-        base_url = finder_config.get("base_url")
-        if base_url:
-            openai.base_url = base_url
+        self.apply_config(c)
+        self.client = get_openai_client(finder_config)
 
     def process_segment(self, segment, model_name, prompt):
-        segment_image, coordinates = segment
-
-        with NamedTemporaryFile(delete=False, suffix=".png") as temp_file:
-            segment_image.save(temp_file, format="PNG")
-            temp_file_path = temp_file.name
-
-        encoded_image = self.encode_image_to_base64(temp_file_path)
+        segment_frame, coordinates = segment
 
-        response = openai.beta.chat.completions.parse(
+        response = self.client.beta.chat.completions.parse(
             model=model_name,
             messages=[
                 {"role": "system", "content": self.system_prompt},
@@ -48,7 +39,7 @@ class OpenAIFinder(BaseFinder):
                             "type": "image_url",
                             "image_url": {
                                 "detail": "low",
-                                "url": f"data:image/png;base64,{encoded_image}",
+                                "url": segment_frame.data_url("PNG"),
                             },
                         },
                         {"type": "text", "text": self.gemini_finder_prompt(prompt)},
@@ -56,6 +47,7 @@ class OpenAIFinder(BaseFinder):
                 },
             ],
             response_format=FinderResponseLLM,
+            timeout=request_timeout(self.client.timeout),
         )
         try:
             response_text = response.choices[0].message.content
@@ -64,3 +56,35 @@ class OpenAIFinder(BaseFinder):
         except Exception as e:
             print("Error processing segment:", e)
             return ("", coordinates)
+
+
+class AsyncOpenAIFinder(AsyncModelFinder):
+    """OpenAIFinder with its segment requests sent over the async OpenAI client."""
+
+    def __init__(self, c: BaseConfig, executor: AsyncExecutor):
+        # the blocking finder only lends its prompts and search settings, it never captures
+        super().__init__(OpenAIFinder(c, None), executor)
+        self.model_config = c.models.get("finder_config")
+
+    async def process_segment(self, segment, prompt):
+        segment_frame, coordinates = segment
+        url = await asyncio.to_thread(segment_frame.data_url, "PNG")
+        response = await get_async_openai_client(self.model_config).beta.chat.completions.parse(
+            model=self.model_name,
+            messages=[
+                {"role": "system", "content": self.finder.system_prompt},
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "image_url", "image_url": {"detail": "low", "url": url}},
+                        {"type": "text", "text": self.finder.gemini_finder_prompt(prompt)},
+                    ],
+                },
+            ],
+            response_format=FinderResponseLLM,
+        )
+        try:
+            return (response.choices[0].message.content, coordinates)
+        except Exception as e:
+            logger.error(f"Error processing segment: {e}")
+            return ("", coordinates)
@@ -0,0 +1,29 @@
+import asyncio
+from typing import List, Optional
+
+from . import AsyncFinder, BaseFinder
+from clickclickclick.executor import Frame
+
+
+class ThreadedFinder(AsyncFinder):
+    """
+    Runs a blocking finder on the default thread pool, so existing finders and finder
+    wrappers can be used by the async task engine unchanged.
+    """
+
+    def __init__(self, finder: BaseFinder):
+        self.finder = finder
+        self.IMAGE_WIDTH = finder.IMAGE_WIDTH
+        self.IMAGE_HEIGHT = finder.IMAGE_HEIGHT
+
+    async def find_element(self, prompt, observation: str, frame: Optional[Frame] = None) -> str:
+        return await asyncio.to_thread(self.finder.find_element, prompt, observation, frame)
+
+    def report_click(self, screen_changed: bool):
+        self.finder.report_click(screen_changed)
+
+    def summary(self) -> dict:
+        return self.finder.summary()
+
+    async def scale_coordinates(self, coordinates: List[int]) -> List[int]:
+        return await asyncio.to_thread(self.finder.scale_coordinates, coordinates)
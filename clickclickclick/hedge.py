@@ -0,0 +1,148 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Optional, TypeVar
+
+from clickclickclick import cancel
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Hedged calls and their duplicates run here, a losing call finishes in the background
+_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+
+
+class Hedger:
+    """
+    Sends a duplicate of a slow request and uses whichever response arrives first.
+
+    A call that has not returned after the `percentile` of recent latencies is hedged with
+    `secondary` (or the same callable again). Only calls without side effects should be
+    hedged. At most `budget` of all calls fire a hedge, so a slow backend is not hit with
+    twice the load.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        percentile: float = 0.9,
+        budget: float = 0.1,
+        min_samples: int = 10,
+        window: int = 100,
+    ):
+        self.name = name
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=window)
+        self.calls = 0
+        self.hedges_fired = 0
+        self.hedges_won = 0
+        self._lock = threading.Lock()
+
+    def delay(self) -> Optional[float]:
+        """Seconds to wait before hedging, None until enough latencies are known."""
+        with self._lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            latencies = sorted(self.latencies)
+        return latencies[int(self.percentile * (len(latencies) - 1))]
+
+    def _record(self, latency: float):
+        with self._lock:
+            self.latencies.append(latency)
+
+    def _take_budget(self) -> bool:
+        with self._lock:
+            if self.hedges_fired + 1 > self.budget * self.calls:
+                return False
+            self.hedges_fired += 1
+            return True
+
+    def _submit(self, fn: Callable[[], T]) -> Future:
+        start = time.monotonic()
+        future = cancel.submit(_pool, fn)
+
+        def done(f):
+            if f.exception() is None:
+                self._record(time.monotonic() - start)
+
+        future.add_done_callback(done)
+        return future
+
+    def call(
+        self,
+        fn: Callable[[], T],
+        secondary: Optional[Callable[[], T]] = None,
+        discard: Optional[Callable[[T], None]] = None,
+    ) -> T:
+        """`fn()`, hedged with `secondary`. `discard` releases the result of the losing call."""
+        with self._lock:
+            self.calls += 1
+        delay = self.delay()
+        if delay is None:
+            start = time.monotonic()
+            result = fn()
+            self._record(time.monotonic() - start)
+            return result
+
+        first = self._submit(fn)
+        done, _ = wait([first], timeout=delay)
+        if done or not self._take_budget():
+            return first.result()
+
+        logger.info(f"{self.name} call slower than {delay:.2f}s, sending a hedged request")
+        hedge = self._submit(secondary or fn)
+        pending = [first, hedge]
+        errors = []
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self._lock:
+                            self.hedges_won += 1
+                    if discard is not None:
+                        for loser in pending:
+                            loser.add_done_callback(
+                                lambda f: f.exception() is None and discard(f.result())
+                            )
+                    logger.debug(f"Hedging stats: {self.as_dict()}")
+                    return future.result()
+                errors.append(future.exception())
+        raise errors[0]
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "name": self.name,
+                "calls": self.calls,
+                "hedges_fired": self.hedges_fired,
+                "hedges_won": self.hedges_won,
+                "samples": len(self.latencies),
+            }
+
+
+_hedgers: Dict[str, Hedger] = {}
+_hedgers_lock = threading.Lock()
+
+
+def get_hedger(name: str, c) -> Optional[Hedger]:
+    """Hedger shared by every planner or finder of the same backend, None when disabled."""
+    if not c.HEDGE_REQUESTS:
+        return None
+    with _hedgers_lock:
+        hedger = _hedgers.get(name)
+        if hedger is None:
+            hedger = _hedgers[name] = Hedger(
+                name, c.HEDGE_PERCENTILE, c.HEDGE_BUDGET, c.HEDGE_MIN_SAMPLES
+            )
+        return hedger
+
+
+def hedger_stats() -> Dict[str, dict]:
+    with _hedgers_lock:
+        return {name: hedger.as_dict() for name, hedger in _hedgers.items()}
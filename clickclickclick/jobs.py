@@ -0,0 +1,185 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from clickclickclick.cancel import CancellationToken
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+TIMED_OUT = "timed_out"
+CANCELLED = "cancelled"
+FINISHED = {SUCCEEDED, FAILED, TIMED_OUT, CANCELLED}
+
+
+class QueueFull(Exception):
+    """Raised by `JobQueue.create` when as many jobs as allowed are queued or running."""
+
+
+@dataclass
+class Job:
+    id: str
+    prompt: str
+    token: CancellationToken
+    status: str = QUEUED
+    result: Any = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    events: List[dict] = field(default_factory=list)
+    future: Optional[Future] = None
+    cancel_requested: bool = False
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    def record(self, event: str, **data):
+        """Appends an event for `GET /tasks/{id}/events`, numbered so a reader can resume."""
+        self.events.append({"seq": len(self.events), "event": event, "time": time.time(), **data})
+
+    def on_action(self, step: int, function_name: str, arguments: Optional[dict]):
+        self.record("action", step=step, function=function_name, arguments=arguments)
+
+    def as_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "task_prompt": self.prompt,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    """
+    Tasks submitted to the API, tracked by id so they can be polled and cancelled.
+
+    At most `max_pending` jobs can be queued or running at once, further submissions are
+    refused with QueueFull rather than piling up behind the devices. Finished jobs are kept
+    for `retention_seconds` so their result can still be read.
+    """
+
+    def __init__(self, max_pending: int = 64, retention_seconds: float = 3600):
+        self.max_pending = max_pending
+        self.retention_seconds = retention_seconds
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def create(self, prompt: str, timeout: Optional[float] = None) -> Job:
+        """A new queued job whose time budget of `timeout` seconds starts now."""
+        with self._lock:
+            self._expire()
+            if self.pending >= self.max_pending:
+                raise QueueFull(f"{self.pending} tasks are already queued or running")
+            job = Job(uuid.uuid4().hex, prompt, CancellationToken(timeout))
+            job.record(QUEUED)
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    @property
+    def pending(self) -> int:
+        return sum(not job.finished for job in self._jobs.values())
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return {"max_pending": self.max_pending, "jobs": counts}
+
+    def attach(self, job: Job, future: Future):
+        """
+        Tracks the future the job was submitted as. A job whose future fails before `run`
+        got to it, e.g. because no device could take it, is recorded as failed.
+        """
+        job.future = future
+
+        def done(future: Future):
+            if future.cancelled() or future.exception() is None:
+                return
+            with self._lock:
+                self._finish(job, FAILED, error=str(future.exception()))
+
+        future.add_done_callback(done)
+
+    def run(self, job: Job, task: Callable[[], Any]) -> Any:
+        """
+        Runs `task` (`run_task` returns True or False, None once stopped) on the worker that
+        picked up the job, and records its outcome on the job.
+        """
+        with self._lock:
+            if job.finished:
+                return None  # cancelled before a worker got to it
+            job.status = RUNNING
+            job.started_at = time.time()
+            job.record(RUNNING)
+        try:
+            result = task()
+        except Exception as e:
+            logger.exception(f"Job {job.id} failed")
+            with self._lock:
+                self._finish(job, FAILED, error=str(e))
+            raise
+        with self._lock:
+            if result is None:
+                status = CANCELLED if job.cancel_requested else TIMED_OUT
+                self._finish(job, status, error=job.token.reason)
+            else:
+                self._finish(job, SUCCEEDED if result else FAILED, result=result)
+        return result
+
+    def cancel(self, job_id: str, timed_out: bool = False) -> Optional[Job]:
+        """
+        Cancels a job: a queued one never starts, a running one stops at its next cancellation
+        point. `timed_out` records it as having run out of time rather than being cancelled by
+        the client. Returns None for unknown ids.
+        """
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return job
+        job.cancel_requested = not timed_out
+        reason = "Task did not complete within the timeout period" if timed_out else None
+        job.token.cancel(reason or "cancelled by the client")
+        if job.future is not None:
+            job.future.cancel()
+        with self._lock:
+            if job.status == QUEUED:
+                # its worker skips it, whether or not it has picked the job up yet
+                status = TIMED_OUT if timed_out else CANCELLED
+                self._finish(job, status, error=reason or "cancelled before it started")
+        return job
+
+    def _finish(self, job: Job, status: str, result=None, error=None):
+        """Records the outcome of a job, the first one wins. Called with the lock held."""
+        if job.finished:
+            return
+        job.status = status
+        job.result = result
+        job.error = error
+        job.finished_at = time.time()
+        job.record(status, result=result, error=error)
+
+    def _expire(self):
+        cutoff = time.time() - self.retention_seconds
+        for job_id in [
+            job.id
+            for job in self._jobs.values()
+            if job.finished_at is not None and job.finished_at < cutoff
+        ]:
+            del self._jobs[job_id]
@@ -1,13 +1,60 @@
 from abc import ABC, abstractmethod
-from typing import Any
+from typing import AsyncIterator, Callable, Iterator, List, Optional, Tuple
 import logging
+from clickclickclick.executor import Frame
 
 logger = logging.getLogger(__name__)
 
 
 class Planner(ABC):
     @abstractmethod
-    def llm_response(self, prompt, screenshot) -> str:
+    def llm_response(self, prompt, screenshot: Frame) -> str:
+        pass
+
+    def llm_response_stream(
+        self, prompt, screenshot: Frame, on_partial: Optional[Callable[[str, str], None]] = None
+    ) -> Iterator[Tuple[str, dict]]:
+        """
+        Yields each function call as soon as it is complete, while the rest of the response
+        may still be arriving. Planners without streaming yield the whole response at once.
+
+        `on_partial(function_name, arguments_so_far)` is called as arguments stream in, for
+        work that can start before a call is complete.
+        """
+        yield from self.llm_response(prompt, screenshot)
+
+    def prepare_screenshot(self, screenshot: Frame):
+        """Encodes the screenshot ahead of llm_response, e.g. while waiting on the device."""
+        pass
+
+    @abstractmethod
+    def add_finder_message(self, message):
+        pass
+
+    @abstractmethod
+    def task_finished(self, reason):
+        pass
+
+
+class AsyncPlanner(ABC):
+    """
+    Asyncio counterpart of `Planner`. Only the model round trip is a coroutine, history
+    bookkeeping stays synchronous. `ThreadedPlanner` adapts any blocking planner.
+    """
+
+    @abstractmethod
+    async def llm_response(self, prompt, screenshot: Frame) -> List[Tuple[str, dict]]:
+        pass
+
+    async def llm_response_stream(
+        self, prompt, screenshot: Frame, on_partial: Optional[Callable[[str, str], None]] = None
+    ) -> AsyncIterator[Tuple[str, dict]]:
+        """See `Planner.llm_response_stream`, `on_partial` is called on the event loop."""
+        for call in await self.llm_response(prompt, screenshot):
+            yield call
+
+    def prepare_screenshot(self, screenshot: Frame):
+        """Encodes the screenshot ahead of llm_response, run on a worker thread."""
         pass
 
     @abstractmethod
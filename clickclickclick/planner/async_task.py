@@ -0,0 +1,258 @@
+import asyncio
+import inspect
+import time
+from contextlib import aclosing
+from typing import Any, Callable, Optional
+
+from . import AsyncPlanner, logger
+from .pipeline import AsyncStepPipeline, StageTimings
+from .task import (
+    begin_planned_action,
+    bind_function,
+    center_of,
+    clicked_message,
+    complete_plan,
+    frame_after,
+    invalid_action_reason,
+    stage_of,
+    stop_plan,
+    unchanged_reason,
+)
+from clickclickclick.cancel import CancellationToken, TaskCancelled, use_token
+from clickclickclick.config import BaseConfig
+from clickclickclick.executor import AsyncExecutor, Frame
+from clickclickclick.executor.settle import settle_options, wait_for_stable_screen_async
+from clickclickclick.finder import AsyncFinder
+
+
+async def execute_task_async(
+    prompt: str,
+    executor: AsyncExecutor,
+    planner: AsyncPlanner,
+    finder: AsyncFinder,
+    c: BaseConfig,
+    on_action: Optional[Callable[[int, str, dict], None]] = None,
+) -> bool:
+    """
+    `execute_task` as a coroutine, so a single event loop can run many tasks. Settling the
+    next screen and looking up an element while the planner streams run as asyncio tasks.
+    """
+    timings = StageTimings()
+    pipeline = AsyncStepPipeline(executor, planner, finder, c, timings)
+    try:
+        clicked_frame = None
+        step = 0
+        while True:
+            step += 1
+            settled = await pipeline.next_frame()
+            screenshot = settled.frame
+            if clicked_frame is not None and screenshot is not None:
+                changed = await asyncio.to_thread(screenshot.difference, clicked_frame)
+                finder.report_click(changed > c.SETTLE_THRESHOLD)
+            clicked_frame = None
+            logger.info(
+                f"Generated screenshot, screen settled in {settled.settle_time:.2f}s "
+                f"(stable={settled.stable}, captures={settled.captures})"
+            )
+
+            frame = screenshot
+            planning_started = time.monotonic()
+            on_partial = None
+            if c.PIPELINE_PREFETCH:
+                on_partial = lambda name, arguments: pipeline.on_partial(name, arguments, frame)
+            if c.PLANNER_STREAMING:
+                llm_responses = planner.llm_response_stream(prompt, screenshot, on_partial)
+            else:
+                llm_responses = iter_async(await planner.llm_response(prompt, screenshot))
+            index = 0
+            # closes the planner stream when an action ends the task before it is drained
+            async with aclosing(llm_responses):
+                while True:
+                    waiting = time.monotonic()
+                    response = await anext(llm_responses, None)
+                    timings.record("plan", time.monotonic() - waiting)
+                    if response is None:
+                        break
+                    func_name, func_args = response
+                    if index == 0:
+                        elapsed = time.monotonic() - planning_started
+                        logger.info(f"First action {func_name} after {elapsed:.2f}s")
+                    index += 1
+                    if on_action is not None and func_name != "run_action_plan":
+                        on_action(step, func_name, func_args)  # a plan reports each of its actions
+                    finder_output = None
+                    logger.debug(f"Executing {func_name} with {func_args}")
+                    frame_before = frame
+                    pipeline.discard_frame()
+                    acting = time.monotonic()
+                    prefetched = None
+                    if func_name == "find_element_and_click" and func_args:
+                        prefetched = await pipeline.take_element(func_args.get("prompt"), frame)
+                    if prefetched is not None:
+                        # already timed as finder_prefetch by the pipeline
+                        execution_output, executed_fn_name = prefetched, func_name
+                        logger.info(f"Used the element prefetched for {func_args.get('prompt')}")
+                    elif func_name == "run_action_plan":
+                        finished = await execute_action_plan_async(
+                            func_args.get("actions", []),
+                            executor,
+                            planner,
+                            finder,
+                            c,
+                            frame,
+                            step,
+                            on_action,
+                        )
+                        timings.record("act", time.monotonic() - acting)
+                        if finished:
+                            return True
+                        frame = None
+                        if c.PIPELINE_PREFETCH:
+                            pipeline.prefetch_frame()
+                        continue
+                    else:
+                        execution_output, executed_fn_name = await parse_and_execute_async(
+                            func_name, func_args, executor, planner, finder, frame
+                        )
+                        timings.record(stage_of(executed_fn_name), time.monotonic() - acting)
+                    frame = frame_after(executed_fn_name, execution_output, frame)
+                    if executed_fn_name == "find_element_and_click":
+                        logger.info(f"Executed Finder with output: {execution_output}")
+                        ui_element = func_args.get("prompt", "")
+                        finder_output = execution_output
+                        clicked_frame = frame_before
+
+                    if executed_fn_name == "task_finished":
+                        return True
+
+                    if finder_output is not None:
+                        acting = time.monotonic()
+                        await click_found_element_async(
+                            finder_output, ui_element, executor, planner, finder
+                        )
+                        timings.record("act", time.monotonic() - acting)
+
+                    if c.PIPELINE_PREFETCH and frame is None:
+                        pipeline.prefetch_frame()
+            timings.end_step(step)
+
+    except TaskCancelled as e:
+        logger.warning(f"Task cancelled after {time.monotonic() - timings.started:.2f}s: {e}")
+        return False
+    except Exception as e:
+        logger.exception("An error occurred during task execution.")
+        return False
+    finally:
+        pipeline.close()
+
+
+async def iter_async(items):
+    for item in items:
+        yield item
+
+
+async def click_found_element_async(finder_output, ui_element, executor, planner, finder):
+    coordinates = list(map(int, finder_output.split(",")))
+    scaled_coordinates = await finder.scale_coordinates(coordinates)
+    await executor.click_at_a_point(*center_of(coordinates), "Clicking center right away")
+    planner.add_finder_message(clicked_message(ui_element, scaled_coordinates))
+
+
+async def execute_action_plan_async(
+    actions: list,
+    executor: AsyncExecutor,
+    planner: AsyncPlanner,
+    finder: AsyncFinder,
+    c: BaseConfig,
+    frame: Optional[Frame] = None,
+    step: int = 0,
+    on_action: Optional[Callable[[int, str, dict], None]] = None,
+) -> bool:
+    """`execute_action_plan` for the async engine."""
+
+    async def settle():
+        settled = await wait_for_stable_screen_async(executor, **settle_options(c))
+        return settled.frame
+
+    for number, action in enumerate(actions, 1):
+        func_name, func_args = begin_planned_action(action, number, len(actions), step, on_action)
+        if func_args is None:
+            return stop_plan(planner, number, invalid_action_reason(action))
+        expect_change = action.get("expect_screen_change", False)
+        if expect_change and frame is None:
+            frame = await settle()
+        execution_output, executed_fn_name = await parse_and_execute_async(
+            func_name, func_args, executor, planner, finder, frame
+        )
+        if executed_fn_name == "task_finished":
+            return True
+        if executed_fn_name == "find_element_and_click":
+            if execution_output == "0,0,0,0":
+                prompt = func_args.get("prompt")
+                return stop_plan(planner, number, f"{prompt} was not found on the screen")
+            await click_found_element_async(
+                execution_output, func_args.get("prompt", ""), executor, planner, finder
+            )
+
+        if expect_change and executed_fn_name != "screenshot":
+            after = await settle()
+            changed = (
+                after is not None
+                and frame is not None
+                and await asyncio.to_thread(after.difference, frame) > c.SETTLE_THRESHOLD
+            )
+            if executed_fn_name == "find_element_and_click":
+                finder.report_click(changed)
+            if not changed:
+                return stop_plan(planner, number, unchanged_reason(func_name, number, actions))
+            frame = after
+        else:
+            frame = frame_after(executed_fn_name, execution_output, frame)
+
+    return complete_plan(planner, actions)
+
+
+async def execute_with_timeout_async(
+    task, timeout, *args, cancel_token: Optional[CancellationToken] = None, **kwargs
+):
+    """
+    `execute_with_timeout` for coroutines: the task is cancelled at its deadline or when the
+    token is cancelled, and None is returned. The token is also in the task's context, so
+    work handed to threads by the thread-backed adapters stops as well.
+    """
+    token = cancel_token or CancellationToken()
+    token.limit(timeout)
+    if token.cancelled:
+        logger.error(f"Task was not started: {token.reason}")
+        return None
+    with use_token(token):
+        running = asyncio.ensure_future(task(*args, **kwargs))
+    loop = asyncio.get_running_loop()
+    unregister = token.on_cancel(lambda: loop.call_soon_threadsafe(running.cancel))
+    result = None
+    try:
+        result = await asyncio.wait_for(running, token.remaining())
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        token.cancel("Task did not complete within the timeout period")
+        if asyncio.current_task().cancelling():
+            raise  # the caller itself was cancelled
+    finally:
+        unregister()
+    if token.cancelled:
+        logger.error(f"Task stopped: {token.reason}")
+        return None
+    return result
+
+
+async def parse_and_execute_async(
+    function_name: str,
+    function_args: dict,
+    executor: AsyncExecutor,
+    planner: AsyncPlanner,
+    finder: AsyncFinder,
+    frame: Optional[Frame] = None,
+) -> Any:
+    result = bind_function(function_name, function_args, executor, planner, finder, frame)()
+    if inspect.isawaitable(result):
+        result = await result
+    return (result, function_name)
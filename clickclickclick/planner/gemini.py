@@ -1,11 +1,12 @@
 import google.generativeai as genai
-from google.generativeai.types import FunctionDeclaration, Tool, File
+from google.generativeai.types import FunctionDeclaration, Tool
+from google.generativeai import protos
 from google.generativeai.protos import FunctionCallingConfig, ToolConfig
-from typing import Any
-from PIL import Image
-import tempfile
+from clickclickclick.cancel import request_timeout
 from clickclickclick.config import BaseConfig
+from clickclickclick.executor import Frame
 from . import Planner, logger
+from .history import ChatHistory
 
 
 class GeminiPlanner(Planner):
@@ -18,11 +19,13 @@ class GeminiPlanner(Planner):
         api_key = planner_config.get("api_key")
         model_name = planner_config.get("model_name")
         generation_config = planner_config.get("generation_config")
+        # screenshots are sent at the planner's configured size
+        self.image_size = (planner_config.get("image_width"), planner_config.get("image_height"))
 
         function_declarations = c.function_declarations
         logger.info("Gemini Planner init")
         genai.configure(api_key=api_key)
-        self.chat_history = []
+        self.history = ChatHistory(c.HISTORY_TOKEN_BUDGET, c.HISTORY_SUMMARY_TOKENS)
         # Create FunctionDeclaration objects
         self.functions = []
         for func in function_declarations:
@@ -54,36 +57,37 @@ class GeminiPlanner(Planner):
             tools=[all_functions_tool],
             tool_config=tool_config,
         )
+        # one chat session for the whole task, only the new turn is sent each step
+        self.chat_session = self.model.start_chat()
+        self.task_prompt = None
+        self.pending_messages = []
 
-    def llm_response(self, prompt=None, screenshot=None) -> list[tuple[str, dict]]:
-        # Remove any previous screenshots from the chat history
-        self.chat_history = [
-            message
-            for message in self.chat_history
-            if not (
-                message.get("role") == "user" and isinstance(message.get("parts", [{}])[0], File)
-            )
-        ]
-        # todo
-        assert screenshot.endswith(".png")
-
-        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as temp_file:
-            temp_file_path = temp_file.name
-
-        # Resize the image
-        with Image.open(screenshot) as img:
-            # Example resize operation, may need to adjust size
-            img = img.resize((768, 768))  # todo from config
-            img.save(temp_file_path)
+    def llm_response(self, prompt=None, screenshot: Frame = None) -> list[tuple[str, dict]]:
+        summarized_turns = self.history.summarized_turns
+        image = screenshot.resized(*self.image_size)
+        # the image goes inline with the request, no separate upload round trip
+        parts = [{"mime_type": "image/png", "data": image.png()}]
+        texts = []
+        if prompt and prompt != self.task_prompt:
+            self.history.set_task(prompt)
+            self.task_prompt = prompt
+            texts.append(prompt)
+        texts.extend(self.pending_messages)
+        self.pending_messages = []
+        parts.extend(texts)
 
-        file = genai.upload_file(temp_file_path, mime_type="image/png")
-        # Append the current screenshot to the chat history
-        self.chat_history.append({"role": "user", "parts": [file]})
-
-        logger.info(self.chat_history)
-        self.chat_session = self.model.start_chat(history=self.chat_history)
-        response = self.chat_session.send_message(f"{prompt}")  # Adjust as needed
+        logger.debug(f"Planner prompt is about {self.history.tokens()} text tokens")
+        timeout = request_timeout()
+        response = self.chat_session.send_message(
+            parts, request_options={"timeout": timeout} if timeout is not None else None
+        )
         logger.info(response)
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            logger.info(
+                f"Planner step used {usage.prompt_token_count} prompt tokens "
+                f"({usage.cached_content_token_count} cached)"
+            )
         for i in range(len(response.candidates[0].content.parts)):
             try:
                 function_call = response.candidates[0].content.parts[i].function_call
@@ -92,29 +96,39 @@ class GeminiPlanner(Planner):
                 pass
         function_name = function_call.name
 
-        # user prompt needs to be only inserted one time
-        if not any(
-            message.get("parts", [None])[0] == prompt
-            for message in self.chat_history
-            if message.get("role") == "user"
-        ):
-            self.chat_history.append({"role": "user", "parts": [prompt]})
-
         args = function_call.args
         d = {key: args[key] for key in args}
         logger.info(f"{d} args")
-        self.chat_history.append(
-            {"role": "model", "parts": [f"function name: {function_name} args: {d}"]}
+        action = f"function name: {function_name} args: {d}"
+        self.history.add("assistant", action)
+
+        # Later steps only need the text of this exchange: the screenshot bytes are dropped and
+        # the function call is kept as plain text, like the rest of the history
+        session_history = self.chat_session.history
+        session_history[-2] = protos.Content(
+            role="user", parts=[protos.Part(text=text) for text in texts or ["(screenshot)"]]
         )
+        session_history[-1] = protos.Content(role="model", parts=[protos.Part(text=action)])
+        if self.history.summarized_turns != summarized_turns:
+            # older turns were folded into the summary, continue from the shortened history
+            self.chat_session.history = [
+                {"role": "model" if turn.role == "assistant" else "user", "parts": [turn.text]}
+                for turn in self.history.turns()
+            ]
 
         if function_name == "task_finished":
             with open("planner.logs", "a") as f:
-                f.write("\n".join(map(str, self.chat_history)))
+                f.write("\n".join(f"{turn.role}: {turn.text}" for turn in self.history.turns()))
                 f.write("\n\n")
         return [(function_name, {key: args[key] for key in args})]
 
+    def prepare_screenshot(self, screenshot: Frame):
+        screenshot.resized(*self.image_size).png()
+
     def add_finder_message(self, message):
-        self.chat_history.append({"role": "user", "parts": [message]})
+        # sent along with the next screenshot, in the same user turn
+        self.pending_messages.append(message)
+        self.history.add("user", message)
 
     def task_finished(self, reason, observation: str):
         logger.info(f"Task finished, reason: {reason}")
@@ -0,0 +1,110 @@
+from collections import deque
+from dataclasses import dataclass
+from typing import List, Optional
+
+from clickclickclick.executor import Frame
+
+SUMMARY_LINE_CHARS = 120
+
+
+def estimate_tokens(text: str) -> int:
+    # roughly four characters per token for English and JSON
+    return len(text) // 4 + 1
+
+
+@dataclass
+class Turn:
+    role: str  # "user" or "assistant"
+    text: str
+    image: Optional[Frame] = None
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.text)
+
+
+class ChatHistory:
+    """
+    Planner conversation kept within a token budget.
+
+    The task prompt is pinned, the latest screenshot is held on its own (an older one is
+    simply replaced, never stored with the turns), and turns are appended in place. When the
+    recent turns exceed `budget_tokens`, the oldest ones are collapsed into one line each of a
+    rolling summary, which itself keeps only its newest `summary_tokens` worth of lines. The
+    prompt sent each step therefore stays bounded however long the task runs.
+
+    Turns are folded in batches, down to half the budget, so the rendered prefix (task,
+    summary, older turns) stays identical across several steps and provider prompt caching
+    keeps applying to it.
+    """
+
+    def __init__(self, budget_tokens: int = 4000, summary_tokens: int = 1000):
+        self.budget_tokens = budget_tokens
+        self.summary_tokens = summary_tokens
+        self.task: Optional[Turn] = None
+        self.screen: Optional[Turn] = None
+        self.recent: deque = deque()
+        self.summary: deque = deque()
+        self.summarized_turns = 0
+        self._recent_tokens = 0
+        self._summary_tokens = 0
+
+    def set_task(self, prompt: str):
+        if prompt and (self.task is None or self.task.text != prompt):
+            self.task = Turn("user", prompt)
+
+    def set_screen(self, frame: Frame, text: Optional[str] = None):
+        """The screenshot for the next request, replacing the previous one."""
+        self.screen = Turn("user", text or "", frame)
+
+    def add(self, role: str, text: str):
+        # the screenshot was answered, later requests get a newer one
+        self.screen = None
+        self._append(Turn(role, text))
+
+    def _append(self, turn: Turn):
+        self.recent.append(turn)
+        self._recent_tokens += turn.tokens
+        if self._recent_tokens > self.budget_tokens:
+            while self._recent_tokens > self.budget_tokens // 2 and len(self.recent) > 1:
+                self._summarize(self.recent.popleft())
+
+    def _summarize(self, turn: Turn):
+        self._recent_tokens -= turn.tokens
+        line = " ".join(turn.text.split())
+        if len(line) > SUMMARY_LINE_CHARS:
+            line = line[: SUMMARY_LINE_CHARS - 3] + "..."
+        line = f"{turn.role}: {line}"
+        self.summary.append(line)
+        self.summarized_turns += 1
+        self._summary_tokens += estimate_tokens(line)
+        while self._summary_tokens > self.summary_tokens and len(self.summary) > 1:
+            self._summary_tokens -= estimate_tokens(self.summary.popleft())
+
+    def summary_text(self) -> Optional[str]:
+        if not self.summary:
+            return None
+        omitted = self.summarized_turns - len(self.summary)
+        header = "Summary of earlier steps"
+        if omitted:
+            header += f" ({omitted} older turns omitted)"
+        return header + ":\n" + "\n".join(self.summary)
+
+    def turns(self) -> List[Turn]:
+        """Everything to send, oldest first: task, summary, recent turns, screenshot."""
+        turns = []
+        if self.task is not None:
+            turns.append(self.task)
+        summary = self.summary_text()
+        if summary:
+            turns.append(Turn("user", summary))
+        turns.extend(self.recent)
+        if self.screen is not None:
+            turns.append(self.screen)
+        return turns
+
+    def tokens(self) -> int:
+        """Estimated text tokens of the next request, excluding the screenshot."""
+        task_tokens = self.task.tokens if self.task else 0
+        screen_tokens = self.screen.tokens if self.screen else 0
+        return task_tokens + self._summary_tokens + self._recent_tokens + screen_tokens
@@ -1,8 +1,11 @@
+import itertools
 from ollama import Client
-from typing import Any
 from . import Planner, logger
+from .history import ChatHistory
+from clickclickclick.cancel import check_cancelled
 from clickclickclick.config import BaseConfig
-from clickclickclick.executor import Executor
+from clickclickclick.executor import Executor, Frame
+from clickclickclick.hedge import get_hedger
 
 
 class OllamaPlanner(Planner):
@@ -16,42 +19,49 @@ class OllamaPlanner(Planner):
         self.model_name = planner_config.get("model_name")
         function_declarations = c.function_declarations
         self.executor = executor
-        self.chat_history = [
-            {
-                "role": "system",
-                "content": system_prompt,  # + "\nHere is a exact list of functions in JSON format that you can invoke.\n\n{functions}\n , Make sure you do not use any other function.".format(functions=function_declarations),
-            }
-        ]
+        # a slow completion is only hedged on a different model, never repeated as is
+        self.secondary_model = c.HEDGE_PLANNER_SECONDARY_MODEL
+        self.hedger = get_hedger(f"planner:{self.model_name}", c) if self.secondary_model else None
+        self.system_prompt = system_prompt
+        self.history = ChatHistory(c.HISTORY_TOKEN_BUDGET, c.HISTORY_SUMMARY_TOKENS)
         # Create tool representations directly
         self.tools = []
         for func in function_declarations:
             tool = {"type": "function", "function": func}
             self.tools.append(tool)
 
-    def llm_response(self, prompt=None, screenshot=None) -> list[tuple[str, dict]]:
-        # Remove items with 'images' key from chat history
-        self.chat_history = [entry for entry in self.chat_history if "images" not in entry]
-
+    def build_messages(self, prompt, screenshot: Frame) -> list:
+        self.history.set_task(prompt)
         if screenshot:
-            self.chat_history.append(
-                {
-                    "role": "user",
-                    "content": prompt or "New screenshot for the task attached",
-                    "images": [screenshot],
-                }
-            )
-        else:
-            self.chat_history.append({"role": "user", "content": prompt})
+            self.history.set_screen(screenshot, "New screenshot for the task attached")
+        messages = [{"role": "system", "content": self.system_prompt}]
+        for turn in self.history.turns():
+            message = {"role": turn.role, "content": turn.text}
+            if turn.image is not None:
+                message["images"] = [turn.image.base64()]
+            messages.append(message)
+        logger.debug(f"Planner prompt is about {self.history.tokens()} text tokens")
+        return messages
+
+    def llm_response(self, prompt=None, screenshot: Frame = None) -> list[tuple[str, dict]]:
+        messages = self.build_messages(prompt, screenshot)
         import time
 
         start_time = time.time()  # Record the start time
-        response = self.client.chat(
-            model=self.model_name, messages=self.chat_history, tools=self.tools
-        )
+
+        def chat(model=self.model_name):
+            return self.client.chat(model=model, messages=messages, tools=self.tools)
+
+        if self.hedger:
+            response = self.hedger.call(chat, lambda: chat(self.secondary_model))
+        else:
+            response = chat()
         end_time = time.time()  # Record the end time
         elapsed_time = end_time - start_time  # Calculate the elapsed time
         print(f"Time required to run the statement: {elapsed_time} seconds")
         print(response, "all res[ponse]")
+        # the server reuses its cache for an unchanged prefix and only evaluates the rest
+        logger.info(f"Planner step evaluated {response.get('prompt_eval_count')} prompt tokens")
         tool_calls = response["message"].get("tool_calls", [])
 
         if tool_calls:
@@ -62,9 +72,7 @@ class OllamaPlanner(Planner):
                 function_name = function_call["name"]
                 args = function_call.get("arguments", {})
 
-                self.chat_history.append(
-                    {"role": "assistant", "content": f"Function: {function_name} with args: {args}"}
-                )
+                self.history.add("assistant", f"Function: {function_name} with args: {args}")
 
                 print(f"Function Call: {function_name} with args: {args}")
                 if "observation" not in args:
@@ -76,8 +84,45 @@ class OllamaPlanner(Planner):
         logger.info(response["message"]["content"])
         return response["message"]["content"]
 
+    def prepare_screenshot(self, screenshot: Frame):
+        screenshot.base64()
+
+    def llm_response_stream(self, prompt=None, screenshot: Frame = None, on_partial=None):
+        messages = self.build_messages(prompt, screenshot)
+
+        def open_stream(model=self.model_name):
+            chunks = self.client.chat(model=model, messages=messages, tools=self.tools, stream=True)
+            return next(chunks, None), chunks
+
+        if self.hedger:
+            # hedges the wait for the first chunk, the stream that answers later is closed
+            first, chunks = self.hedger.call(
+                open_stream, lambda: open_stream(self.secondary_model), lambda s: s[1].close()
+            )
+        else:
+            first, chunks = open_stream()
+        content = []
+        for chunk in itertools.chain([first] if first is not None else [], chunks):
+            check_cancelled()
+            # tool calls arrive whole, each one is dispatched as soon as its chunk does
+            for tool_call in chunk["message"].get("tool_calls") or []:
+                function_name = tool_call["function"]["name"]
+                args = tool_call["function"].get("arguments", {})
+                self.history.add("assistant", f"Function: {function_name} with args: {args}")
+                logger.info(f"Streamed function call {function_name} with args: {args}")
+                if "observation" not in args:
+                    args["observation"] = "NA"
+                yield function_name, args
+            content.append(chunk["message"].get("content") or "")
+            if chunk.get("done"):
+                logger.info(
+                    f"Planner step evaluated {chunk.get('prompt_eval_count')} prompt tokens"
+                )
+        if "".join(content).strip():
+            logger.info("".join(content))
+
     def add_finder_message(self, message):
-        self.chat_history.append({"role": "user", "content": message})
+        self.history.add("user", message)
 
     def task_finished(self, reason, observation: str):
         logger.info(f"Task finished, reason: {reason}")
@@ -1,8 +1,25 @@
-import openai
-from typing import Any
-from . import Planner, logger
+from . import AsyncPlanner, Planner, logger
+from .history import ChatHistory, Turn
 import json
+from clickclickclick.cancel import abort_on_cancel, request_timeout
+from clickclickclick.clients import get_async_openai_client, get_openai_client
 from clickclickclick.config import BaseConfig
+from clickclickclick.executor import Frame
+from clickclickclick.hedge import get_hedger
+
+
+def strict_schema(schema: dict) -> dict:
+    """Copy of a parameters schema with additionalProperties disabled on every object."""
+    schema = dict(schema)
+    if schema.get("type") == "object":
+        schema["additionalProperties"] = False
+        if "properties" in schema:
+            schema["properties"] = {
+                name: strict_schema(value) for name, value in schema["properties"].items()
+            }
+    if "items" in schema:
+        schema["items"] = strict_schema(schema["items"])
+    return schema
 
 
 class ChatGPTPlanner(Planner):
@@ -13,95 +30,72 @@ class ChatGPTPlanner(Planner):
             f"{prompts['common-planner-prompt']}\n{prompts['specific-planner-prompt']}"
         )
         planner_config = c.models.get("planner_config")
-        openai.api_key = planner_config.get("api_key")
-        openai.azure_endpoint = planner_config.get("azure_endpoint")
-        openai.api_type = planner_config.get("api_type")
-        openai.api_version = planner_config.get("api_version")
-        base_url = planner_config.get("base_url")
-        if base_url:
-            openai.base_url = base_url
+        self.client = get_openai_client(planner_config)
         self.model_name = planner_config.get("model_name")
         self.functions = c.function_declarations
+        # built once, an identical tools payload every step keeps the prompt prefix cacheable
+        self.tools = [
+            {
+                "type": "function",
+                "function": {**fn, "parameters": strict_schema(fn["parameters"]), "strict": True},
+            }
+            for fn in self.functions
+        ]
+        self.usage = {"prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+        # a slow completion is only hedged on a different backend, never repeated as is
+        self.secondary_model = c.HEDGE_PLANNER_SECONDARY_MODEL
+        self.hedger = get_hedger(f"planner:{self.model_name}", c) if self.secondary_model else None
 
         self.system_instruction = system_instruction
-        self.chat_history = [{"role": "system", "content": system_instruction}]
+        self.history = ChatHistory(c.HISTORY_TOKEN_BUDGET, c.HISTORY_SUMMARY_TOKENS)
 
-    def build_prompt(self, query_text=None, base64_image=None):
-        if query_text is None:
-            return [
+    def render(self, turn: Turn) -> dict:
+        content = []
+        if turn.text:
+            content.append({"type": "text", "text": turn.text})
+        if turn.image is not None:
+            # "low" detail is downscaled by the API anyway, JPEG keeps the upload small
+            content.append(
                 {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}",
-                                "detail": "low",
-                            },
-                        }
-                    ],
+                    "type": "image_url",
+                    "image_url": {"url": turn.image.data_url("JPEG"), "detail": "low"},
                 }
-            ]
-        else:
-            return [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": query_text},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}",
-                                "detail": "low",
-                            },
-                        },
-                    ],
-                }
-            ]
-
-    def llm_response(self, prompt=None, screenshot=None) -> list[tuple[str, dict]]:
-        # Remove all prev screenshots
-        new_chat_history = []
-        for message in self.chat_history:
-            if message["role"] == "user" and any(
-                item["type"] == "image_url" for item in message["content"]
-            ):
-
-                filtered_content = [
-                    item for item in message["content"] if item["type"] != "image_url"
-                ]
-                new_chat_history.append({"role": message["role"], "content": filtered_content})
-
-            else:
-                new_chat_history.append(message)
-        # Append the current prompt to the chat history
+            )
+        return {"role": turn.role, "content": content}
+
+    def build_messages(self, prompt, screenshot: Frame) -> list:
+        self.history.set_task(prompt)
         if screenshot:
-            prompt_with_image = self.build_prompt(
-                prompt, f"{screenshot}"
-            )  # data:image/jpeg;base64,
-            new_chat_history.extend(prompt_with_image)
-        else:
-            new_chat_history.extend(self.build_prompt(prompt))
-        self.chat_history = new_chat_history
+            self.history.set_screen(screenshot)
+        messages = [{"role": "system", "content": self.system_instruction}]
+        messages.extend(self.render(turn) for turn in self.history.turns())
+        logger.debug(f"Planner prompt is about {self.history.tokens()} text tokens")
+        return messages
 
-        completion = openai.chat.completions.create(
-            model=self.model_name,
-            messages=self.chat_history,
-            tools=[
-                {
-                    "type": "function",
-                    "function": {
-                        **fn,
-                        "parameters": {**fn["parameters"], "additionalProperties": False},
-                        "strict": True,
-                    },
-                }
-                for fn in self.functions
-            ],
-            tool_choice="required",
-            parallel_tool_calls=False,
-        )
+    def llm_response(self, prompt=None, screenshot: Frame = None) -> list[tuple[str, dict]]:
+        messages = self.build_messages(prompt, screenshot)
+
+        def create(model=self.model_name):
+            return self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                tools=self.tools,
+                tool_choice="required",
+                parallel_tool_calls=False,
+                timeout=request_timeout(self.client.timeout),
+            )
+
+        if self.hedger:
+            completion = self.hedger.call(create, lambda: create(self.secondary_model))
+        else:
+            completion = create()
         print(completion)
+        self.report_usage(completion.usage)
+        list_of_functions_to_call = self.function_calls(completion)
+        print(list_of_functions_to_call)
+        return list_of_functions_to_call
+
+    def function_calls(self, completion) -> list[tuple[str, dict]]:
         response_message = completion.choices[0].message
         function_name = None
         function_args = None
@@ -109,27 +103,147 @@ class ChatGPTPlanner(Planner):
         for tool in response_message.tool_calls:
             function_name = tool.function.name
             function_args = json.loads(tool.function.arguments)
-            self.chat_history.append(
-                {
-                    "role": "assistant",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": f"Function: {function_name} with args: {function_args}",
-                        }
-                    ],
-                }
-            )
+            self.history.add("assistant", f"Function: {function_name} with args: {function_args}")
             list_of_functions_to_call.append((function_name, function_args))
 
-        print(list_of_functions_to_call)
-
         if len(list_of_functions_to_call) == 0:
             list_of_functions_to_call.append((None, None))
         return list_of_functions_to_call
 
+    def prepare_screenshot(self, screenshot: Frame):
+        screenshot.data_url("JPEG")
+
+    def llm_response_stream(self, prompt=None, screenshot: Frame = None, on_partial=None):
+        messages = self.build_messages(prompt, screenshot)
+
+        def open_stream(model=self.model_name):
+            return self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                tools=self.tools,
+                tool_choice="required",
+                parallel_tool_calls=False,
+                stream=True,
+                stream_options={"include_usage": True},
+                timeout=request_timeout(self.client.timeout),
+            )
+
+        if self.hedger:
+            # hedges the wait for the first byte, the stream that opens later is closed
+            stream = self.hedger.call(
+                open_stream, lambda: open_stream(self.secondary_model), lambda s: s.close()
+            )
+        else:
+            stream = open_stream()
+        calls = {}  # index -> [name, arguments so far, already yielded]
+        # closing the stream on cancellation aborts the read in flight
+        with abort_on_cancel(stream.close):
+            for chunk in stream:
+                yield from self.stream_chunk(chunk, calls, on_partial)
+
+        if not any(call[2] for call in calls.values()):
+            yield None, None
+
+    def stream_chunk(self, chunk, calls: dict, on_partial=None) -> list[tuple[str, dict]]:
+        """
+        Adds a streamed chunk to `calls` (index -> [name, arguments so far, already yielded])
+        and returns the function calls whose arguments became complete with it.
+        """
+        if chunk.usage is not None:
+            self.report_usage(chunk.usage)
+        if not chunk.choices or not chunk.choices[0].delta.tool_calls:
+            return []
+        complete = []
+        for delta in chunk.choices[0].delta.tool_calls:
+            call = calls.setdefault(delta.index, ["", "", False])
+            if delta.function.name:
+                call[0] += delta.function.name
+            if delta.function.arguments:
+                call[1] += delta.function.arguments
+            if call[2] or not call[0]:
+                continue
+            if on_partial is not None:
+                on_partial(call[0], call[1])
+            try:
+                function_args = json.loads(call[1])
+            except json.JSONDecodeError:
+                continue  # arguments still arriving
+            # complete arguments, dispatch before the rest of the response arrives
+            call[2] = True
+            self.history.add("assistant", f"Function: {call[0]} with args: {function_args}")
+            logger.info(f"Streamed function call {call[0]} with args: {function_args}")
+            complete.append((call[0], function_args))
+        return complete
+
+    def report_usage(self, usage):
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = (getattr(details, "cached_tokens", None) or 0) if details else 0
+        self.usage["prompt_tokens"] += usage.prompt_tokens
+        self.usage["cached_tokens"] += cached_tokens
+        self.usage["completion_tokens"] += usage.completion_tokens
+        logger.info(
+            f"Planner step used {usage.prompt_tokens} prompt tokens ({cached_tokens} cached), "
+            f"task total {self.usage['prompt_tokens']} ({self.usage['cached_tokens']} cached)"
+        )
+
     def add_finder_message(self, message):
-        self.chat_history.append({"role": "user", "content": [{"type": "text", "text": message}]})
+        self.history.add("user", message)
 
     def task_finished(self, reason: str, observation: str):
         logger.info(f"Task finished with reason: {reason}")
+
+
+class AsyncChatGPTPlanner(AsyncPlanner):
+    """
+    ChatGPTPlanner over the async OpenAI client. History, tools and usage accounting are those
+    of a wrapped ChatGPTPlanner, only the requests are awaited.
+    """
+
+    def __init__(self, c: BaseConfig):
+        self.planner = ChatGPTPlanner(c)
+        self.model_config = c.models.get("planner_config")
+
+    async def llm_response(self, prompt=None, screenshot: Frame = None) -> list[tuple[str, dict]]:
+        planner = self.planner
+        completion = await get_async_openai_client(self.model_config).chat.completions.create(
+            model=planner.model_name,
+            messages=planner.build_messages(prompt, screenshot),
+            tools=planner.tools,
+            tool_choice="required",
+            parallel_tool_calls=False,
+        )
+        planner.report_usage(completion.usage)
+        return planner.function_calls(completion)
+
+    async def llm_response_stream(self, prompt=None, screenshot: Frame = None, on_partial=None):
+        planner = self.planner
+        stream = await get_async_openai_client(self.model_config).chat.completions.create(
+            model=planner.model_name,
+            messages=planner.build_messages(prompt, screenshot),
+            tools=planner.tools,
+            tool_choice="required",
+            parallel_tool_calls=False,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        calls = {}
+        try:
+            async for chunk in stream:
+                for call in planner.stream_chunk(chunk, calls, on_partial):
+                    yield call
+        finally:
+            await stream.close()
+
+        if not any(call[2] for call in calls.values()):
+            yield None, None
+
+    def prepare_screenshot(self, screenshot: Frame):
+        self.planner.prepare_screenshot(screenshot)
+
+    def add_finder_message(self, message):
+        self.planner.add_finder_message(message)
+
+    def task_finished(self, reason: str, observation: str):
+        return self.planner.task_finished(reason, observation)
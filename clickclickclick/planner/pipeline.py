@@ -0,0 +1,255 @@
+import asyncio
+import json
+import re
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional
+
+from . import AsyncPlanner, Planner, logger
+from clickclickclick import cancel
+from clickclickclick.config import BaseConfig
+from clickclickclick.executor import AsyncExecutor, Executor, Frame
+from clickclickclick.executor.settle import (
+    SettleResult,
+    settle_options,
+    wait_for_stable_screen,
+    wait_for_stable_screen_async,
+)
+from clickclickclick.finder import AsyncFinder, BaseFinder
+
+# "prompt": "..." with the closing quote already streamed in
+PARTIAL_PROMPT = re.compile(r'"prompt"\s*:\s*("(?:[^"\\]|\\.)*")')
+
+
+class StageTimings:
+    """
+    Time spent in each stage of the step loop. Stages running on the background worker
+    overlap with the foreground ones, so the sum of all stages exceeds the wall time by the
+    amount of overlap achieved.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.totals: Dict[str, float] = defaultdict(float)
+        self.step: Dict[str, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self.totals[stage] += seconds
+            self.step[stage] += seconds
+
+    def end_step(self, index: int):
+        with self._lock:
+            step = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in self.step.items())
+            self.step = defaultdict(float)
+            busy = sum(self.totals.values())
+        wall = time.monotonic() - self.started
+        logger.info(
+            f"Step {index} stages: {step}. Task so far: {busy:.2f}s of stage time in "
+            f"{wall:.2f}s wall time, {max(busy - wall, 0):.2f}s overlapped"
+        )
+
+
+class StepPipeline:
+    """
+    Background work for the step loop: settling and pre-encoding the next frame as soon as an
+    action completes, and looking up an element while the planner is still streaming the rest
+    of its answer.
+    """
+
+    def __init__(
+        self,
+        executor: Executor,
+        planner: Planner,
+        finder: BaseFinder,
+        c: BaseConfig,
+        timings: StageTimings,
+    ):
+        self.executor = executor
+        self.planner = planner
+        self.finder = finder
+        self.c = c
+        self.timings = timings
+        self._worker = ThreadPoolExecutor(max_workers=2, thread_name_prefix="step-pipeline")
+        self._frame: Optional[Future] = None
+        self._frame_cancel: Optional[threading.Event] = None
+        self._element: Optional[tuple] = None  # (prompt, frame, future, token)
+
+    def settle(self, cancel: Optional[threading.Event] = None) -> SettleResult:
+        start = time.monotonic()
+        settled = wait_for_stable_screen(self.executor, **settle_options(self.c), cancel=cancel)
+        self.timings.record("settle", time.monotonic() - start)
+        if settled.frame is not None and not (cancel is not None and cancel.is_set()):
+            start = time.monotonic()
+            self.planner.prepare_screenshot(settled.frame)
+            self.timings.record("encode", time.monotonic() - start)
+        return settled
+
+    def prefetch_frame(self):
+        """Starts settling the screen after an action, replacing any earlier prefetch."""
+        self.discard_frame()
+        self._frame_cancel = threading.Event()
+        self._frame = cancel.submit(self._worker, self.settle, self._frame_cancel)
+
+    def discard_frame(self):
+        if self._frame_cancel is not None:
+            self._frame_cancel.set()
+        self._frame = self._frame_cancel = None
+
+    def next_frame(self) -> SettleResult:
+        """The settled frame for the next step, prefetched if possible."""
+        future, self._frame, self._frame_cancel = self._frame, None, None
+        if future is not None:
+            return future.result()
+        return self.settle()
+
+    def on_partial(self, function_name: str, arguments: str, frame: Optional[Frame]):
+        """Starts the finder once the element prompt of a streaming call is known."""
+        if function_name != "find_element_and_click" or frame is None:
+            return
+        if self._element is not None and self._element[1] is frame:
+            return  # already looking on this frame
+        match = PARTIAL_PROMPT.search(arguments)
+        if match is None:
+            return
+        prompt = json.loads(match.group(1))
+        self.discard_element()
+        # its own token, so a stale lookup can be stopped without stopping the task
+        parent = cancel.current_token()
+        token = parent.child() if parent is not None else cancel.CancellationToken()
+
+        def find():
+            start = time.monotonic()
+            try:
+                with cancel.use_token(token):
+                    return self.finder.find_element(prompt, "Prefetched while planning", frame)
+            finally:
+                token.release()
+                self.timings.record("finder_prefetch", time.monotonic() - start)
+
+        logger.debug(f"Prefetching element {prompt} while the planner streams")
+        self._element = (prompt, frame, cancel.submit(self._worker, find), token)
+
+    def take_element(self, prompt: str, frame: Optional[Frame]) -> Optional[str]:
+        """
+        The result of the prefetched lookup of this prompt on this frame. None without one, or
+        when it failed, the caller then looks the element up itself.
+        """
+        element, self._element = self._element, None
+        if element is None:
+            return None
+        if element[0] != prompt or element[1] is not frame:
+            self._stop(element)
+            return None
+        try:
+            return element[2].result()
+        except Exception:
+            logger.exception(f"Prefetched lookup of {prompt} failed, looking it up again")
+            return None
+
+    def discard_element(self):
+        element, self._element = self._element, None
+        if element is not None:
+            self._stop(element)
+
+    @staticmethod
+    def _stop(element):
+        element[2].cancel()
+        element[3].cancel("the prefetched element is not needed")
+
+    def close(self):
+        self.discard_frame()
+        self.discard_element()
+        # a cancelled task's lookups stop at their next check, queued ones never start
+        self._worker.shutdown(wait=False, cancel_futures=True)
+
+
+class AsyncStepPipeline:
+    """`StepPipeline` for the async engine, the background work runs as asyncio tasks."""
+
+    def __init__(
+        self,
+        executor: AsyncExecutor,
+        planner: AsyncPlanner,
+        finder: AsyncFinder,
+        c: BaseConfig,
+        timings: StageTimings,
+    ):
+        self.executor = executor
+        self.planner = planner
+        self.finder = finder
+        self.c = c
+        self.timings = timings
+        self._frame: Optional[asyncio.Task] = None
+        self._element: Optional[tuple] = None  # (prompt, frame, task)
+
+    async def settle(self) -> SettleResult:
+        start = time.monotonic()
+        settled = await wait_for_stable_screen_async(self.executor, **settle_options(self.c))
+        self.timings.record("settle", time.monotonic() - start)
+        if settled.frame is not None:
+            start = time.monotonic()
+            await asyncio.to_thread(self.planner.prepare_screenshot, settled.frame)
+            self.timings.record("encode", time.monotonic() - start)
+        return settled
+
+    def prefetch_frame(self):
+        self.discard_frame()
+        self._frame = asyncio.create_task(self.settle())
+
+    def discard_frame(self):
+        if self._frame is not None:
+            self._frame.cancel()
+        self._frame = None
+
+    async def next_frame(self) -> SettleResult:
+        task, self._frame = self._frame, None
+        if task is not None:
+            return await task
+        return await self.settle()
+
+    def on_partial(self, function_name: str, arguments: str, frame: Optional[Frame]):
+        if function_name != "find_element_and_click" or frame is None:
+            return
+        if self._element is not None and self._element[1] is frame:
+            return
+        match = PARTIAL_PROMPT.search(arguments)
+        if match is None:
+            return
+        prompt = json.loads(match.group(1))
+        self.discard_element()
+
+        async def find():
+            start = time.monotonic()
+            try:
+                return await self.finder.find_element(prompt, "Prefetched while planning", frame)
+            finally:
+                self.timings.record("finder_prefetch", time.monotonic() - start)
+
+        logger.debug(f"Prefetching element {prompt} while the planner streams")
+        self._element = (prompt, frame, asyncio.create_task(find()))
+
+    async def take_element(self, prompt: str, frame: Optional[Frame]) -> Optional[str]:
+        element, self._element = self._element, None
+        if element is None:
+            return None
+        if element[0] != prompt or element[1] is not frame:
+            element[2].cancel()
+            return None
+        try:
+            return await element[2]
+        except Exception:
+            logger.exception(f"Prefetched lookup of {prompt} failed, looking it up again")
+            return None
+
+    def discard_element(self):
+        element, self._element = self._element, None
+        if element is not None:
+            element[2].cancel()
+
+    def close(self):
+        self.discard_frame()
+        self.discard_element()
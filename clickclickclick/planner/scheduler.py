@@ -0,0 +1,167 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict
+
+from . import logger
+from clickclickclick.executor.android import AndroidExecutor
+from clickclickclick.executor.pool import DevicePool
+
+
+class NoHealthyDevice(RuntimeError):
+    """Set on a task's future when no healthy device took it within its health retries."""
+
+
+@dataclass
+class DeviceStats:
+    serial: str
+    completed: int = 0
+    failed: int = 0
+    busy_seconds: float = 0.0
+    healthy: bool = True
+    busy: bool = False
+    started_at: float = field(default_factory=time.monotonic)
+
+    def as_dict(self) -> dict:
+        elapsed_minutes = max(time.monotonic() - self.started_at, 1e-9) / 60
+        finished = self.completed + self.failed
+        return {
+            "serial": self.serial,
+            "completed": self.completed,
+            "failed": self.failed,
+            "busy": self.busy,
+            "healthy": self.healthy,
+            "tasks_per_minute": finished / elapsed_minutes,
+            "utilization": self.busy_seconds / (elapsed_minutes * 60),
+            "avg_task_seconds": self.busy_seconds / finished if finished else None,
+        }
+
+
+class TaskScheduler:
+    """
+    Runs tasks concurrently on a pool of devices.
+
+    Each device gets one worker thread that takes the next queued task, so a task always
+    lands on a free device. A task is a callable receiving the device's executor. Devices
+    failing their health check are skipped until they recover. A task turned away by
+    unhealthy devices `max_health_retries` times fails with NoHealthyDevice, so it cannot
+    wait forever when the only device never recovers.
+    """
+
+    def __init__(
+        self,
+        pool: DevicePool,
+        max_queue: int = 0,
+        health_retry_seconds: float = 10,
+        max_health_retries: int = 30,
+    ):
+        self.pool = pool
+        self.health_retry_seconds = health_retry_seconds
+        self.max_health_retries = max_health_retries
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stats: Dict[str, DeviceStats] = {}
+        self._workers: Dict[str, threading.Thread] = {}
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._refreshed = None
+        self.start_workers()
+
+    def start_workers(self, max_age: float = 0):
+        """
+        Starts a worker for every pool device that does not have one yet. Attached devices are
+        looked up again unless that was done less than `max_age` seconds ago.
+        """
+        now = time.monotonic()
+        with self._lock:
+            refresh = self._refreshed is None or now - self._refreshed >= max_age
+            if refresh:
+                self._refreshed = now
+        if refresh:
+            self.pool.refresh()
+        with self._lock:
+            for serial in self.pool.serials:
+                if serial in self._workers:
+                    continue
+                self._stats[serial] = DeviceStats(serial)
+                worker = threading.Thread(
+                    target=self._work, args=(serial,), name=f"device-{serial}", daemon=True
+                )
+                self._workers[serial] = worker
+                worker.start()
+
+    def submit(self, task: Callable[[AndroidExecutor], Any], block: bool = True) -> Future:
+        """Queues `task`; raises queue.Full when the queue is bounded and `block` is False."""
+        if not self._workers:
+            self.start_workers()
+        future = Future()
+        self._queue.put((future, task, 0), block=block)
+        return future
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        with self._lock:
+            devices = [stats.as_dict() for stats in self._stats.values()]
+        return {"queue_depth": self.queue_depth, "devices": devices}
+
+    def shutdown(self, wait: bool = True):
+        self._stopped.set()
+        for _ in self._workers:
+            self._queue.put(None)
+        if wait:
+            for worker in self._workers.values():
+                worker.join()
+
+    def _work(self, serial: str):
+        stats = self._stats[serial]
+        executor = self.pool.executor(serial)
+        while not self._stopped.is_set():
+            item = self._queue.get()
+            if item is None:
+                break
+            future, task, retries = item
+            if future.cancelled():
+                continue
+            if not self.pool.is_healthy(serial):
+                stats.healthy = False
+                if retries >= self.max_health_retries:
+                    logger.error(f"No healthy device took a task after {retries} retries")
+                    if future.set_running_or_notify_cancel():
+                        future.set_exception(
+                            NoHealthyDevice(f"No healthy device after {retries} retries")
+                        )
+                else:
+                    # hand the task to another device and back off
+                    self._queue.put((future, task, retries + 1))
+                    logger.warning(f"Device {serial} is unhealthy, retrying later")
+                self._stopped.wait(self.health_retry_seconds)
+                continue
+            stats.healthy = True
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            stats.busy = True
+            start = time.monotonic()
+            try:
+                result = task(executor)
+            except BaseException as e:
+                logger.exception(f"Task failed on device {serial}")
+                self._finished(stats, start, failed=True)
+                future.set_exception(e)
+            else:
+                # counted before the caller sees the result, so stats() already includes it
+                self._finished(stats, start, failed=False)
+                future.set_result(result)
+
+    @staticmethod
+    def _finished(stats: DeviceStats, start: float, failed: bool):
+        stats.busy = False
+        stats.busy_seconds += time.monotonic() - start
+        if failed:
+            stats.failed += 1
+        else:
+            stats.completed += 1
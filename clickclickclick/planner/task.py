@@ -1,86 +1,366 @@
+import json
 import re
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, TimeoutError
-from typing import Callable, Any
+from concurrent.futures import Future
+from typing import Callable, Any, Optional, Tuple
 
 from . import logger
+from clickclickclick.cancel import CancellationToken, TaskCancelled, check_cancelled, use_token
 from clickclickclick.config import BaseConfig
-from clickclickclick.executor import Executor
+from clickclickclick.executor import Executor, Frame
+from clickclickclick.executor.settle import settle_options, wait_for_stable_screen
 from clickclickclick.finder import BaseFinder
 from . import Planner
+from .pipeline import StageTimings, StepPipeline
 
 
 def execute_task(
-    prompt: str, executor: Executor, planner: Planner, finder: BaseFinder, c: BaseConfig
+    prompt: str,
+    executor: Executor,
+    planner: Planner,
+    finder: BaseFinder,
+    c: BaseConfig,
+    on_action: Optional[Callable[[int, str, dict], None]] = None,
 ) -> bool:
+    """
+    Runs the planner step loop until the task is finished. `on_action` is called with the
+    step number, function name and arguments before each planned action runs, for an action
+    plan before each of its actions.
+    """
+    timings = StageTimings()
+    pipeline = StepPipeline(executor, planner, finder, c, timings)
     try:
+        clicked_frame = None  # screen a finder click was made on, to check it had an effect
+        step = 0
         while True:
-            screenshot = executor.screenshot(
-                "Planner took screenshot",
-                executor.screenshot_as_base64,
-                executor.screenshot_as_tempfile,
+            step += 1
+            check_cancelled()
+            settled = pipeline.next_frame()
+            screenshot = settled.frame
+            if clicked_frame is not None and screenshot is not None:
+                finder.report_click(screenshot.difference(clicked_frame) > c.SETTLE_THRESHOLD)
+            clicked_frame = None
+            logger.info(
+                f"Generated screenshot, screen settled in {settled.settle_time:.2f}s "
+                f"(stable={settled.stable}, captures={settled.captures})"
             )
-            logger.info("Generated screenshot")
-            time.sleep(c.TASK_DELAY)
 
-            llm_responses = planner.llm_response(prompt, screenshot)
-            for func_name, func_args in llm_responses:
+            # The frame the planner reasoned about stays valid until an action changes the screen
+            frame = screenshot
+            planning_started = time.monotonic()
+            if c.PLANNER_STREAMING:
+                # actions start while the rest of the planner response is still streaming, and
+                # the finder can start as soon as the element prompt has streamed in
+                on_partial = None
+                if c.PIPELINE_PREFETCH:
+                    on_partial = lambda name, arguments: pipeline.on_partial(name, arguments, frame)
+                llm_responses = planner.llm_response_stream(prompt, screenshot, on_partial)
+            else:
+                llm_responses = planner.llm_response(prompt, screenshot)
+            llm_responses = iter(llm_responses)
+            index = 0
+            while True:
+                waiting = time.monotonic()
+                response = next(llm_responses, None)
+                timings.record("plan", time.monotonic() - waiting)
+                if response is None:
+                    break
+                func_name, func_args = response
+                if index == 0:
+                    logger.info(
+                        f"First action {func_name} after {time.monotonic() - planning_started:.2f}s"
+                    )
+                index += 1
+                check_cancelled()
+                if on_action is not None and func_name != "run_action_plan":
+                    on_action(step, func_name, func_args)  # a plan reports each of its actions
                 finder_output = None
                 logger.debug(f"Executing {func_name} with {func_args}")
-                (execution_output, executed_fn_name) = parse_and_execute(
-                    func_name, func_args, executor, planner, finder
-                )
+                frame_before = frame
+                # a frame settling in the background would be stale after this action
+                pipeline.discard_frame()
+                acting = time.monotonic()
+                prefetched = None
+                if func_name == "find_element_and_click" and func_args:
+                    prefetched = pipeline.take_element(func_args.get("prompt"), frame)
+                if prefetched is not None:
+                    # already timed as finder_prefetch by the pipeline
+                    execution_output, executed_fn_name = prefetched, func_name
+                    logger.info(f"Used the element prefetched for {func_args.get('prompt')}")
+                elif func_name == "run_action_plan":
+                    finished = execute_action_plan(
+                        func_args.get("actions", []),
+                        executor,
+                        planner,
+                        finder,
+                        c,
+                        frame,
+                        step,
+                        on_action,
+                    )
+                    timings.record("act", time.monotonic() - acting)
+                    if finished:
+                        return True
+                    frame = None
+                    if c.PIPELINE_PREFETCH:
+                        pipeline.prefetch_frame()
+                    continue
+                else:
+                    (execution_output, executed_fn_name) = parse_and_execute(
+                        func_name, func_args, executor, planner, finder, frame
+                    )
+                    timings.record(stage_of(executed_fn_name), time.monotonic() - acting)
+                # recapture if a later action in this batch needs the screen
+                frame = frame_after(executed_fn_name, execution_output, frame)
                 if executed_fn_name == "find_element_and_click":
                     logger.info(f"Executed Finder with output: {execution_output}")
                     ui_element = func_args.get("prompt", "")
                     finder_output = execution_output
+                    clicked_frame = frame_before
 
                 if executed_fn_name == "task_finished":
                     return True
 
                 if finder_output is not None:
-                    coordinates = list(map(int, finder_output.split(",")))
-                    scaled_coordinates = finder.scale_coordinates(coordinates)
-                    executor.click_at_a_point(
-                        (coordinates[0] + coordinates[2]) // 2,
-                        (coordinates[1] + coordinates[3]) // 2,
-                        "Clicking center right away",
-                    )
-                    finder_output = ",".join(map(str, scaled_coordinates))
+                    check_cancelled()
+                    acting = time.monotonic()
+                    click_found_element(finder_output, ui_element, executor, planner, finder)
+                    timings.record("act", time.monotonic() - acting)
 
-                    message = f"The UI bounds of the {ui_element} is {finder_output} and it has been clicked "
-                    planner.add_finder_message(message)
+                if c.PIPELINE_PREFETCH and frame is None:
+                    # settle and encode the next screenshot while the planner response finishes
+                    pipeline.prefetch_frame()
+            timings.end_step(step)
 
+    except TaskCancelled as e:
+        logger.warning(f"Task cancelled after {time.monotonic() - timings.started:.2f}s: {e}")
+        return False
     except Exception as e:
         logger.exception("An error occurred during task execution.")
         return False
+    finally:
+        pipeline.close()
+
+
+def click_found_element(finder_output, ui_element, executor, planner, finder):
+    coordinates = list(map(int, finder_output.split(",")))
+    scaled_coordinates = finder.scale_coordinates(coordinates)
+    executor.click_at_a_point(*center_of(coordinates), "Clicking center right away")
+    planner.add_finder_message(clicked_message(ui_element, scaled_coordinates))
+
+
+def center_of(coordinates) -> Tuple[int, int]:
+    return (coordinates[0] + coordinates[2]) // 2, (coordinates[1] + coordinates[3]) // 2
+
+
+def clicked_message(ui_element, scaled_coordinates) -> str:
+    finder_output = ",".join(map(str, scaled_coordinates))
+    return f"The UI bounds of the {ui_element} is {finder_output} and it has been clicked "
+
+
+def stage_of(executed_fn_name: str) -> str:
+    """Timing stage an executed function is recorded under."""
+    return "finder" if executed_fn_name == "find_element_and_click" else "act"
+
+
+def frame_after(executed_fn_name: str, execution_output, frame: Optional[Frame]):
+    """The frame still showing the screen after a function ran, None if it has to be recaptured."""
+    if executed_fn_name == "screenshot":
+        return execution_output
+    if executed_fn_name in SCREEN_PRESERVING_FUNCTIONS:
+        return frame
+    return None
+
+
+def execute_action_plan(
+    actions: list,
+    executor: Executor,
+    planner: Planner,
+    finder: BaseFinder,
+    c: BaseConfig,
+    frame: Optional[Frame] = None,
+    step: int = 0,
+    on_action: Optional[Callable[[int, str, dict], None]] = None,
+) -> bool:
+    """
+    Runs a planned list of actions back to back, checking each expected screen change with a
+    local frame diff instead of a planner round trip. Stops at the first action that does not
+    behave as planned and tells the planner why. Returns True if the task was finished.
+    `on_action` is called with `step`, the planner step the plan belongs to, before each action.
+    """
+
+    def settle():
+        return wait_for_stable_screen(executor, **settle_options(c)).frame
+
+    for number, action in enumerate(actions, 1):
+        check_cancelled()
+        func_name, func_args = begin_planned_action(action, number, len(actions), step, on_action)
+        if func_args is None:
+            return stop_plan(planner, number, invalid_action_reason(action))
+        expect_change = action.get("expect_screen_change", False)
+        if expect_change and frame is None:
+            frame = settle()
+        execution_output, executed_fn_name = parse_and_execute(
+            func_name, func_args, executor, planner, finder, frame
+        )
+        if executed_fn_name == "task_finished":
+            return True
+        if executed_fn_name == "find_element_and_click":
+            if execution_output == "0,0,0,0":
+                prompt = func_args.get("prompt")
+                return stop_plan(planner, number, f"{prompt} was not found on the screen")
+            click_found_element(
+                execution_output, func_args.get("prompt", ""), executor, planner, finder
+            )
+
+        if expect_change and executed_fn_name != "screenshot":
+            after = settle()
+            changed = (
+                after is not None
+                and frame is not None
+                and after.difference(frame) > c.SETTLE_THRESHOLD
+            )
+            if executed_fn_name == "find_element_and_click":
+                finder.report_click(changed)
+            if not changed:
+                return stop_plan(planner, number, unchanged_reason(func_name, number, actions))
+            frame = after
+        else:
+            frame = frame_after(executed_fn_name, execution_output, frame)
+
+    return complete_plan(planner, actions)
+
+
+def begin_planned_action(
+    action: dict,
+    number: int,
+    total: int,
+    step: int,
+    on_action: Optional[Callable[[int, str, dict], None]],
+) -> Tuple[str, Optional[dict]]:
+    """Parses a planned action and reports it, arguments are None if it cannot be run."""
+    func_name, func_args = parse_planned_action(action)
+    if func_args is not None:
+        if on_action is not None:
+            on_action(step, func_name, func_args)
+        logger.info(f"Action plan step {number}/{total}: {func_name} {func_args}")
+    return func_name, func_args
+
+
+def invalid_action_reason(action: dict) -> str:
+    return f"invalid action {action.get('function')} with arguments {action.get('arguments_json')}"
+
+
+def unchanged_reason(func_name: str, number: int, actions: list) -> str:
+    return (
+        f"the screen did not change after {func_name}, "
+        f"the remaining {len(actions) - number} actions were skipped"
+    )
+
+
+def stop_plan(planner, number: int, reason: str) -> bool:
+    planner.add_finder_message(f"Action plan stopped at step {number}: {reason}")
+    return False
+
+
+def complete_plan(planner, actions: list) -> bool:
+    planner.add_finder_message(f"Action plan completed, all {len(actions)} actions were run")
+    return False
+
+
+def parse_planned_action(action: dict) -> Tuple[str, Optional[dict]]:
+    """Function name and arguments of a planned action, arguments are None if unusable."""
+    func_name = action.get("function")
+    try:
+        func_args = json.loads(action.get("arguments_json") or "{}")
+    except ValueError:
+        return func_name, None
+    if func_name == "run_action_plan" or not isinstance(func_args, dict):
+        return func_name, None
+    return func_name, func_args
 
 
 # TODO: move to utils
-def execute_with_timeout(task, timeout, *args, **kwargs):
-    with ThreadPoolExecutor(max_workers=1) as executor:
-        future = executor.submit(task, *args, **kwargs)
-        try:
-            result = future.result(timeout=timeout)
-            return result
-        except TimeoutError:
-            logger.exception("Task did not complete within the timeout period.")
-            return None
+def execute_with_timeout(
+    task, timeout, *args, cancel_token: Optional[CancellationToken] = None, **kwargs
+):
+    """
+    Runs `task` on its own thread with a cancellation token in its context. Returns its
+    result, or None once `timeout` seconds have passed or the token was cancelled. The task
+    is not waited for then: it is cancelled, stops at its next cancellation point, and the
+    caller is free right away.
+    """
+    token = cancel_token or CancellationToken()
+    token.limit(timeout)
+    if token.cancelled:
+        logger.error(f"Task was not started: {token.reason}")
+        return None
+    outcome = Future()
+    finished = threading.Event()
+    outcome.add_done_callback(lambda _: finished.set())
+    unregister = token.on_cancel(finished.set)
+
+    def run():
+        with use_token(token):
+            try:
+                outcome.set_result(task(*args, **kwargs))
+            except BaseException as e:
+                outcome.set_exception(e)
+
+    threading.Thread(target=run, name="task", daemon=True).start()
+    try:
+        finished.wait(token.remaining())
+    except KeyboardInterrupt:
+        token.cancel("interrupted")
+        raise
+    unregister()
+    if not outcome.done() or isinstance(outcome.exception(), TaskCancelled):
+        token.cancel("Task did not complete within the timeout period")
+    if token.cancelled:
+        # a task that noticed the cancellation itself returns normally, but did not finish
+        logger.error(f"Task stopped: {token.reason}")
+        return None
+    return outcome.result()
+
+
+# Functions that leave the screen as it was, so the current frame can be reused after them
+SCREEN_PRESERVING_FUNCTIONS = {"screenshot", "task_finished", "volume_up", "volume_down"}
 
 
 def parse_and_execute(
-    function_name: str, function_args: dict, executor: object, planner: object, finder: object
+    function_name: str,
+    function_args: dict,
+    executor: object,
+    planner: object,
+    finder: object,
+    frame: Optional[Frame] = None,
 ) -> Any:
-    func_name = function_name
-    args = function_args if function_args is not None else []
+    return (
+        bind_function(function_name, function_args, executor, planner, finder, frame)(),
+        function_name,
+    )
+
 
-    func = get_function(func_name, executor, planner, finder)
-    return (func(**args), func_name)
+def bind_function(
+    function_name: str,
+    function_args: Optional[dict],
+    executor,
+    planner,
+    finder,
+    frame: Optional[Frame] = None,
+) -> Callable[[], Any]:
+    """The executor, planner or finder method for a planned function, bound to its arguments."""
+    args = dict(function_args) if function_args is not None else {}
+    if function_name == "find_element_and_click" and frame is not None:
+        # Let the finder look at the same frame the planner saw instead of capturing again
+        args["frame"] = frame
+    func = get_function(function_name, executor, planner, finder)
+    return lambda: func(**args)
 
 
-def get_function(
-    name: str, executor: Executor, planner: Planner, finder: BaseFinder
-) -> Callable[..., Any]:
+def get_function(name: str, executor, planner, finder) -> Callable[..., Any]:
+    """Looks up a planned function, for the sync and the async executor, planner and finder."""
     funcs = {
         "screenshot": executor.screenshot,
         "find_element_and_click": finder.find_element,
@@ -0,0 +1,49 @@
+import asyncio
+
+from . import AsyncPlanner, Planner
+from clickclickclick.executor import Frame
+
+_DONE = object()
+
+
+class ThreadedPlanner(AsyncPlanner):
+    """
+    Runs a blocking `Planner` on the default thread pool, so existing planners can be used by
+    the async task engine unchanged.
+    """
+
+    def __init__(self, planner: Planner):
+        self.planner = planner
+
+    async def llm_response(self, prompt, screenshot: Frame):
+        return await asyncio.to_thread(self.planner.llm_response, prompt, screenshot)
+
+    async def llm_response_stream(self, prompt, screenshot: Frame, on_partial=None):
+        loop = asyncio.get_running_loop()
+        forward = None
+        if on_partial is not None:
+            # the blocking stream runs on a worker thread, the callback belongs on the loop
+            def forward(name, arguments):
+                loop.call_soon_threadsafe(on_partial, name, arguments)
+
+        calls = self.planner.llm_response_stream(prompt, screenshot, forward)
+        try:
+            while True:
+                call = await asyncio.to_thread(next, calls, _DONE)
+                if call is _DONE:
+                    return
+                yield call
+        finally:
+            try:
+                calls.close()
+            except ValueError:
+                pass  # still running on its thread after a cancellation, it ends on its own
+
+    def prepare_screenshot(self, screenshot: Frame):
+        self.planner.prepare_screenshot(screenshot)
+
+    def add_finder_message(self, message):
+        self.planner.add_finder_message(message)
+
+    def task_finished(self, *args, **kwargs):
+        return self.planner.task_finished(*args, **kwargs)
@@ -1,16 +1,24 @@
+import asyncio
+import json
 import os
+import time
 
 import click
+from clickclickclick.clients import aclose_http_clients
 from clickclickclick.config import get_config
 from clickclickclick.executor.android import AndroidExecutor
-from clickclickclick.executor.wind import WindowsExecutor
-from clickclickclick.finder.gemini import GeminiFinder
-from clickclickclick.finder.local_ollama import OllamaFinder
-from clickclickclick.finder.mlx import MLXFinder
-from clickclickclick.finder.openai import OpenAIFinder
-from clickclickclick.planner.gemini import GeminiPlanner
-from clickclickclick.planner.local_ollama import OllamaPlanner
-from clickclickclick.planner.openai import ChatGPTPlanner
+from clickclickclick.executor.pool import DevicePool
+from clickclickclick.factory import (
+    get_async_executor,
+    get_async_finder,
+    get_async_planner,
+    get_executor,
+    get_finder,
+    get_planner,
+)
+from clickclickclick.hedge import hedger_stats
+from clickclickclick.planner.async_task import execute_task_async, execute_with_timeout_async
+from clickclickclick.planner.scheduler import TaskScheduler
 from clickclickclick.planner.task import execute_task, execute_with_timeout
 
 
@@ -19,37 +27,6 @@ def cli():
     pass
 
 
-def get_executor(platform):
-    if platform.lower() == "win":
-        return WindowsExecutor()
-    return AndroidExecutor()
-
-
-def get_planner(planner_model, config, executor):
-    if planner_model.lower() == "openai":
-        executor.screenshot_as_base64 = True
-        return ChatGPTPlanner(config)
-    elif planner_model.lower() == "gemini":
-        executor.screenshot_as_tempfile = True
-        return GeminiPlanner(config)
-    elif planner_model.lower() == "ollama":
-        executor.screenshot_as_tempfile = True
-        return OllamaPlanner(config, executor)
-    raise ValueError(f"Unsupported planner model: {planner_model}")
-
-
-def get_finder(finder_model, config, executor):
-    if finder_model.lower() == "openai":
-        return OpenAIFinder(config, executor)
-    elif finder_model.lower() == "gemini":
-        return GeminiFinder(config, executor)
-    elif finder_model.lower() == "ollama":
-        return OllamaFinder(config, executor)
-    elif finder_model.lower() == "mlx":
-        return MLXFinder(config, executor)
-    raise ValueError(f"Unsupported finder model: {finder_model}")
-
-
 def setup_environment_variables(planner=None, finder=None):
     if planner and planner.lower() == "gemini":
         os.environ["GEMINI_API_KEY"] = click.prompt("Enter your Gemini API key", hide_input=True)
@@ -131,31 +108,155 @@ def setup_openai_or_azure(existing=False):
 @click.option(
     "--finder-model",
     default="gemini",
-    help="The finder model to use, 'openai', 'gemini', or 'ollama'.",
+    help="The finder model to use, 'openai', 'gemini', or 'ollama'. Comma separate several "
+    "to run them as an ensemble, e.g. 'gemini,openai'.",
+)
+@click.option(
+    "--ensemble-mode",
+    type=click.Choice(["race", "consensus"]),
+    default=None,
+    help="With several finder models, use the first box returned or the one most agree on.",
+)
+@click.option("--serial", default=None, help="Serial of the android device to use.")
+@click.option(
+    "--stream/--no-stream",
+    default=False,
+    help="Capture android frames continuously in the background instead of on demand.",
+)
+@click.option(
+    "--search-mode",
+    type=click.Choice(["single", "tiled", "two_pass"]),
+    default=None,
+    help="How the finder looks at the screen: one scaled image, native resolution tiles, "
+    "or a thumbnail followed by a crop.",
 )
-def run(task_prompt, platform, planner_model, finder_model):
+def run(
+    task_prompt, platform, planner_model, finder_model, serial, stream, search_mode, ensemble_mode
+):
     """
     Execute a task with the given TASK_PROMPT using the specified
     platform, planner model, and finder model.
     """
     task_prompt = " ".join(task_prompt)
     config = get_config(platform, planner_model, finder_model)
+    if search_mode:
+        config.FINDER_SEARCH_MODE = search_mode
+    if ensemble_mode:
+        config.FINDER_ENSEMBLE_MODE = ensemble_mode
 
-    executor = get_executor(platform)
-    planner = get_planner(planner_model, config, executor)
-    finder = get_finder(finder_model, config, executor)
+    executor = get_executor(platform, serial, stream)
 
     if not task_prompt:
         task_prompt = config.SAMPLE_TASK_PROMPT
 
-    result = execute_with_timeout(
-        execute_task, config.TASK_TIMEOUT_IN_SECONDS, task_prompt, executor, planner, finder, config
-    )
+    result = run_task(task_prompt, executor, config, planner_model, finder_model)
 
     if result is not None:
         print(result)
 
 
+def run_task(task_prompt, executor, config, planner_model, finder_model, cancel_token=None):
+    planner = get_planner(planner_model, config, executor)
+    finder = get_finder(finder_model, config, executor)
+    return execute_with_timeout(
+        execute_task,
+        config.TASK_TIMEOUT_IN_SECONDS,
+        task_prompt,
+        executor,
+        planner,
+        finder,
+        config,
+        cancel_token=cancel_token,
+    )
+
+
+@click.command("run-many")
+@click.argument("prompts_file", type=click.File("r"))
+@click.option(
+    "--devices", default="all", help="Comma separated device serials, or 'all' attached devices."
+)
+@click.option("--planner-model", default="openai", help="The planner model to use.")
+@click.option("--finder-model", default="gemini", help="The finder model to use.")
+@click.option(
+    "--engine",
+    type=click.Choice(["threads", "async"]),
+    default="threads",
+    help="One thread per device, or all devices driven from one asyncio event loop.",
+)
+def run_many(prompts_file, devices, planner_model, finder_model, engine):
+    """
+    Execute every task prompt in PROMPTS_FILE (one per line) concurrently
+    on the given android devices.
+    """
+    prompts = [line.strip() for line in prompts_file if line.strip()]
+    config = get_config("android", planner_model, finder_model)
+    pool = DevicePool(None if devices == "all" else devices.split(","))
+    if not pool.serials:
+        raise click.ClickException("No android devices found")
+    if engine == "async":
+        results = asyncio.run(
+            run_many_async(prompts, pool.serials, config, planner_model, finder_model)
+        )
+        for prompt, result in zip(prompts, results):
+            print(f"{prompt}: {result}")
+        pool.close()
+        return
+    scheduler = TaskScheduler(pool)
+
+    futures = [
+        scheduler.submit(
+            lambda executor, prompt=prompt: run_task(
+                prompt, executor, config, planner_model, finder_model
+            )
+        )
+        for prompt in prompts
+    ]
+    for prompt, future in zip(prompts, futures):
+        print(f"{prompt}: {future.result()}")
+
+    print(json.dumps(scheduler.stats(), indent=2))
+    print(json.dumps(hedger_stats(), indent=2))
+    scheduler.shutdown()
+    pool.close()
+
+
+async def run_many_async(prompts, serials, config, planner_model, finder_model):
+    """Runs the prompts with one asyncio worker per device, results in prompt order."""
+    queue = asyncio.Queue()
+    for index, prompt in enumerate(prompts):
+        queue.put_nowait((index, prompt))
+    results = [None] * len(prompts)
+
+    async def device_worker(serial):
+        executor = get_async_executor("android", serial)
+        # blocking finders drive the device through their own executor, one per worker
+        sync_executor = None if finder_model.lower() == "openai" else AndroidExecutor(serial)
+        try:
+            finder = get_async_finder(finder_model, config, executor, sync_executor)
+            while not queue.empty():
+                index, prompt = queue.get_nowait()
+                planner = get_async_planner(planner_model, config, executor)
+                results[index] = await execute_with_timeout_async(
+                    execute_task_async,
+                    config.TASK_TIMEOUT_IN_SECONDS,
+                    prompt,
+                    executor,
+                    planner,
+                    finder,
+                    config,
+                )
+        finally:
+            await executor.close()
+            if sync_executor is not None:
+                await asyncio.to_thread(sync_executor.close)
+
+    try:
+        await asyncio.gather(*(device_worker(serial) for serial in serials))
+    finally:
+        await aclose_http_clients()
+    return results
+
+
 @click.command()
 def setup():
     """Setup command to configure planner and finder"""
@@ -169,8 +270,33 @@ def setup():
     setup_environment_variables(planner, finder)
 
 
+@click.command("bench-screenshot")
+@click.option("--rounds", default=10, help="Number of captures per mode.")
+def bench_screenshot(rounds):
+    """Compare raw framebuffer captures against device PNG captures."""
+    for mode in ("png", "raw"):
+        executor = AndroidExecutor(capture_mode=mode)
+        executor.screenshot("warm up")
+        capture_time = encode_time = 0.0
+        for _ in range(rounds):
+            start = time.perf_counter()
+            screenshot = executor.screenshot("benchmark")
+            capture_time += time.perf_counter() - start
+            # what a backend pays when it does need PNG bytes
+            start = time.perf_counter()
+            screenshot.png()
+            encode_time += time.perf_counter() - start
+        executor.close()
+        print(
+            f"{mode}: capture {capture_time / rounds * 1000:.1f} ms, "
+            f"capture + host PNG encode {(capture_time + encode_time) / rounds * 1000:.1f} ms"
+        )
+
+
 cli.add_command(run)
+cli.add_command(run_many)
 cli.add_command(setup)
+cli.add_command(bench_screenshot)
 
 if __name__ == "__main__":
     cli()
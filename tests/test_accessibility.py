@@ -0,0 +1,140 @@
+import asyncio
+from subprocess import CompletedProcess
+from types import SimpleNamespace
+
+import pytest
+
+from clickclickclick.executor import ScreenGeometry
+from clickclickclick.finder.accessibility import (
+    AccessibilityFinder,
+    AccessibilityTree,
+    AsyncAccessibilityFinder,
+)
+
+HIERARCHY = """<?xml version='1.0' encoding='UTF-8' standalone='yes' ?>
+<hierarchy rotation="0">
+  <node text="" content-desc="" resource-id="" class="android.widget.FrameLayout"
+        clickable="false" bounds="[0,0][1080,2400]">
+    <node text="Settings" content-desc="" resource-id="" class="android.widget.TextView"
+          clickable="true" bounds="[0,100][1080,200]" />
+    <node text="" content-desc="Chrome" resource-id="" class="android.widget.TextView"
+          clickable="true" bounds="[0,300][200,500]" />
+    <node text="Wi-Fi preferences" content-desc="" resource-id="" class="android.widget.TextView"
+          clickable="true" bounds="[0,600][1080,700]" />
+    <node text="Display brightness" content-desc="" resource-id="" class="android.widget.TextView"
+          clickable="true" bounds="[0,800][1080,900]" />
+    <node text="Sound brightness" content-desc="" resource-id="" class="android.widget.TextView"
+          clickable="true" bounds="[0,1000][1080,1100]" />
+    <node text="Sign in" content-desc="" resource-id="com.example:id/sign_in"
+          class="android.widget.Button" clickable="true" bounds="[0,1200][1080,1300]" />
+  </node>
+</hierarchy>
+"""
+
+
+@pytest.fixture
+def finder():
+    vision = SimpleNamespace(
+        IMAGE_WIDTH=1080, IMAGE_HEIGHT=2400, OUTPUT_WIDTH=1080, OUTPUT_HEIGHT=2400, model_name="x"
+    )
+    finder = AccessibilityFinder(vision, executor=None)
+    finder.dump_tree = lambda: AccessibilityTree(HIERARCHY)
+    return finder
+
+
+def labels(node):
+    return node.labels if node is not None else None
+
+
+@pytest.mark.parametrize(
+    "prompt, label",
+    [
+        ("Settings", "Settings"),
+        ("Chrome icon", "Chrome"),  # only filler words beyond the label
+        ("the Wi-Fi option", "Wi-Fi preferences"),  # prompt covered by a longer label
+        ('tap "Sign in"', "Sign in"),
+    ],
+)
+def test_confident_matches(finder, prompt, label):
+    assert labels(finder.find_in_tree(prompt))[0] == label
+
+
+@pytest.mark.parametrize(
+    "prompt",
+    [
+        "Settings gear icon",  # "gear" is not on the Settings label
+        "open Settings",
+        "Chrome icon on the home screen",
+        "Display brightness slider",
+        "Sign up",
+    ],
+)
+def test_near_misses_fall_back_to_vision(finder, prompt):
+    assert finder.find_in_tree(prompt) is None
+
+
+def test_prompt_covered_by_several_labels_is_ambiguous(finder):
+    # "Display brightness" and "Sound brightness" both contain the prompt
+    assert finder.find_in_tree("brightness") is None
+
+
+def test_extra_prompt_words_score_below_threshold():
+    scores = {
+        node.labels[0]: score for score, node in AccessibilityTree(HIERARCHY).match("Settings gear")
+    }
+    assert scores["Settings"] < 0.85
+
+
+class AsyncDevice:
+    def __init__(self):
+        self.dumps = 0
+
+    async def run_shell(self, commands):
+        self.dumps += 1
+        return CompletedProcess(["shell"], 0, HIERARCHY, "")
+
+    async def screen_geometry(self):
+        return ScreenGeometry(1080, 2400)
+
+
+class AsyncVision:
+    IMAGE_WIDTH = 1080
+    IMAGE_HEIGHT = 2400
+
+    def __init__(self):
+        self.prompts = []
+
+    async def find_element(self, prompt, observation, frame=None):
+        self.prompts.append(prompt)
+        return "0,0,0,0"
+
+    def summary(self):
+        return {}
+
+
+def test_async_finder_only_asks_vision_without_a_confident_match():
+    vision = AsyncVision()
+    finder = AsyncAccessibilityFinder(vision, AsyncDevice())
+
+    assert asyncio.run(finder.find_element("Settings", "")) == "100,0,200,1080"
+    assert vision.prompts == []
+    asyncio.run(finder.find_element("brightness", ""))
+    assert vision.prompts == ["brightness"]
+
+
+def test_tree_is_skipped_after_repeated_misses():
+    vision, device = AsyncVision(), AsyncDevice()
+    finder = AsyncAccessibilityFinder(vision, device)
+
+    async def lookups(prompt, count):
+        for _ in range(count):
+            await finder.find_element(prompt, "")
+
+    asyncio.run(lookups("Sign up", 6))
+    assert (device.dumps, len(vision.prompts)) == (3, 6)
+    asyncio.run(lookups("Settings", 2))  # the tree is tried again, and used while it hits
+    assert (device.dumps, len(vision.prompts)) == (5, 6)
+
+    stats = finder.summary()["accessibility"]
+    assert (stats["tree_hits"], stats["tree_skips"], stats["vision_calls"]) == (2, 3, 6)
+    assert stats["hit_rate"] == 2 / 8
@@ -0,0 +1,329 @@
+import asyncio
+import os
+import socket
+import socketserver
+import struct
+import subprocess
+import threading
+import time
+
+import pytest
+
+from clickclickclick.executor.adb import AdbClient, AdbError, AdbFailure, AsyncAdbClient
+from clickclickclick.executor.android import AdbShellSession
+
+SERIAL = "emulator-5554"
+
+# command -> (stdout, stderr, exit code) answered by the stub device
+COMMANDS = {
+    "echo hi": (b"hi\n", b"", 0),
+    "fail": (b"", b"boom", 3),
+}
+
+
+def read_exact(sock, size):
+    buf = b""
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            raise EOFError
+        buf += chunk
+    return buf
+
+
+def read_request(sock):
+    length = int(read_exact(sock, 4), 16)
+    return read_exact(sock, length).decode()
+
+
+def fail(sock, message):
+    sock.sendall(b"FAIL" + b"%04x" % len(message) + message.encode())
+
+
+class StubAdbServer:
+    """Just enough of the adb server wire protocol, and of adbd behind it, for AdbClient."""
+
+    def __init__(self, shell_v2=True):
+        self.shell_v2 = shell_v2
+        self.files = {}
+        self.transports = 0
+        self.services = []
+        self.idle = []  # connections that completed host:transport and wait for a service
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                try:
+                    stub.handle(self.request)
+                except (EOFError, OSError):
+                    pass
+
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def drop_idle(self):
+        """Closes pooled transports, as if the device had been reconnected."""
+        with self._lock:
+            idle, self.idle = self.idle, []
+        for sock in idle:
+            sock.shutdown(socket.SHUT_RDWR)
+            sock.close()
+
+    def handle(self, sock):
+        request = read_request(sock)
+        if request == "host:devices":
+            devices = f"{SERIAL}\tdevice\n".encode()
+            sock.sendall(b"OKAY" + b"%04x" % len(devices) + devices)
+            return
+        if request in (f"host-serial:{SERIAL}:features", "host:features"):
+            features = b"shell_v2,cmd" if self.shell_v2 else b"cmd"
+            sock.sendall(b"OKAY" + b"%04x" % len(features) + features)
+            return
+        if request not in (f"host:transport:{SERIAL}", "host:transport-any"):
+            fail(sock, "device not found")
+            return
+        sock.sendall(b"OKAY")
+        with self._lock:
+            self.transports += 1
+            self.idle.append(sock)
+        service = read_request(sock)
+        with self._lock:
+            if sock in self.idle:
+                self.idle.remove(sock)
+            self.services.append(service)
+        if service in ("shell,v2,raw:sh", "shell:sh"):
+            sock.sendall(b"OKAY")
+            self.bridge_shell(sock, v2=service.startswith("shell,v2"))
+        elif service == "shell,v2,raw:hang":
+            sock.sendall(b"OKAY")
+            sock.recv(1)  # never answers, until the client gives up
+        elif service == "shell,v2,raw:refused":
+            fail(sock, "permission denied")
+        elif service.startswith("shell,v2,raw:"):
+            if not self.shell_v2:
+                fail(sock, "unknown service")
+                return
+            stdout, stderr, code = COMMANDS[service.split(":", 1)[1]]
+            sock.sendall(b"OKAY")
+            for packet_id, data in ((1, stdout), (2, stderr), (3, bytes([code]))):
+                if data:
+                    sock.sendall(struct.pack("<BI", packet_id, len(data)) + data)
+        elif service.startswith("shell:"):
+            sock.sendall(b"OKAY" + COMMANDS[service.split(":", 1)[1]][0])
+        elif service == "sync:":
+            sock.sendall(b"OKAY")
+            self.sync(sock)
+        else:
+            fail(sock, f"unknown service {service}")
+
+    def bridge_shell(self, sock, v2):
+        """Connects the service to a local `sh`, as adbd would to the device shell."""
+        shell = subprocess.Popen(
+            ["sh"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE if v2 else subprocess.STDOUT,
+        )
+
+        def forward(stream, packet_id):
+            for data in iter(lambda: stream.read1(4096), b""):
+                sock.sendall(struct.pack("<BI", packet_id, len(data)) + data if v2 else data)
+
+        for stream, packet_id in ((shell.stdout, 1), (shell.stderr, 2)):
+            if stream is not None:
+                threading.Thread(target=forward, args=(stream, packet_id), daemon=True).start()
+        try:
+            while True:
+                if v2:
+                    packet_id, length = struct.unpack("<BI", read_exact(sock, 5))
+                    data = read_exact(sock, length)
+                else:
+                    data = sock.recv(4096)
+                    if not data:
+                        break
+                shell.stdin.write(data)
+                shell.stdin.flush()
+        finally:
+            shell.kill()
+
+    def sync(self, sock):
+        while True:
+            command, length = struct.unpack("<4sI", read_exact(sock, 8))
+            if command == b"QUIT":
+                return
+            path = read_exact(sock, length).decode()
+            if command == b"STAT":
+                data = self.files.get(path)
+                mode, size = (0o100644, len(data)) if data is not None else (0, 0)
+                sock.sendall(struct.pack("<4sIII", b"STAT", mode, size, 0))
+            elif command == b"RECV":
+                data = self.files.get(path)
+                if data is None:
+                    message = b"No such file or directory"
+                    sock.sendall(struct.pack("<4sI", b"FAIL", len(message)) + message)
+                    continue
+                for offset in range(0, len(data), 64 * 1024):
+                    chunk = data[offset : offset + 64 * 1024]
+                    sock.sendall(struct.pack("<4sI", b"DATA", len(chunk)) + chunk)
+                sock.sendall(struct.pack("<4sI", b"DONE", 0))
+            elif command == b"SEND":
+                chunks = []
+                while True:
+                    packet, size = struct.unpack("<4sI", read_exact(sock, 8))
+                    if packet == b"DONE":
+                        break
+                    chunks.append(read_exact(sock, size))
+                self.files[path.rsplit(",", 1)[0]] = b"".join(chunks)
+                sock.sendall(struct.pack("<4sI", b"OKAY", 0))
+
+
+@pytest.fixture
+def server():
+    stub = StubAdbServer()
+    yield stub
+    stub.close()
+
+
+def client_for(server, serial=SERIAL):
+    return AdbClient(serial, port=server.port, timeout=5)
+
+
+def wait_for_pool(client):
+    deadline = time.monotonic() + 5
+    while not client._idle.full() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert client._idle.full()
+
+
+def test_devices(server):
+    assert client_for(server).devices() == [(SERIAL, "device")]
+
+
+def test_shell_v2_returns_output_and_exit_code(server):
+    client = client_for(server)
+
+    result = client.shell("echo hi")
+    assert (result.returncode, result.stdout, result.stderr) == (0, "hi\n", "")
+
+    result = client.shell("fail")
+    assert (result.returncode, result.stdout, result.stderr) == (3, "", "boom")
+
+
+def test_shell_falls_back_to_legacy_protocol():
+    server = StubAdbServer(shell_v2=False)
+    try:
+        result = client_for(server).shell("echo hi")
+    finally:
+        server.close()
+    assert (result.returncode, result.stdout) == (0, "hi\n")
+
+
+def test_refused_shell_v2_is_not_retried_with_the_legacy_protocol(server):
+    with pytest.raises(AdbFailure, match="permission denied"):
+        client_for(server).shell("refused")
+    assert server.services == ["shell,v2,raw:refused"]
+
+
+def test_refused_service_is_not_retried_on_another_transport(server):
+    client = client_for(server)
+    client.shell("echo hi")
+    wait_for_pool(client)
+
+    with pytest.raises(AdbFailure, match="unknown service"):
+        client.exec_out("screencap")
+    assert server.services.count("exec:screencap") == 1
+
+
+def test_async_shell(server):
+    client = AsyncAdbClient(SERIAL, port=server.port, timeout=5)
+    result = asyncio.run(client.shell("fail"))
+    assert (result.returncode, result.stdout, result.stderr) == (3, "", "boom")
+
+
+def test_async_reads_time_out(server):
+    client = AsyncAdbClient(SERIAL, port=server.port, timeout=0.2)
+    with pytest.raises(TimeoutError):
+        asyncio.run(client.shell("hang"))
+
+
+def test_unknown_device_raises(server):
+    with pytest.raises(AdbError, match="device not found"):
+        client_for(server, serial="missing").shell("echo hi")
+
+
+def test_uses_pooled_transports(server):
+    client = client_for(server)
+    client.shell("echo hi")
+    wait_for_pool(client)
+    transports = server.transports
+
+    assert client.shell("echo hi").stdout == "hi\n"
+    # served by a pooled transport, only the pool is topped up again
+    wait_for_pool(client)
+    assert server.transports == transports + 1
+
+
+def test_stale_pooled_transports_are_replaced(server):
+    client = client_for(server)
+    client.shell("echo hi")
+    wait_for_pool(client)
+
+    server.drop_idle()
+
+    result = client.shell("echo hi")
+    assert (result.returncode, result.stdout) == (0, "hi\n")
+
+
+def test_push_stat_and_pull(server):
+    client = client_for(server)
+    data = bytes(range(256)) * 1000  # several sync DATA chunks
+
+    client.push(data, "/sdcard/file.bin")
+
+    mode, size, _ = client.stat("/sdcard/file.bin")
+    assert (mode & 0o777, size) == (0o644, len(data))
+    assert client.pull("/sdcard/file.bin") == data
+
+
+def test_pull_missing_file_raises(server):
+    with pytest.raises(AdbError, match="No such file"):
+        client_for(server).pull("/sdcard/missing")
+
+
+@pytest.mark.parametrize("shell_v2", [True, False])
+def test_shell_session_over_the_adb_server(shell_v2):
+    server = StubAdbServer(shell_v2=shell_v2)
+    session = AdbShellSession(client=client_for(server))
+    try:
+        result = session.run(["echo out", "echo err >&2", "false"])
+        after = session.run("printf done")
+    finally:
+        session.close()
+        server.close()
+
+    assert result.returncode == 1
+    if shell_v2:
+        assert (result.stdout, result.stderr) == ("out\n", "err\n")
+    else:
+        assert (result.stdout, result.stderr) == ("out\nerr\n", "")
+    assert (after.returncode, after.stdout, after.stderr) == (0, "done", "")
+
+
+def test_shell_session_process_separates_stderr(tmp_path, monkeypatch):
+    adb = tmp_path / "adb"
+    adb.write_text("#!/bin/sh\nexec sh\n")
+    adb.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    session = AdbShellSession()
+    try:
+        result = session.run("echo out; echo err >&2; (exit 4)")
+    finally:
+        session.close()
+    assert (result.returncode, result.stdout, result.stderr) == (4, "out\n", "err\n")
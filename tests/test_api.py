@@ -0,0 +1,108 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+from clickclickclick.cancel import check_cancelled
+from clickclickclick.jobs import JobQueue
+from clickclickclick.planner.task import execute_with_timeout
+
+
+def fake_task(prompt):
+    """Finishes the "done" and "give up" tasks at once, every other task runs until stopped."""
+    if prompt in ("done", "give up"):
+        return prompt == "done"
+    while True:
+        check_cancelled()
+        time.sleep(0.01)
+
+
+def fake_run_task(request, c, executor, cancel_token=None, on_action=None):
+    return execute_with_timeout(
+        fake_task, c.TASK_TIMEOUT_IN_SECONDS, request.task_prompt, cancel_token=cancel_token
+    )
+
+
+@pytest.fixture
+def config():
+    return SimpleNamespace(TASK_TIMEOUT_IN_SECONDS=5)
+
+
+@pytest.fixture
+def client(monkeypatch, config):
+    monkeypatch.setattr(api, "_jobs", JobQueue(max_pending=2))
+    monkeypatch.setattr(api, "get_cached_config", lambda *args: config)
+    monkeypatch.setattr(api, "get_windows_executor", lambda: "desktop")
+    monkeypatch.setattr(api, "run_task", fake_run_task)
+    return TestClient(api.app)
+
+
+def submit(client, prompt):
+    response = client.post("/tasks", json={"task_prompt": prompt, "platform": "win"})
+    assert response.status_code == 202, response.text
+    return response.json()["id"]
+
+
+def wait_for(client, job_id, *statuses):
+    for _ in range(500):
+        job = client.get(f"/tasks/{job_id}").json()
+        if job["status"] in statuses:
+            return job
+        time.sleep(0.01)
+    pytest.fail(f"task {job_id} stayed {job['status']}")
+
+
+@pytest.mark.parametrize("prompt, status", [("done", "succeeded"), ("give up", "failed")])
+def test_task_runs_to_its_outcome(client, prompt, status):
+    job = wait_for(client, submit(client, prompt), status)
+    assert job["result"] == (prompt == "done")
+
+
+def test_running_task_cancelled(client):
+    job_id = submit(client, "wait")
+    wait_for(client, job_id, "running")
+
+    assert client.delete(f"/tasks/{job_id}").status_code == 200
+    job = wait_for(client, job_id, "cancelled")
+    assert job["error"] == "cancelled by the client"
+
+
+def test_task_past_its_deadline_timed_out(client, config):
+    config.TASK_TIMEOUT_IN_SECONDS = 0.05
+    job = wait_for(client, submit(client, "wait"), "timed_out")
+    assert job["error"]
+
+
+def test_execute_answers_with_the_result(client):
+    response = client.post("/execute", json={"task_prompt": "done", "platform": "win"})
+    assert response.status_code == 200 and response.json() == {"result": True}
+
+
+def test_execute_past_the_deadline_fails(client, config):
+    config.TASK_TIMEOUT_IN_SECONDS = 0.05
+    response = client.post("/execute", json={"task_prompt": "wait", "platform": "win"})
+    assert response.status_code == 500
+
+
+def test_too_many_pending_tasks(client):
+    job_ids = [submit(client, "wait"), submit(client, "wait")]
+
+    response = client.post("/tasks", json={"task_prompt": "wait", "platform": "win"})
+    assert response.status_code == 429 and response.headers["Retry-After"] == "10"
+    assert client.get("/tasks").json()["jobs"] == {"running": 1, "queued": 1}
+
+    for job_id in job_ids:
+        client.delete(f"/tasks/{job_id}")
+        wait_for(client, job_id, "cancelled")
+
+
+def test_unknown_task(client):
+    assert client.get("/tasks/unknown").status_code == 404
+    assert client.delete("/tasks/unknown").status_code == 404
+
+
+def test_unsupported_platform(client):
+    response = client.post("/tasks", json={"task_prompt": "done", "platform": "mac"})
+    assert response.status_code == 400
@@ -0,0 +1,118 @@
+from types import SimpleNamespace
+
+from PIL import Image, ImageDraw
+
+from clickclickclick.executor import Frame
+from clickclickclick.finder.cache import CachingFinder, ElementCache, region_hash
+
+SIZE = 200
+BUTTON = "20,20,80,120"  # ymin,xmin,ymax,xmax
+FEATURED = 0xF0F0F0F0  # a region hash with enough set bits to be cached
+
+
+def screen(button_fill="black", clock=None):
+    image = Image.new("L", (SIZE, SIZE), "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((20, 20, 120, 80), fill=button_fill)
+    draw.rectangle((30, 40, 60, 60), fill="white")  # the button label
+    if clock is not None:
+        draw.text((150, 180), clock, fill="black")
+    return Frame(image)
+
+
+def button_hash(frame):
+    return region_hash(frame, BUTTON, SIZE, SIZE)
+
+
+def cached_button(cache, frame):
+    return cache.get(
+        "OK button", frame.dhash(), lambda bounds: region_hash(frame, bounds, SIZE, SIZE)
+    )
+
+
+def test_changes_elsewhere_on_the_screen_still_hit():
+    cache = ElementCache()
+    before = screen(clock="12:00")
+    cache.put("OK button", before.dhash(), button_hash(before), BUTTON)
+
+    after = screen(clock="12:01")
+    assert cached_button(cache, after).bounds == BUTTON
+
+
+def test_changed_element_pixels_miss():
+    cache = ElementCache()
+    before = screen()
+    cache.put("OK  Button", before.dhash(), button_hash(before), BUTTON)
+
+    assert cached_button(cache, before) is not None  # prompts are normalized
+    assert cached_button(cache, screen(button_fill="white")) is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ElementCache(max_entries=2)
+    for prompt in ("a", "b"):
+        cache.put(prompt, 0, FEATURED, "1,1,2,2")
+    assert cache.get("a", 0, lambda bounds: FEATURED) is not None
+
+    cache.put("c", 0, FEATURED, "1,1,2,2")
+    cached = {prompt: cache.get(prompt, 0, lambda bounds: FEATURED) for prompt in "abc"}
+    assert cached["a"] and cached["b"] is None and cached["c"]
+
+
+def test_expired_entries_are_not_served():
+    cache = ElementCache(ttl_seconds=60)
+    cache.put("a", 0, FEATURED, "1,1,2,2")
+    cache.get("a", 0, lambda bounds: FEATURED).created_at -= 61
+
+    assert cache.get("a", 0, lambda bounds: FEATURED) is None
+    assert len(cache) == 0
+
+
+def test_file_tier_round_trip(tmp_path):
+    path = str(tmp_path / "elements.json")
+    cache = ElementCache(path=path, ttl_seconds=60)
+    cache.put("a", 1, FEATURED, "1,1,2,2")
+    cache.put("old", 1, FEATURED, "3,3,4,4")
+    cache.get("old", 1, lambda bounds: FEATURED).created_at -= 61
+    cache.flush()
+
+    loaded = ElementCache(path=path, ttl_seconds=60)
+    entry = loaded.get("a", 1, lambda bounds: FEATURED)
+    assert (entry.bounds, entry.frame_hash, entry.region_hash) == ("1,1,2,2", 1, FEATURED)
+    assert len(loaded) == 1
+
+
+class Finder:
+    IMAGE_WIDTH = IMAGE_HEIGHT = OUTPUT_WIDTH = OUTPUT_HEIGHT = SIZE
+    model_name = "stub"
+
+    def __init__(self):
+        self.calls = 0
+
+    def find_element(self, prompt, observation, frame=None):
+        self.calls += 1
+        return BUTTON
+
+    def report_click(self, screen_changed):
+        pass
+
+    def summary(self):
+        return {}
+
+
+def test_caching_finder_reports_its_hit_rate():
+    vision = Finder()
+    finder = CachingFinder(vision, SimpleNamespace(), ElementCache())
+    frame = screen()
+    for _ in range(3):
+        assert finder.find_element("OK button", "", frame) == BUTTON
+
+    finder.report_click(screen_changed=False)  # the cached bounds missed, they are dropped
+    assert vision.calls == 1
+    assert finder.summary()["element_cache"] == {
+        "hits": 2,
+        "misses": 1,
+        "invalidations": 1,
+        "hit_rate": 2 / 3,
+        "entries": 0,
+    }
@@ -0,0 +1,87 @@
+import asyncio
+import time
+
+import httpx
+
+from clickclickclick.cancel import (
+    CancellationToken,
+    TaskCancelled,
+    check_cancelled,
+    request_timeout,
+    use_token,
+)
+from clickclickclick.planner.async_task import execute_with_timeout_async
+from clickclickclick.planner.task import execute_with_timeout
+
+
+def cancelled_by_client(token):
+    """A task that is cancelled while running, notices it and returns normally."""
+
+    def task():
+        token.cancel("cancelled by the client")
+        try:
+            check_cancelled()
+        except TaskCancelled:
+            return False
+        return True
+
+    return task
+
+
+def test_returns_the_task_result():
+    assert execute_with_timeout(lambda: "done", 5) == "done"
+
+
+def test_task_returning_after_cancellation_is_not_a_result():
+    token = CancellationToken()
+    assert execute_with_timeout(cancelled_by_client(token), 5, cancel_token=token) is None
+    assert token.reason == "cancelled by the client"
+
+
+def test_task_past_its_deadline_is_stopped():
+    stopped = []
+
+    def task():
+        while True:
+            try:
+                check_cancelled()
+            except TaskCancelled:
+                stopped.append(True)
+                return False
+            time.sleep(0.01)
+
+    token = CancellationToken()
+    assert execute_with_timeout(task, 0.1, cancel_token=token) is None
+    assert token.cancelled
+    deadline = time.monotonic() + 5
+    while not stopped and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert stopped
+
+
+def test_async_task_returning_after_cancellation_is_not_a_result():
+    token = CancellationToken()
+    task = cancelled_by_client(token)
+
+    async def run():
+        return task()
+
+    assert asyncio.run(execute_with_timeout_async(run, 5, cancel_token=token)) is None
+
+
+def test_async_task_past_its_deadline_is_stopped():
+    async def run():
+        await asyncio.sleep(5)
+        return True
+
+    assert asyncio.run(execute_with_timeout_async(run, 0.1)) is None
+
+
+def test_request_timeout_keeps_shorter_httpx_timeouts():
+    token = CancellationToken(30)
+    with use_token(token):
+        timeout = request_timeout(httpx.Timeout(60, connect=5))
+        assert timeout.connect == 5
+        assert 29 < timeout.read <= 30
+        assert request_timeout(10) == 10
+    assert request_timeout(10) == 10  # outside of a task
@@ -0,0 +1,123 @@
+import json
+
+import pytest
+from PIL import Image, ImageDraw
+
+from clickclickclick.executor import Frame
+from clickclickclick.finder import BaseFinder
+
+
+class PixelFinder(BaseFinder):
+    """Answers every segment with the box of its dark pixels, like a perfect vision model."""
+
+    IMAGE_WIDTH = IMAGE_HEIGHT = 512
+    OUTPUT_WIDTH = OUTPUT_HEIGHT = 1000
+
+    def __init__(self, search_mode):
+        super().__init__(None, "pixels", None, None, executor=None)
+        self.SEARCH_MODE = search_mode
+        self.segment_sizes = []
+
+    def process_segment(self, segment, model, prompt):
+        frame, coordinates = segment
+        self.segment_sizes.append(frame.size)
+        dark = frame.image.convert("L").point(lambda value: 255 if value < 128 else 0)
+        bbox = dark.getbbox()
+        if bbox is None:
+            return json.dumps({"ymin": 0, "xmin": 0, "ymax": 0, "xmax": 0}), coordinates
+        left, top, right, bottom = bbox
+        width, height = frame.size
+        box = {
+            "ymin": top / height * self.OUTPUT_HEIGHT,
+            "xmin": left / width * self.OUTPUT_WIDTH,
+            "ymax": bottom / height * self.OUTPUT_HEIGHT,
+            "xmax": right / width * self.OUTPUT_WIDTH,
+        }
+        return json.dumps(box), coordinates
+
+
+def screen(width, height, element=None):
+    """A white screen with a black element at (left, top, right, bottom)."""
+    image = Image.new("RGB", (width, height), "white")
+    if element is not None:
+        left, top, right, bottom = element
+        ImageDraw.Draw(image).rectangle((left, top, right - 1, bottom - 1), fill="black")
+    return Frame(image)
+
+
+def image_space(element, width, height):
+    """The element as ymin,xmin,ymax,xmax in the finder's 512x512 image space."""
+    left, top, right, bottom = element
+    return [top / height * 512, left / width * 512, bottom / height * 512, right / width * 512]
+
+
+def assert_close(answer, expected, tolerance):
+    values = list(map(int, answer.split(",")))
+    assert all(abs(a - b) <= tolerance for a, b in zip(values, expected)), (answer, expected)
+
+
+def test_tiles_cover_the_frame_within_the_tile_budget():
+    finder = PixelFinder("tiled")
+    frame = screen(1080, 2400)
+
+    segments, width, height = finder.tile(frame, 512)
+
+    assert (width, height) == (1080, 2400)
+    assert len(segments) <= finder.MAX_TILES
+    boxes = [box for _, box in segments]
+    assert min(box[0] for box in boxes) == 0 and max(box[2] for box in boxes) == 1080
+    assert min(box[1] for box in boxes) == 0 and max(box[3] for box in boxes) == 2400
+    for tile_frame, (left, top, right, bottom) in segments:
+        assert right - left == bottom - top  # square, scaled to the model's image size
+        assert tile_frame.size == (512, 512)
+
+
+def test_small_frames_are_one_tile():
+    segments, _, _ = PixelFinder("tiled").tile(screen(300, 200), 512)
+    assert [box for _, box in segments] == [(0, 0, 200, 200), (100, 0, 300, 200)]
+
+
+@pytest.mark.parametrize("search_mode", ["single", "tiled", "two_pass"])
+def test_search_modes_answer_in_image_space(search_mode):
+    element = (700, 1500, 900, 1600)
+    finder = PixelFinder(search_mode)
+
+    answer = finder.find_element("OK button", "", screen(1080, 2400, element))
+
+    assert_close(answer, image_space(element, 1080, 2400), tolerance=3)
+
+
+def test_two_pass_refines_on_a_native_resolution_crop():
+    element = (500, 1000, 530, 1020)  # a few pixels on the coarse thumbnail
+    finder = PixelFinder("two_pass")
+
+    answer = finder.find_element("checkbox", "", screen(1080, 2400, element))
+
+    assert finder.segment_sizes == [(256, 256), (384, 384)]
+    assert_close(answer, image_space(element, 1080, 2400), tolerance=2)
+
+
+def test_two_pass_falls_back_to_the_full_image_when_the_thumbnail_misses():
+    element = (500, 1000, 504, 1004)  # vanishes on the 256 pixel thumbnail
+    finder = PixelFinder("two_pass")
+
+    answer = finder.find_element("dot", "", screen(1080, 2400, element))
+
+    assert finder.segment_sizes == [(256, 256), (512, 512)]
+    assert_close(answer, image_space(element, 1080, 2400), tolerance=2)
+
+
+def test_refine_crop_stays_inside_the_frame():
+    finder = PixelFinder("two_pass")
+    crop, crop_box = finder.refine_segment(screen(1000, 800), (0, 990, 10, 1000))
+    assert crop_box == (800, 0, 1000, 200)
+    assert crop.size == (384, 384)
+
+
+def test_to_frame_space():
+    frame = screen(1000, 500)
+    assert BaseFinder.to_frame_space((10, 20, 30, 40), frame, 100, 200) == (25, 200, 75, 400)
+
+
+def test_nothing_found_answers_zeros():
+    assert PixelFinder("tiled").find_element("OK", "", screen(600, 600)) == "0,0,0,0"
@@ -0,0 +1,87 @@
+import threading
+from concurrent.futures import ALL_COMPLETED
+
+import pytest
+
+from clickclickclick import hedge
+from clickclickclick.hedge import Hedger
+
+
+class Backend:
+    """Counts invocations, answering once `gate` is set (at once without a gate)."""
+
+    def __init__(self, answer="box", gate=None):
+        self.answer = answer
+        self.gate = gate
+        self.invocations = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.invocations += 1
+        if self.gate is not None:
+            assert self.gate.wait(5)
+        return self.answer
+
+
+@pytest.fixture
+def always_slow(monkeypatch):
+    """Every call outlasts the hedging delay, however fast it really is."""
+    real_wait = hedge.wait
+
+    def wait(futures, timeout=None, return_when=ALL_COMPLETED):
+        if timeout is not None:  # waiting out the hedging delay
+            return set(), set(futures)
+        return real_wait(futures, return_when=return_when)
+
+    monkeypatch.setattr(hedge, "wait", wait)
+
+
+def warmed_up(budget):
+    hedger = Hedger("test", budget=budget, min_samples=1)
+    hedger._record(0.01)
+    return hedger
+
+
+def test_no_hedging_before_enough_samples(always_slow):
+    hedger = Hedger("test", budget=1.0, min_samples=3)
+    backend = Backend()
+    for _ in range(3):
+        hedger.call(backend)
+    assert (backend.invocations, hedger.hedges_fired) == (3, 0)
+
+
+def test_budget_caps_duplicates_under_sustained_slowness(always_slow):
+    hedger = warmed_up(budget=0.1)
+    backend = Backend()
+    for _ in range(50):
+        assert hedger.call(backend) == "box"
+
+    assert hedger.hedges_fired == backend.invocations - 50 == 5
+
+
+def test_hedge_goes_to_the_secondary_backend(always_slow):
+    hedger = warmed_up(budget=1.0)
+    release = threading.Event()
+    primary, secondary = Backend("primary", gate=release), Backend("secondary")
+
+    assert hedger.call(primary, secondary) == "secondary"
+    release.set()
+    assert (primary.invocations, secondary.invocations) == (1, 1)
+    assert hedger.hedges_won == 1
+
+
+def test_losing_result_is_discarded(always_slow):
+    hedger = warmed_up(budget=1.0)
+    release, discarded = threading.Event(), threading.Event()
+    losers = []
+
+    def discard(result):
+        losers.append(result)
+        discarded.set()
+
+    primary = Backend("primary stream", gate=release)
+    assert hedger.call(primary, Backend("secondary stream"), discard) == "secondary stream"
+    release.set()
+    assert discarded.wait(5)
+    assert losers == ["primary stream"]
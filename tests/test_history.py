@@ -0,0 +1,70 @@
+from clickclickclick.planner.history import SUMMARY_LINE_CHARS, ChatHistory, estimate_tokens
+
+STEP = "x" * 396  # 100 estimated tokens
+
+
+def history(budget=1000, summary=300):
+    history = ChatHistory(budget, summary)
+    history.set_task("open the settings")
+    return history
+
+
+def texts(history):
+    return [turn.text for turn in history.turns()]
+
+
+def test_long_tasks_stay_within_the_budget():
+    chat = history()
+    for step in range(500):
+        chat.add("assistant" if step % 2 else "user", f"{step} {STEP}")
+        assert chat._recent_tokens <= 1000
+        assert chat._summary_tokens <= 300
+
+    assert chat.tokens() <= estimate_tokens("open the settings") + 1000 + 300
+    assert chat.summarized_turns == 500 - len(chat.recent)
+    assert "older turns omitted" in chat.summary_text()
+
+
+def test_turns_are_task_summary_recent_then_screen():
+    chat = history()
+    for step in range(11):
+        chat.add("user", f"{step} {STEP}")
+    chat.set_screen("frame", "the screen")
+
+    turns = texts(chat)
+    assert turns[0] == "open the settings"
+    assert turns[1].startswith("Summary of earlier steps:\nuser: 0 xxx")
+    assert turns[2].startswith(f"{11 - len(chat.recent)} ")
+    assert turns[-1] == "the screen" and chat.turns()[-1].image == "frame"
+
+
+def test_turns_are_folded_in_batches_to_keep_the_prefix_stable():
+    chat = history()
+    for step in range(11):
+        chat.add("user", f"{step} {STEP}")
+    prefix = texts(chat)[:3]
+
+    # room was made down to half the budget, the next steps only append
+    for step in range(4):
+        chat.add("assistant", f"next {STEP}")
+        assert texts(chat)[:3] == prefix
+
+
+def test_summary_lines_are_shortened():
+    chat = history(budget=10)
+    chat.add("user", "first " + "word " * 100)
+    chat.add("assistant", "second")
+
+    line = chat.summary[0]
+    assert line.startswith("user: first word") and line.endswith("...")
+    assert len(line) == len("user: ") + SUMMARY_LINE_CHARS
+
+
+def test_answered_screenshot_is_dropped():
+    chat = history()
+    chat.set_screen("old")
+    chat.set_screen("new")
+    assert [turn.image for turn in chat.turns()] == [None, "new"]
+
+    chat.add("assistant", "click")
+    assert chat.screen is None
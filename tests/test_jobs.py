@@ -0,0 +1,132 @@
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from clickclickclick.cancel import check_cancelled
+from clickclickclick.jobs import (
+    CANCELLED,
+    FAILED,
+    QUEUED,
+    RUNNING,
+    SUCCEEDED,
+    TIMED_OUT,
+    JobQueue,
+    QueueFull,
+)
+from clickclickclick.planner.task import execute_with_timeout
+
+
+@pytest.fixture
+def jobs():
+    return JobQueue(max_pending=2)
+
+
+def statuses(job):
+    return [event["event"] for event in job.events]
+
+
+@pytest.mark.parametrize(
+    "result, status", [(True, SUCCEEDED), (False, FAILED)], ids=["finished", "gave up"]
+)
+def test_task_outcome(jobs, result, status):
+    job = jobs.create("task")
+    assert jobs.run(job, lambda: result) is result
+    assert (job.status, job.result, job.error) == (status, result, None)
+    assert statuses(job) == [QUEUED, RUNNING, status]
+
+
+def test_task_raising_fails_the_job(jobs):
+    job = jobs.create("task")
+
+    def task():
+        raise RuntimeError("device gone")
+
+    with pytest.raises(RuntimeError):
+        jobs.run(job, task)
+    assert (job.status, job.error) == (FAILED, "device gone")
+
+
+def test_task_stopped_by_its_deadline_timed_out(jobs):
+    job = jobs.create("task", timeout=0.05)
+
+    def slow_task():
+        while True:
+            check_cancelled()
+            time.sleep(0.01)
+
+    assert (
+        jobs.run(job, lambda: execute_with_timeout(slow_task, None, cancel_token=job.token)) is None
+    )
+    assert job.status == TIMED_OUT and job.error
+
+
+def test_running_task_cancelled_by_the_client(jobs):
+    job = jobs.create("task")
+    started, stopped = threading.Event(), threading.Event()
+
+    def task():
+        started.set()
+        stopped.wait(5)
+        return None
+
+    worker = threading.Thread(target=jobs.run, args=(job, task))
+    worker.start()
+    assert started.wait(5)
+    assert job.status == RUNNING
+
+    jobs.cancel(job.id)
+    assert job.token.cancelled and job.status == RUNNING  # until the task has stopped
+    stopped.set()
+    worker.join(5)
+    assert (job.status, job.error) == (CANCELLED, "cancelled by the client")
+
+
+@pytest.mark.parametrize("timed_out, status", [(False, CANCELLED), (True, TIMED_OUT)])
+def test_queued_task_never_starts(jobs, timed_out, status):
+    job = jobs.create("task")
+    jobs.attach(job, Future())
+
+    jobs.cancel(job.id, timed_out=timed_out)
+
+    assert job.status == status and job.future.cancelled()
+    assert jobs.run(job, lambda: pytest.fail("a cancelled job ran")) is None
+    assert statuses(job) == [QUEUED, status]
+
+
+def test_finished_job_is_not_cancelled(jobs):
+    job = jobs.create("task")
+    jobs.run(job, lambda: True)
+    assert jobs.cancel(job.id).status == SUCCEEDED
+    assert jobs.cancel("unknown") is None
+
+
+def test_job_failing_before_it_ran(jobs):
+    job = jobs.create("task")
+    future = Future()
+    jobs.attach(job, future)
+
+    future.set_exception(RuntimeError("No healthy device after 30 retries"))
+    assert (job.status, job.error) == (FAILED, "No healthy device after 30 retries")
+
+
+def test_pending_jobs_are_bounded(jobs):
+    first = jobs.create("first")
+    jobs.create("second")
+    with pytest.raises(QueueFull):
+        jobs.create("third")
+
+    jobs.cancel(first.id)
+    jobs.create("third")
+    assert jobs.stats() == {"max_pending": 2, "jobs": {CANCELLED: 1, QUEUED: 2}}
+
+
+def test_finished_jobs_expire():
+    jobs = JobQueue(retention_seconds=60)
+    job = jobs.create("task")
+    jobs.run(job, lambda: True)
+    job.finished_at -= 61
+
+    jobs.create("next")
+    assert jobs.get(job.id) is None
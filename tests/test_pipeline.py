@@ -0,0 +1,65 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from clickclickclick.cancel import TaskCancelled, check_cancelled
+from clickclickclick.planner.pipeline import StageTimings, StepPipeline
+
+CALL = '{"prompt": "%s"'
+
+
+class Finder:
+    def __init__(self):
+        self.started = threading.Event()
+        self.stopped = threading.Event()
+
+    def find_element(self, prompt, observation, frame=None):
+        if prompt == "broken":
+            raise RuntimeError("finder down")
+        if prompt == "slow":
+            self.started.set()
+            try:
+                while True:
+                    check_cancelled()
+                    time.sleep(0.01)
+            except TaskCancelled:
+                self.stopped.set()
+                raise
+        return "1,2,3,4"
+
+
+@pytest.fixture
+def finder():
+    return Finder()
+
+
+@pytest.fixture
+def pipeline(finder):
+    config = SimpleNamespace(SETTLE_STABLE_MS=0, SETTLE_TIMEOUT_IN_SECONDS=0)
+    pipeline = StepPipeline(None, None, finder, config, StageTimings())
+    yield pipeline
+    pipeline.close()
+
+
+def test_prefetched_element_is_used(pipeline):
+    frame = object()
+    pipeline.on_partial("find_element_and_click", CALL % "OK", frame)
+    assert pipeline.take_element("OK", frame) == "1,2,3,4"
+    assert "finder_prefetch" in pipeline.timings.totals
+
+
+def test_stale_prefetch_is_stopped(pipeline, finder):
+    frame = object()
+    pipeline.on_partial("find_element_and_click", CALL % "slow", frame)
+    assert finder.started.wait(5)
+
+    assert pipeline.take_element("another element", frame) is None
+    assert finder.stopped.wait(5)
+
+
+def test_failed_prefetch_leaves_the_lookup_to_the_caller(pipeline):
+    frame = object()
+    pipeline.on_partial("find_element_and_click", CALL % "broken", frame)
+    assert pipeline.take_element("broken", frame) is None
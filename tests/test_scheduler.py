@@ -0,0 +1,100 @@
+import threading
+
+import pytest
+
+from clickclickclick.planner.scheduler import NoHealthyDevice, TaskScheduler
+
+
+class Pool:
+    """Device pool whose devices are attached by the test, every executor is its serial."""
+
+    def __init__(self, *serials):
+        self.attached = list(serials)
+        self.serials = []
+        self.unhealthy = set()
+        self.refreshes = 0
+
+    def refresh(self):
+        self.refreshes += 1
+        added = [serial for serial in self.attached if serial not in self.serials]
+        self.serials += added
+        return added
+
+    def executor(self, serial):
+        return serial
+
+    def is_healthy(self, serial):
+        return serial not in self.unhealthy
+
+
+@pytest.fixture
+def pool():
+    return Pool("first")
+
+
+@pytest.fixture
+def scheduler(pool):
+    scheduler = TaskScheduler(pool)
+    yield scheduler
+    scheduler.shutdown()
+
+
+def test_devices_attached_later_get_workers(pool, scheduler):
+    busy, release = threading.Event(), threading.Event()
+
+    def hold(serial):
+        busy.set()
+        assert release.wait(5)
+        return serial
+
+    held = scheduler.submit(hold)
+    assert busy.wait(5)
+
+    pool.attached.append("second")
+    scheduler.start_workers()
+    assert scheduler.submit(lambda serial: serial).result(5) == "second"
+    release.set()
+    assert held.result(5) == "first"
+
+
+def test_device_lookups_are_throttled(pool, scheduler):
+    refreshes = pool.refreshes
+    for _ in range(3):
+        scheduler.start_workers(max_age=60)
+    assert pool.refreshes == refreshes
+    scheduler.start_workers()
+    assert pool.refreshes == refreshes + 1
+
+
+def test_unhealthy_devices_hand_tasks_to_healthy_ones():
+    pool = Pool("first", "second")
+    pool.unhealthy.add("first")
+    scheduler = TaskScheduler(pool, health_retry_seconds=0.01)
+    try:
+        assert {scheduler.submit(lambda serial: serial).result(5) for _ in range(5)} == {"second"}
+    finally:
+        scheduler.shutdown()
+
+
+def test_task_fails_when_no_device_recovers(pool):
+    pool.unhealthy.add("first")
+    scheduler = TaskScheduler(pool, health_retry_seconds=0.01, max_health_retries=2)
+    try:
+        with pytest.raises(NoHealthyDevice):
+            scheduler.submit(lambda serial: pytest.fail("ran on an unhealthy device")).result(5)
+        assert scheduler.stats()["devices"][0]["healthy"] is False
+    finally:
+        scheduler.shutdown()
+
+
+def test_stats_count_finished_tasks(scheduler):
+    def fail(serial):
+        raise RuntimeError("device gone")
+
+    scheduler.submit(lambda serial: True).result(5)
+    with pytest.raises(RuntimeError):
+        scheduler.submit(fail).result(5)
+
+    (device,) = scheduler.stats()["devices"]
+    assert (device["completed"], device["failed"], device["busy"]) == (1, 1, False)
+    assert device["avg_task_seconds"] is not None
@@ -0,0 +1,105 @@
+import asyncio
+import json
+
+import pytest
+
+from clickclickclick.executor.threaded import ThreadedExecutor
+from clickclickclick.finder.threaded import ThreadedFinder
+from clickclickclick.planner.async_task import execute_action_plan_async
+from clickclickclick.planner.task import execute_action_plan
+from clickclickclick.planner.threaded import ThreadedPlanner
+
+
+class Device:
+    """Records what the executor, planner and finder were asked to do."""
+
+    IMAGE_WIDTH = IMAGE_HEIGHT = 100
+
+    def __init__(self):
+        self.calls = []
+        self.messages = []
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            self.calls.append((name, *args, *kwargs.values()))
+            return True
+
+        return call
+
+    def click_at_a_point(self, x, y, observation):
+        self.calls.append(("click_at_a_point", x, y))
+        return True
+
+    def find_element(self, prompt, observation, frame=None):
+        return "0,0,0,0" if prompt == "missing" else "10,20,30,40"
+
+    def scale_coordinates(self, coordinates):
+        return [value * 2 for value in coordinates]
+
+    def add_finder_message(self, message):
+        self.messages.append(message)
+
+    def task_finished(self, reason):
+        return True
+
+
+def action(function, **arguments):
+    return {"function": function, "arguments_json": json.dumps(arguments)}
+
+
+def run_sync(actions):
+    device = Device()
+    finished = execute_action_plan(actions, device, device, device, None)
+    return finished, device.calls, device.messages
+
+
+def run_async(actions):
+    device = Device()
+    finished = asyncio.run(
+        execute_action_plan_async(
+            actions,
+            ThreadedExecutor(device),
+            ThreadedPlanner(device),
+            ThreadedFinder(device),
+            None,
+        )
+    )
+    return finished, device.calls, device.messages
+
+
+PLANS = [
+    [
+        action("swipe_up", observation="up"),
+        action("find_element_and_click", prompt="OK", observation="ok"),
+    ],
+    [
+        action("find_element_and_click", prompt="missing", observation="-"),
+        action("swipe_up", observation="up"),
+    ],
+    [{"function": "swipe_up", "arguments_json": "not json"}],
+    [action("swipe_up", observation="up"), action("task_finished", reason="done")],
+]
+
+
+@pytest.mark.parametrize("actions", PLANS)
+def test_async_action_plan_behaves_like_the_sync_one(actions):
+    assert run_async(actions) == run_sync(actions)
+
+
+def test_action_plan_clicks_the_found_element():
+    finished, calls, messages = run_sync(PLANS[0])
+    assert not finished
+    assert calls == [("swipe_up", "up"), ("click_at_a_point", 20, 30)]
+    assert messages == [
+        "The UI bounds of the OK is 20,40,60,80 and it has been clicked ",
+        "Action plan completed, all 2 actions were run",
+    ]
+
+
+def test_action_plan_stops_at_a_missing_element():
+    finished, calls, messages = run_sync(PLANS[1])
+    assert (finished, calls) == (False, [])
+    assert messages == ["Action plan stopped at step 1: missing was not found on the screen"]